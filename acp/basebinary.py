@@ -2,6 +2,7 @@ import logging
 import os.path
 import struct
 import zlib
+from itertools import izip
 
 from Crypto.Cipher import AES
 
@@ -53,9 +54,14 @@ class Basebinary(object):
 	
 	header_size = _header_format.size
 	
+	# every chunk of the inner data is encrypted separately, starting from the same iv
+	_chunk_length = 0x8000
+	# chunks handed to a pool at once when streaming, bounds memory use
+	_pool_chunk_count = 16
+	
 	
 	@classmethod
-	def parse(cls, data):
+	def parse(cls, data, pool=None):
 		if len(data) < (cls.header_size + 4):
 			raise BasebinaryError("not enough data to parse")
 		
@@ -68,19 +74,85 @@ class Basebinary(object):
 		(byte_0x0F, model, version, byte_0x18, byte_0x19, byte_0x1A, flags, unk_0x1C) = cls.parse_header(header_data)
 		
 		if flags & 2:
-			inner_data = cls.decrypt(inner_data, model, byte_0x0F)
+			inner_data = cls.decrypt(inner_data, model, byte_0x0F, pool)
 		
 		#XXX: why is Python so shitty about this comparison <.<
-		checksum = cast_u32(zlib.adler32(header_data+inner_data))
+		checksum = cast_u32(zlib.adler32(inner_data, zlib.adler32(header_data)))
 		logging.debug("stored checksum     {0:#x}".format(stored_checksum))
 		logging.debug("calculated checksum {0:#x}".format(checksum))
-		logging.debug("data length         {0:#x}".format(len(header_data+inner_data)))
+		logging.debug("data length         {0:#x}".format(len(header_data) + len(inner_data)))
 		if stored_checksum != checksum:
 			raise BasebinaryError("bad checksum")
 			
 		return inner_data
 	
 	
+	@classmethod
+	def parse_stream(cls, infile, outfile, pool=None):
+		"""Verify a basebinary and write out its decrypted inner data, one chunk at a time
+		
+		Note:
+			The checksum can only be verified at the end, so outfile must be discarded if this raises
+		
+		Args:
+			infile (file): seekable basebinary file object, opened in binary mode
+			outfile (file): file object the inner data is written to
+			pool (multiprocessing.Pool): optional process or thread pool to decrypt chunks in parallel
+		
+		Returns:
+			size of the inner data
+		
+		Raises:
+			BasebinaryError
+		
+		"""
+		infile.seek(0, os.SEEK_END)
+		size = infile.tell()
+		if size < (cls.header_size + 4):
+			raise BasebinaryError("not enough data to parse")
+		
+		infile.seek(size - 4)
+		stored_checksum, = struct.unpack(">I", infile.read(4))
+		infile.seek(0)
+		header_data = infile.read(cls.header_size)
+		
+		(byte_0x0F, model, version, byte_0x18, byte_0x19, byte_0x1A, flags, unk_0x1C) = cls.parse_header(header_data)
+		
+		if flags & 2:
+			key, iv = cls._get_cipher_params(model, byte_0x0F)
+		
+		checksum = zlib.adler32(header_data)
+		inner_length = size - cls.header_size - 4
+		remaining_length = inner_length
+		group_count = cls._pool_chunk_count if pool is not None else 1
+		while remaining_length:
+			chunks = []
+			while remaining_length and len(chunks) < group_count:
+				chunk = infile.read(min(cls._chunk_length, remaining_length))
+				if len(chunk) != min(cls._chunk_length, remaining_length):
+					raise BasebinaryError("short read from input")
+				remaining_length -= len(chunk)
+				chunks.append(chunk)
+			
+			if flags & 2:
+				if pool is not None:
+					chunks = pool.map(_decrypt_chunk_worker, [(chunk, key, iv) for chunk in chunks])
+				else:
+					chunks = [cls.decrypt_chunk(chunk, key, iv) for chunk in chunks]
+			for chunk in chunks:
+				checksum = zlib.adler32(chunk, checksum)
+				outfile.write(chunk)
+		
+		checksum = cast_u32(checksum)
+		logging.debug("stored checksum     {0:#x}".format(stored_checksum))
+		logging.debug("calculated checksum {0:#x}".format(checksum))
+		logging.debug("data length         {0:#x}".format(cls.header_size + inner_length))
+		if stored_checksum != checksum:
+			raise BasebinaryError("bad checksum")
+		
+		return inner_length
+	
+	
 	@classmethod
 	def compose(cls, data):
 		#TODO
@@ -104,45 +176,49 @@ class Basebinary(object):
 	
 	
 	@classmethod
-	def decrypt(cls, data, model, byte_0x0F):
+	def _get_cipher_params(cls, model, byte_0x0F):
 		iv = cls._header_magic+chr(byte_0x0F)
 		key = _derive_key(model)
 		if key is None:
 			raise BasebinaryError("key missing for model {0}".format(model))
+		return key, iv
+	
+	
+	@classmethod
+	def decrypt(cls, data, model, byte_0x0F, pool=None):
+		"""Decrypt the inner data of a basebinary
 		
-		decrypted_data = ""
-		remaining_length = len(data)
-		chunk_length = 0x8000
-		while remaining_length:
-			if remaining_length > chunk_length:
-				decrypted_data   += cls.decrypt_chunk(data[-remaining_length:-(remaining_length-chunk_length)], key, iv)
-				remaining_length -= chunk_length
-			else:
-				decrypted_data   += cls.decrypt_chunk(data[-remaining_length:], key, iv)
-				remaining_length = 0
+		Args:
+			pool (multiprocessing.Pool): optional process or thread pool to decrypt chunks in parallel,
+			                             each chunk restarts CBC from the same iv so they are independent
+		
+		"""
+		key, iv = cls._get_cipher_params(model, byte_0x0F)
+		
+		chunk_length = cls._chunk_length
+		offsets = xrange(0, len(data), chunk_length)
+		jobs = ((data[offset:offset + chunk_length], key, iv) for offset in offsets)
+		if pool is not None:
+			decrypted_chunks = _map_in_groups(pool, _decrypt_chunk_worker, jobs, cls._pool_chunk_count)
+		else:
+			decrypted_chunks = (cls.decrypt_chunk(*job) for job in jobs)
+		
+		# chunks are copied into the output as they are produced
+		decrypted_data = bytearray(len(data))
+		for offset, decrypted_chunk in izip(offsets, decrypted_chunks):
+			decrypted_data[offset:offset + len(decrypted_chunk)] = decrypted_chunk
 		
-		return decrypted_data
+		return str(decrypted_data)
 	
 	
 	@classmethod
 	def decrypt_chunk(cls, encrypted_data, key, iv):
 		cipher = AES.new(key, AES.MODE_CBC, iv)
-		decrypted_data = ""
-		bytes_left = len(encrypted_data)
-		while bytes_left:
-			#logging.debug("bytes left: {0:#x}".format(bytes_left))
-			if bytes_left > 0x10:
-				decrypted_data += cipher.decrypt(encrypted_data[-bytes_left:-(bytes_left-0x10)])
-				bytes_left -= 0x10
-			elif bytes_left == 0x10:
-				decrypted_data += cipher.decrypt(encrypted_data[-bytes_left:])
-				bytes_left = 0
-			else: # bytes_left < 0x10
-				#LOL: odd-sized chunk at the end is left unencrypted
-				decrypted_data += encrypted_data[-bytes_left:]
-				bytes_left = 0
-		
-		return decrypted_data
+		#LOL: odd-sized chunk at the end is left unencrypted
+		aligned_length = len(encrypted_data) & ~0xF
+		if aligned_length == len(encrypted_data):
+			return cipher.decrypt(encrypted_data)
+		return cipher.decrypt(encrypted_data[:aligned_length]) + encrypted_data[aligned_length:]
 	
 	
 	@classmethod
@@ -158,3 +234,22 @@ class Basebinary(object):
 		gzdata = data[gzip_offset:]
 		
 		return zlib.decompress(gzdata, 16+zlib.MAX_WBITS)
+
+
+def _map_in_groups(pool, function, jobs, group_count):
+	# unlike pool.imap, this never queues more than group_count jobs at once
+	group = []
+	for job in jobs:
+		group.append(job)
+		if len(group) == group_count:
+			for result in pool.map(function, group):
+				yield result
+			group = []
+	if group:
+		for result in pool.map(function, group):
+			yield result
+
+
+def _decrypt_chunk_worker(job):
+	# module level so process pools can pickle it
+	return Basebinary.decrypt_chunk(*job)
@@ -1,7 +1,7 @@
-import logging
 import struct
-from collections import OrderedDict
-from math  import log
+from collections import Mapping, OrderedDict, Sequence
+from datetime import date, datetime, timedelta
+from itertools import chain
 from types import *
 
 
@@ -10,13 +10,30 @@ _footer_magic = "END!"
 _header_size = len(_header_magic)
 _footer_size = len(_footer_magic)
 
-def _lslice(data, length):
-	""" Slice object into two counting from the left
-	
-	Returns:
-		(left_slice, right_slice)
-	"""
-	return data[:length], data[length:]
+# packed int and real formats, keyed by size exponent
+_int_formats = {
+	0: struct.Struct(">B"),
+	1: struct.Struct(">H"),
+	2: struct.Struct(">I"),
+	3: struct.Struct(">Q"),
+	}
+_real_formats = {
+	2: struct.Struct(">f"),
+	3: struct.Struct(">d"),
+	}
+
+# largest value of each packed int size, keyed by size exponent
+_int_limits = [0xFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF]
+
+# largest finite single precision float
+_float_max = 3.4028234663852886e+38
+_float_inf = float("inf")
+
+# dates are stored as seconds relative to this
+_date_epoch = datetime(2001, 1, 1)
+
+# marks a dict frame that is waiting for its next key
+_no_key = object()
 
 
 class CFLBinaryPListComposeError(Exception):
@@ -28,107 +45,177 @@ class CFLBinaryPListParseError(Exception):
 	pass
 
 
+def _pack_int(obj, buf, object_marker=0x10):
+	""" Pack an int object, or a count following a 0xF object info nibble """
+	if obj < 0:
+		raise CFLBinaryPListComposeError("negative int values are not supported: {0}".format(obj))
+	for size_exponent in range(len(_int_limits)):
+		if obj <= _int_limits[size_exponent]:
+			buf.append(object_marker + size_exponent)
+			buf += _int_formats[size_exponent].pack(obj)
+			return
+	raise CFLBinaryPListComposeError("int value too large to pack: {0}".format(obj))
+
+def _pack_none(obj, buf):
+	buf += "\x00"
+
+def _pack_bool(obj, buf):
+	if not obj:
+		buf += "\x08"
+	else:
+		buf += "\x09"
+
+def _pack_float(obj, buf):
+	# single precision whenever the value fits, infinities and NaN included, as before; finite values too
+	# large for single precision used to fail to pack and now fall back to double precision
+	if not _float_max < abs(obj) < _float_inf:
+		buf.append(0x22)
+		buf += _real_formats[2].pack(obj)
+	else:
+		buf.append(0x23)
+		buf += _real_formats[3].pack(obj)
+
+def _pack_datetime(obj, buf):
+	# naive datetimes are taken to be UTC
+	if obj.utcoffset() is not None:
+		obj = obj.replace(tzinfo=None) - obj.utcoffset()
+	delta = obj - _date_epoch
+	buf.append(0x33)
+	buf += _real_formats[3].pack(delta.days * 86400.0 + delta.seconds + delta.microseconds / 1e6)
+
+def _pack_date(obj, buf):
+	_pack_datetime(datetime(obj.year, obj.month, obj.day), buf)
+
+def _pack_data(obj, buf):
+	data_len = len(obj)
+	if data_len < 0xF:
+		buf.append(0x40 + data_len)
+	else:
+		buf.append(0x4F)
+		_pack_int(data_len, buf)
+	buf += obj
+
+def _pack_memoryview(obj, buf):
+	_pack_data(obj.tobytes(), buf)
+
+def _pack_unicode(obj, buf):
+	buf += "\x70"
+	buf += obj.encode("utf-8")
+	buf += "\x00"
+
+def _pack_array(obj, buf):
+	buf += "\xA0"
+	return iter(obj)
+
+def _pack_dict(obj, buf):
+	buf += "\xD0"
+	return chain.from_iterable(obj.iteritems())
+
+
 class CFLBinaryPListComposer(object):
-	"""Write cflbinary format property list"""
+	"""Write cflbinary format property list
+	
+	Note:
+		Everything is packed into one shared output buffer, nested objects are handled with an explicit stack
+	"""
+	
+	# type -> encoder(obj, buf), which packs obj into buf and returns an iterator over the children of a
+	# container, or None; subclasses of a registered type use its encoder unless they have their own
+	_encoders = {
+		NoneType    : _pack_none,
+		BooleanType : _pack_bool,
+		IntType     : _pack_int,
+		LongType    : _pack_int,
+		FloatType   : _pack_float,
+		datetime    : _pack_datetime,
+		date        : _pack_date,
+		StringType  : _pack_data,
+		bytearray   : _pack_data,
+		BufferType  : _pack_data,
+		memoryview  : _pack_memoryview,
+		UnicodeType : _pack_unicode,
+		ListType    : _pack_array,
+		TupleType   : _pack_array,
+		#XXX: sets are packed as arrays, the set object type is not supported by the parser
+		set         : _pack_array,
+		frozenset   : _pack_array,
+		DictType    : _pack_dict,
+		}
+	
+	# exact type -> encoder, filled in as types are first seen
+	_resolved_encoders = {}
+	
+	# packed form of small immutable objects that are composed over and over, like common keys
+	_memo_types = frozenset([BooleanType, IntType, LongType, StringType, UnicodeType])
+	_memo_max_entries = 0x1000
+	_memo_max_size = 0x100
+	_memo = {}
 	
 	@classmethod
-	def _pack_object(cls, obj):
-		""" Pack a supported Python built-in object
+	def register_encoder(cls, object_type, encoder):
+		""" Add or replace the encoder for a type and its subclasses
 		
-		Note:
-			this function is super hacky and needs to be fixed
+		Args:
+			object_type (type): type handled by encoder
+			encoder (callable): called as encoder(obj, buf), must append the packed object to the bytearray buf
+			                    and return None, or an iterator over its children for a container object
+		"""
+		# registering on a subclass must not change its parent
+		if "_encoders" not in cls.__dict__:
+			cls._encoders = dict(cls._encoders)
+		cls._encoders[object_type] = encoder
+		cls._resolved_encoders = {}
+		cls._memo = {}
+	
+	@classmethod
+	def _resolve_encoder(cls, object_type):
+		for base in object_type.__mro__:
+			encoder = cls._encoders.get(base)
+			if encoder is not None:
+				break
+		else:
+			raise CFLBinaryPListComposeError("unsupported Python built-in type: {0}".format(object_type))
+		
+		if "_resolved_encoders" not in cls.__dict__:
+			cls._resolved_encoders = {}
+		cls._resolved_encoders[object_type] = encoder
+		return encoder
+	
+	@classmethod
+	def _pack_object(cls, obj, buf):
+		""" Pack a supported Python object into buf
 		
 		Returns:
-			data
+			iterator over the children of a container, which the caller packs and terminates, otherwise None
 		
 		Raises:
 			CFLBinaryPListComposeError
 		"""
-		data = ""
-		
 		object_type = type(obj)
 		
-		if	 object_type == NoneType:
-			data += "\x00"
-		
-		elif object_type == BooleanType:
-			if not obj:
-				data += "\x08"
-			else:
-				data += "\x09"
-		
-		elif object_type == IntType:
-			object_marker = 0x10
-			buf = ""
-			#XXX: need to actually catch unsupported packed sizes
-			for fmt in [">B", ">H", ">I", ">Q"]:
-				try:
-					buf = struct.pack(fmt, obj)
-				except struct.error:
-					logging.debug("XXX: skipping {0}".format(fmt))
-					pass
-				else:
-					break
-			
-			object_marker += int(log(len(buf), 2))
-			
-			data += chr(object_marker)
-			data += buf
-		
-		elif object_type == FloatType:
-			object_marker = 0x20
-			buf = ""
-			#XXX: need to actually catch unsupported packed sizes
-			for fmt in ["!f", "!d"]:
-				try:
-					buf = struct.pack(fmt, obj)
-				except struct.error:
-					logging.debug("XXX: skipping {0}".format(fmt))
-					pass
-				else:
-					break
-			
-			object_marker += int(log(len(buf), 2))
-			
-			data += chr(object_marker)
-			data += buf
-		
-		#XXX: DateType?
-		
-		elif object_type == StringType:
-			object_marker = 0x40
-			data_len = len(obj)
-			if data_len < 0xF:
-				object_marker += data_len
-				data += chr(object_marker)
-			else:
-				object_marker += 0xF
-				data += chr(object_marker)
-				data += cls._pack_object(data_len)
-			data += obj
-		
-		elif object_type == UnicodeType:
-			data += "\x70"
-			data += obj.encode("utf-8")
-			data += "\x00"
-		
-		elif object_type == ListType:
-			data += "\xA0"
-			for element in obj:
-				data += cls._pack_object(element)
-			data += "\x00"
-		
-		elif object_type in [DictType, OrderedDict]:
-			data += "\xD0"
-			for k, v in obj.iteritems():
-				data += cls._pack_object(k)
-				data += cls._pack_object(v)
-			data += "\x00"
-		
+		if object_type in cls._memo_types:
+			memo_key = (object_type, obj)
+			packed = cls._memo.get(memo_key)
+			if packed is not None:
+				buf += packed
+				return None
 		else:
-			raise CFLBinaryPListComposeError("unsupported Python built-in type: {0}".format(type(obj)))
-		
-		return data
+			memo_key = None
+		
+		encoder = cls._resolved_encoders.get(object_type)
+		if encoder is None:
+			encoder = cls._resolve_encoder(object_type)
+		
+		if memo_key is None:
+			return encoder(obj, buf)
+		
+		start = len(buf)
+		encoder(obj, buf)
+		if len(buf) - start <= cls._memo_max_size:
+			if "_memo" not in cls.__dict__ or len(cls._memo) >= cls._memo_max_entries:
+				cls._memo = {}
+			cls._memo[memo_key] = str(buf[start:])
+		return None
 	
 	@classmethod
 	def compose(cls, object):
@@ -140,154 +227,166 @@ class CFLBinaryPListComposer(object):
 		Raises:
 			CFLBinaryPListComposeError
 		"""
-		data =  _header_magic
+		buf = bytearray(_header_magic)
+		
 		# assume one root object
-		data += cls._pack_object(object)
-		data += _footer_magic
-		return data
+		stack = []
+		children = cls._pack_object(object, buf)
+		if children is not None:
+			stack.append(children)
+		
+		while stack:
+			for child in stack[-1]:
+				children = cls._pack_object(child, buf)
+				if children is not None:
+					stack.append(children)
+					break
+			else:
+				# all children packed, terminate the container
+				buf += "\x00"
+				stack.pop()
+		
+		buf += _footer_magic
+		return str(buf)
 
 
 class CFLBinaryPListParser(object):
-	"""Read cflbinary format property list"""
+	"""Read cflbinary format property list
+	
+	Note:
+		Objects are unpacked from the whole plist data at an offset instead of from slices of it
+	"""
+	
+	# default limits, so a malformed or hostile plist cannot exhaust memory
+	max_depth = 512
+	max_objects = 0x400000
 	
 	@classmethod
-	def _unpack_int(cls, size_exponent, data):
+	def _unpack_int(cls, size_exponent, data, offset):
 		""" Unpack an int object as a Python int from the provided data
 		
 		Returns:
-			(int, remaining_data)
+			(int, next_offset)
 		
 		Raises:
 			CFLBinaryPListParseError
 		"""
-		int_size = 2**size_exponent
-		int_bytes, data = _lslice(data, int_size)
 		#XXX: are these supposed to be signed or unsigned?
-		if int_size == 1:
-			int_fmt = ">B"
-		elif int_size == 2:
-			int_fmt = ">H"
-		elif int_size == 4:
-			int_fmt = ">I"
-		elif int_size == 8:
-			int_fmt = ">Q"
-		else:
-			raise CFLBinaryPListParseError("unsupported int packed object size of {0} bytes")
+		int_format = _int_formats.get(size_exponent)
+		if int_format is None:
+			raise CFLBinaryPListParseError("unsupported int packed object size of {0} bytes".format(2**size_exponent))
 		
 		try:
-			(int_val, ) = struct.unpack(int_fmt, int_bytes)
+			(int_val, ) = int_format.unpack_from(data, offset)
 		except struct.error:
 			raise CFLBinaryPListParseError("failed to unpack int value")
 		
-		return int_val, data
+		return int_val, offset + int_format.size
 	
 	@classmethod
-	def _unpack_real(cls, size_exponent, data):
+	def _unpack_real(cls, size_exponent, data, offset):
 		""" Unpack a real object as a Python float from the provided data
 		
 		Returns:
-			(float, remaining_data)
+			(float, next_offset)
 		
 		Raises:
 			CFLBinaryPListParseError
 		"""
-		real_size = 2**size_exponent
-		real_bytes, data = _lslice(data, real_size)
-		if   real_size == 4:
-			real_fmt = ">f"
-		elif real_size == 8:
-			real_fmt = ">d"
-		else:
-			raise CFLBinaryPListParseError("unsupported real packed object size of {0} bytes")
+		real_format = _real_formats.get(size_exponent)
+		if real_format is None:
+			raise CFLBinaryPListParseError("unsupported real packed object size of {0} bytes".format(2**size_exponent))
 		
 		try:
-			(float_val, ) = struct.unpack(real_fmt, real_bytes)
+			(float_val, ) = real_format.unpack_from(data, offset)
 		except struct.error:
 			raise CFLBinaryPListParseError("failed to unpack float value")
 		
-		return float_val, data
+		return float_val, offset + real_format.size
 	
 	@classmethod
-	def _unpack_count(cls, object_info, data):
+	def _unpack_count(cls, object_info, data, offset):
 		""" Unpack count from object info nibble and/or packed int value
 		
 		Returns:
-			(count, remaining_data)
+			(count, next_offset)
 		
 		Raises:
 			CFLBinaryPListParseError
 		"""
 		if object_info == 0x0F:
 			# count is the following packed int object
-			marker, data = cls._unpack_object_marker(data)
+			marker, offset = cls._unpack_object_marker(data, offset)
 			count_object_type = marker & 0xF0
 			count_object_info = marker & 0x0F
 			if count_object_type != 0x10:
 				raise CFLBinaryPListParseError("expected count to be a packed int object")
-			count, data = cls._unpack_int(count_object_info, data)
-		else:
-			count = object_info
+			return cls._unpack_int(count_object_info, data, offset)
 		
-		return count, data
+		return object_info, offset
 	
 	@classmethod
-	def _unpack_object_marker(cls, data):
+	def _unpack_object_marker(cls, data, offset):
 		""" Unpack an object marker from the provided data
 		
 		Returns:
-			(marker, remaining_data)
+			(marker, next_offset)
 		
 		Raises:
 			CFLBinaryPListParseError
 		"""
-		marker_byte, data = _lslice(data, 1)
 		try:
-			(marker, ) = struct.unpack(">B", marker_byte)
-		except struct.error:
+			return ord(data[offset]), offset + 1
+		except IndexError:
 			raise CFLBinaryPListParseError("failed to unpack object marker")
-		
-		return marker, data
 	
 	@classmethod
-	def _unpack_object(cls, data):
+	def _unpack_object(cls, data, offset):
 		""" Unpack an object from the provided data
 		
+		Note:
+			Arrays and dicts are returned empty, positioned at their first child
+		
 		Returns:
-			(obj, remaining_data)
+			(obj, next_offset)
 		
 		Raises:
 			CFLBinaryPListParseError
 		"""
-		obj = None
-		
-		marker, data = cls._unpack_object_marker(data)
+		marker, offset = cls._unpack_object_marker(data, offset)
 		object_type = marker & 0xF0
 		object_info = marker & 0x0F
 		
 		if object_type == 0x00:
 			if object_info == 0x00:   # null, null object
-				return None, data
+				return None, offset
 			elif object_info == 0x08: # bool, false
-				return False, data
+				return False, offset
 			elif object_info == 0x09: # bool, true
-				return True, data
+				return True, offset
 			else:
 				raise CFLBinaryPListParseError("unsupported object info value for object type 0x00: {0:#x}".format(object_info))
 		
 		elif object_type == 0x10:     # int, big-endian
-			return cls._unpack_int(object_info, data)
+			return cls._unpack_int(object_info, data, offset)
 		
 		elif object_type == 0x20:     # real, big-endian
-			return cls._unpack_real(object_info, data)
+			return cls._unpack_real(object_info, data, offset)
 		
-		elif object_type == 0x30:     # date
+		elif object_type == 0x30:     # date, big-endian double seconds since 2001-01-01 UTC
 			#XXX: not sure if this is actually used
-			raise CFLBinaryPListParseError("date support not implemented")
+			if object_info != 0x03:
+				raise CFLBinaryPListParseError("unsupported object info value for date object: {0:#x}".format(object_info))
+			seconds, offset = cls._unpack_real(object_info, data, offset)
+			return _date_epoch + timedelta(seconds=seconds), offset
 		
 		elif object_type == 0x40:     # data
-			size, data = cls._unpack_count(object_info, data)
+			size, offset = cls._unpack_count(object_info, data, offset)
+			end = offset + size
+			if end > len(data):
+				raise CFLBinaryPListParseError("data object extends past end of plist")
 			#XXX: we return data as str type, is this ok?
-			return _lslice(data, size)
+			return data[offset:end], end
 		
 		elif object_type == 0x50:     # string, ASCII
 			raise CFLBinaryPListParseError("ASCII string support not implemented")
@@ -296,27 +395,18 @@ class CFLBinaryPListParser(object):
 			raise CFLBinaryPListParseError("Unicode string support not implemented")
 		
 		elif object_type == 0x70:     # string, UTF8, NULL terminated
-			raw = ""
-			while True:
-				byte, data = _lslice(data, 1)
-				if byte == "\x00":
-					break
-				raw += byte
+			end = data.find("\x00", offset)
+			if end == -1:
+				raise CFLBinaryPListParseError("unterminated UTF-8 string object")
 			#XXX: what exceptions could we get here?
-			obj = raw.decode("utf-8")
-			return obj, data
+			return data[offset:end].decode("utf-8"), end + 1
 		
 		elif object_type == 0x80:      # uid
 			raise CFLBinaryPListParseError("uid support not implemented")
 		
 		elif object_type == 0xA0:      # array
-			obj = []
-			while True:
-				element, data = cls._unpack_object(data)
-				if element == None:
-					break
-				obj.append(element)
-			return obj, data
+			# elements are filled in by _unpack_object_tree
+			return [], offset
 		
 		elif object_type == 0xB0:      # ordset
 			raise CFLBinaryPListParseError("ordset support not implemented")
@@ -325,50 +415,552 @@ class CFLBinaryPListParser(object):
 			raise CFLBinaryPListParseError("set support not implemented")
 		
 		elif object_type == 0xD0:      # dict
-			keys = []
-			values = []
-			while True:
-				key, data = cls._unpack_object(data)
-				if key == None:
-					break
-				keys.append(key)
-				
-				value, data = cls._unpack_object(data)
-				values.append(value)
-			
-			obj = OrderedDict()
-			for i in range(len(keys)):
-				obj[keys[i]] = values[i]
-			
-			return obj, data
+			# items are filled in by _unpack_object_tree
+			return OrderedDict(), offset
 		
 		else:
 			raise CFLBinaryPListParseError("unsupported object type: {0:#x}".format(object_type))
 	
 	@classmethod
-	def parse(cls, data):
+	def _skip_object(cls, data, offset):
+		""" Find the end of an object without unpacking its value
+		
+		Note:
+			Arrays and dicts are skipped to their first child, like _unpack_object
+		
+		Returns:
+			(marker, next_offset)
+		
+		Raises:
+			CFLBinaryPListParseError
+		"""
+		marker, next_offset = cls._unpack_object_marker(data, offset)
+		object_type = marker & 0xF0
+		object_info = marker & 0x0F
+		
+		if object_type in (0xA0, 0xD0) or (object_type == 0x00 and object_info in (0x00, 0x08, 0x09)):
+			return marker, next_offset
+		
+		if object_type == 0x10 and object_info in _int_formats:
+			next_offset += _int_formats[object_info].size
+		elif object_type == 0x20 and object_info in _real_formats:
+			next_offset += _real_formats[object_info].size
+		elif object_type == 0x30 and object_info == 0x03:
+			next_offset += _real_formats[object_info].size
+		elif object_type == 0x40:
+			size, next_offset = cls._unpack_count(object_info, data, next_offset)
+			next_offset += size
+		elif object_type == 0x70:
+			next_offset = data.find("\x00", next_offset) + 1
+			if not next_offset:
+				raise CFLBinaryPListParseError("unterminated UTF-8 string object")
+		else:
+			# let the unpacker report the problem
+			return marker, cls._unpack_object(data, offset)[1]
+		
+		if next_offset > len(data):
+			raise CFLBinaryPListParseError("object extends past end of plist")
+		return marker, next_offset
+	
+	@classmethod
+	def _skip_object_tree(cls, data, offset, max_depth):
+		""" Find the end of an object and all of its children without unpacking any values
+		
+		Returns:
+			next_offset
+		
+		Raises:
+			CFLBinaryPListParseError
+		"""
+		# one [is_dict, expecting_key] frame per open container
+		stack = []
+		while True:
+			marker, offset = cls._skip_object(data, offset)
+			
+			if stack:
+				frame = stack[-1]
+				if marker == 0x00 and (not frame[0] or frame[1]):
+					stack.pop()
+				elif frame[0]:
+					frame[1] = not frame[1]
+			
+			if marker in (0xA0, 0xD0):
+				if len(stack) >= max_depth:
+					raise CFLBinaryPListParseError("plist nesting is deeper than {0} levels".format(max_depth))
+				stack.append([marker == 0xD0, True])
+			
+			if not stack:
+				return offset
+	
+	@classmethod
+	def _unpack_object_tree(cls, data, offset, max_depth, max_objects):
+		""" Unpack an object and all of its children without recursion
+		
+		Containers are added to their parent as soon as they start and filled in place, tracked by
+		an explicit stack of [container, is_dict, pending_key] frames.
+		
+		Returns:
+			(obj, next_offset)
+		
+		Raises:
+			CFLBinaryPListParseError
+		"""
+		stack = []
+		object_count = 0
+		while True:
+			obj, offset = cls._unpack_object(data, offset)
+			object_count += 1
+			if object_count > max_objects:
+				raise CFLBinaryPListParseError("plist has more than {0} objects".format(max_objects))
+			
+			obj_type = type(obj)
+			is_container = obj_type is list or obj_type is OrderedDict
+			
+			if not stack:
+				root = obj
+			else:
+				frame = stack[-1]
+				if not frame[1]:
+					if obj is None:
+						stack.pop()
+					else:
+						frame[0].append(obj)
+				elif frame[2] is _no_key:
+					if obj is None:
+						stack.pop()
+					elif is_container:
+						raise CFLBinaryPListParseError("unsupported container used as dict key")
+					else:
+						frame[2] = obj
+				else:
+					frame[0][frame[2]] = obj
+					frame[2] = _no_key
+			
+			if is_container:
+				if len(stack) >= max_depth:
+					raise CFLBinaryPListParseError("plist nesting is deeper than {0} levels".format(max_depth))
+				stack.append([obj, obj_type is OrderedDict, _no_key])
+			
+			if not stack:
+				return root, offset
+	
+	@classmethod
+	def parse(cls, data, max_depth=None, max_objects=None):
 		""" Parse plist data into equivalent Python built-in object type
 		
+		Args:
+			max_depth (int): maximum container nesting, defaults to max_depth of the class
+			max_objects (int): maximum number of objects, defaults to max_objects of the class
+		
 		Returns:
 			obj
 		
 		Raises:
 			CFLBinaryPListParseError
 		"""
+		if max_depth is None:
+			max_depth = cls.max_depth
+		if max_objects is None:
+			max_objects = cls.max_objects
+		
 		# bail now if there isn't enough data for header, footer, and at least one object
 		if len(data) < (_header_size + _footer_size + 1):
 			raise CFLBinaryPListParseError("not enough data to parse")
 		
-		header_data, data = _lslice(data, _header_size)
-		if header_data != _header_magic:
+		if data[:_header_size] != _header_magic:
 			raise CFLBinaryPListParseError("bad header magic")
 		
 		# read object stream (assume one root object)
-		obj, remaining_data = cls._unpack_object(data)
-		if len(remaining_data) > _footer_size:
+		obj, offset = cls._unpack_object_tree(data, _header_size, max_depth, max_objects)
+		if len(data) - offset > _footer_size:
 			raise CFLBinaryPListParseError("extra data found after unpacking root object")
 		
-		if remaining_data != _footer_magic:
+		if data[offset:] != _footer_magic:
 			raise CFLBinaryPListParseError("bad footer magic")
 		
 		return obj
+	
+	@classmethod
+	def parse_lazy(cls, data):
+		""" Parse plist data on demand
+		
+		Note:
+			Only the header is checked up front, the rest of the data is validated as it is accessed
+		
+		Returns:
+			CFLBinaryPListDictView or CFLBinaryPListArrayView for a container root object, otherwise the object
+		
+		Raises:
+			CFLBinaryPListParseError
+		"""
+		if len(data) < (_header_size + _footer_size + 1):
+			raise CFLBinaryPListParseError("not enough data to parse")
+		
+		if data[:_header_size] != _header_magic:
+			raise CFLBinaryPListParseError("bad header magic")
+		
+		return _view_object(data, _header_size)
+
+
+def _view_object(data, offset):
+	""" Get a lazy view for a container object, or the unpacked value of any other object """
+	marker, child_offset = CFLBinaryPListParser._unpack_object_marker(data, offset)
+	if marker == 0xD0:
+		return CFLBinaryPListDictView(data, offset)
+	if marker == 0xA0:
+		return CFLBinaryPListArrayView(data, offset)
+	return CFLBinaryPListParser._unpack_object(data, offset)[0]
+
+
+class _CFLBinaryPListContainerView(object):
+	"""Common parts of the lazy container views
+	
+	Child offsets are indexed in one pass on first access, without unpacking any values. Accessed values
+	are unpacked and cached, containers come back as further views.
+	"""
+	
+	# dicts index values by key, arrays by position
+	_keyed = False
+	
+	def __init__(self, data, offset):
+		self._data = data
+		self._offset = offset
+		self._index = None
+		self._cache = {}
+	
+	def _index_children(self):
+		index = OrderedDict() if self._keyed else []
+		offset = self._offset + 1
+		while True:
+			if self._keyed:
+				key, offset = CFLBinaryPListParser._unpack_object(self._data, offset)
+				if key == None:
+					return index
+				if type(key) in (list, OrderedDict):
+					raise CFLBinaryPListParseError("unsupported container used as dict key")
+				index[key] = offset
+			else:
+				marker, next_offset = CFLBinaryPListParser._skip_object(self._data, offset)
+				if marker == 0x00:
+					return index
+				index.append(offset)
+			offset = CFLBinaryPListParser._skip_object_tree(self._data, offset, CFLBinaryPListParser.max_depth)
+	
+	def _get_index(self):
+		if self._index is None:
+			self._index = self._index_children()
+		return self._index
+	
+	def _get_cached(self, index_key, value_offset):
+		try:
+			return self._cache[index_key]
+		except KeyError:
+			value = self._cache[index_key] = _view_object(self._data, value_offset)
+			return value
+	
+	def lookup(self, path):
+		""" Look up a nested value by a sequence of dict keys and array indices
+		
+		Returns:
+			the value, which is a view if it is a container
+		
+		Raises:
+			KeyError, IndexError
+		"""
+		obj = self
+		for key in path:
+			obj = obj[key]
+		return obj
+	
+	def to_object(self):
+		""" Unpack the whole container into Python built-in objects """
+		return CFLBinaryPListParser._unpack_object_tree(self._data, self._offset, CFLBinaryPListParser.max_depth, CFLBinaryPListParser.max_objects)[0]
+
+
+class CFLBinaryPListDictView(_CFLBinaryPListContainerView, Mapping):
+	"""Lazy read-only view of a dict object in cflbinary plist data"""
+	
+	_keyed = True
+	
+	def __getitem__(self, key):
+		return self._get_cached(key, self._get_index()[key])
+	
+	def __contains__(self, key):
+		# Mapping.__contains__ would unpack the value
+		return key in self._get_index()
+	
+	def __iter__(self):
+		return iter(self._get_index())
+	
+	def __len__(self):
+		return len(self._get_index())
+	
+	def __repr__(self):
+		return "<{0} of {1} keys at {2:#x}>".format(type(self).__name__, len(self), self._offset)
+
+
+class CFLBinaryPListArrayView(_CFLBinaryPListContainerView, Sequence):
+	"""Lazy read-only view of an array object in cflbinary plist data"""
+	
+	def __getitem__(self, i):
+		index = self._get_index()
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(len(index)))]
+		if i < 0:
+			i += len(index)
+		if not 0 <= i < len(index):
+			raise IndexError("array view index out of range")
+		return self._get_cached(i, index[i])
+	
+	def __len__(self):
+		return len(self._get_index())
+	
+	def __repr__(self):
+		return "<{0} of {1} elements at {2:#x}>".format(type(self).__name__, len(self), self._offset)
+
+
+class CFLBinaryPListHandler(object):
+	"""Receiver for CFLBinaryPListIncrementalParser events, override the ones of interest"""
+	
+	def start_dict(self):
+		pass
+	
+	def end_dict(self):
+		pass
+	
+	def start_array(self):
+		pass
+	
+	def end_array(self):
+		pass
+	
+	def key(self, key):
+		pass
+	
+	def value(self, value):
+		pass
+
+
+class CFLBinaryPListObjectBuilder(CFLBinaryPListHandler):
+	"""Handler that builds the equivalent Python built-in objects as events arrive"""
+	
+	def __init__(self):
+		self.result = None
+		self._stack = []
+		self._key = None
+	
+	def _add(self, obj):
+		if not self._stack:
+			self.result = obj
+		elif type(self._stack[-1]) is list:
+			self._stack[-1].append(obj)
+		else:
+			self._stack[-1][self._key] = obj
+	
+	def start_dict(self):
+		obj = OrderedDict()
+		self._add(obj)
+		self._stack.append(obj)
+	
+	def end_dict(self):
+		self._stack.pop()
+	
+	def start_array(self):
+		obj = []
+		self._add(obj)
+		self._stack.append(obj)
+	
+	def end_array(self):
+		self._stack.pop()
+	
+	def key(self, key):
+		self._key = key
+	
+	def value(self, value):
+		self._add(value)
+
+
+class CFLBinaryPListIncrementalParser(object):
+	"""Push-style cflbinary format property list reader
+	
+	Data is fed in arbitrary chunks as it arrives and turned into events on a CFLBinaryPListHandler, so
+	parsing overlaps with I/O and only the object currently being received has to be buffered.
+	"""
+	
+	def __init__(self, handler=None, max_depth=None, max_objects=None):
+		"""
+		Args:
+			handler (CFLBinaryPListHandler): event receiver, defaults to a new CFLBinaryPListObjectBuilder
+			max_depth (int): maximum container nesting, defaults to CFLBinaryPListParser.max_depth
+			max_objects (int): maximum number of objects, defaults to CFLBinaryPListParser.max_objects
+		"""
+		self.handler = handler if handler is not None else CFLBinaryPListObjectBuilder()
+		self.max_depth = max_depth if max_depth is not None else CFLBinaryPListParser.max_depth
+		self.max_objects = max_objects if max_objects is not None else CFLBinaryPListParser.max_objects
+		
+		# unparsed input, joined only once enough has arrived to make progress
+		self._chunks = []
+		self._chunks_size = 0
+		self._needed_size = _header_size
+		
+		self._state = "header"
+		# one [is_dict, expecting_key] frame per open container
+		self._stack = []
+		self._object_count = 0
+	
+	@classmethod
+	def _object_end(cls, data, offset):
+		""" Find the end of the object at offset, without its children
+		
+		Returns:
+			end offset, which is past the end of data if more is needed, or None if it is not known yet
+		
+		Raises:
+			CFLBinaryPListParseError
+		"""
+		if offset >= len(data):
+			return None
+		marker = ord(data[offset])
+		object_type = marker & 0xF0
+		object_info = marker & 0x0F
+		offset += 1
+		
+		if object_type == 0x40 and object_info == 0x0F:
+			if offset >= len(data):
+				return None
+			count_marker = ord(data[offset])
+			if count_marker & 0xF0 != 0x10 or count_marker & 0x0F not in _int_formats:
+				raise CFLBinaryPListParseError("expected count to be a packed int object")
+			count_format = _int_formats[count_marker & 0x0F]
+			if offset + 1 + count_format.size > len(data):
+				return None
+			(size, ) = count_format.unpack_from(data, offset + 1)
+			end = offset + 1 + count_format.size + size
+		elif object_type == 0x40:
+			end = offset + object_info
+		elif object_type == 0x10 and object_info in _int_formats:
+			end = offset + _int_formats[object_info].size
+		elif object_type == 0x20 and object_info in _real_formats:
+			end = offset + _real_formats[object_info].size
+		elif object_type == 0x30 and object_info == 0x03:
+			end = offset + _real_formats[object_info].size
+		elif object_type == 0x70:
+			end = data.find("\x00", offset) + 1
+			if not end:
+				return None
+		else:
+			# the remaining supported objects are a bare marker, let the unpacker reject the others
+			return CFLBinaryPListParser._unpack_object(data, offset - 1)[1]
+		
+		return end
+	
+	def _parse_objects(self, data, offset):
+		""" Emit events for the complete objects in data
+		
+		Returns:
+			offset of the first unparsed byte
+		"""
+		handler = self.handler
+		stack = self._stack
+		while True:
+			end = self._object_end(data, offset)
+			if end is None or end > len(data):
+				# remember how much has to be buffered before it is worth trying again
+				self._needed_size = end - offset if end is not None else len(data) - offset + 1
+				return offset
+			
+			obj, offset = CFLBinaryPListParser._unpack_object(data, offset)
+			self._object_count += 1
+			if self._object_count > self.max_objects:
+				raise CFLBinaryPListParseError("plist has more than {0} objects".format(self.max_objects))
+			
+			frame = stack[-1] if stack else None
+			obj_type = type(obj)
+			
+			if obj is None and frame is not None and (not frame[0] or frame[1]):
+				stack.pop()
+				if frame[0]:
+					handler.end_dict()
+				else:
+					handler.end_array()
+			
+			elif obj_type is list or obj_type is OrderedDict:
+				if frame is not None and frame[0]:
+					if frame[1]:
+						raise CFLBinaryPListParseError("unsupported container used as dict key")
+					frame[1] = True
+				if len(stack) >= self.max_depth:
+					raise CFLBinaryPListParseError("plist nesting is deeper than {0} levels".format(self.max_depth))
+				if obj_type is OrderedDict:
+					stack.append([True, True])
+					handler.start_dict()
+				else:
+					stack.append([False, False])
+					handler.start_array()
+			
+			elif frame is not None and frame[0] and frame[1]:
+				frame[1] = False
+				handler.key(obj)
+			
+			else:
+				if frame is not None and frame[0]:
+					frame[1] = True
+				handler.value(obj)
+			
+			if not stack:
+				self._state = "footer"
+				self._needed_size = _footer_size
+				return offset
+	
+	def feed(self, data):
+		""" Parse the next chunk of plist data
+		
+		Raises:
+			CFLBinaryPListParseError
+		"""
+		if not data:
+			return
+		if self._state == "done":
+			raise CFLBinaryPListParseError("extra data found after footer")
+		
+		self._chunks.append(data)
+		self._chunks_size += len(data)
+		if self._chunks_size < self._needed_size:
+			return
+		
+		data = "".join(self._chunks)
+		offset = 0
+		
+		if self._state == "header":
+			if data[:_header_size] != _header_magic:
+				raise CFLBinaryPListParseError("bad header magic")
+			offset = _header_size
+			self._state = "objects"
+		
+		if self._state == "objects":
+			offset = self._parse_objects(data, offset)
+		
+		if self._state == "footer" and len(data) - offset >= _footer_size:
+			if data[offset:] != _footer_magic:
+				raise CFLBinaryPListParseError("bad footer magic")
+			offset = len(data)
+			self._state = "done"
+		
+		remaining = data[offset:]
+		self._chunks = [remaining] if remaining else []
+		self._chunks_size = len(remaining)
+		if self._state == "footer":
+			self._needed_size = _footer_size
+	
+	def close(self):
+		""" Finish parsing
+		
+		Returns:
+			the result of the handler if it has one, like CFLBinaryPListObjectBuilder
+		
+		Raises:
+			CFLBinaryPListParseError
+		"""
+		if self._state != "done":
+			raise CFLBinaryPListParseError("plist data ended early")
+		return getattr(self.handler, "result", None)
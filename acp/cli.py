@@ -9,7 +9,10 @@ from collections import OrderedDict
 from .basebinary import *
 from .client import ACPClient
 from .exception import *
+from .fanout import fan_out
 from .property import ACPProperty
+from .propertybatch import ACPPropertyBatch
+from .snapshot import ACPSnapshotWriter
 
 
 class _ArgParser(argparse.ArgumentParser):
@@ -75,11 +78,37 @@ def _cmd_setprop(client, args):
 
 def _cmd_dumpprop(client, unused):
 	prop_names = ACPProperty.get_supported_property_names()
-	properties = client.get_properties(prop_names)
+	try:
+		properties = client.get_properties_batched(prop_names)
+	except ACPReplyError as e:
+		print e
+		return
 	for prop in properties:
 		padded_description = ACPProperty.get_property_info_string(prop.name, "description").ljust(32, " ")
 		print "{0}: {1}".format(padded_description, prop)
 
+def _cmd_snapshot(targets, password, args):
+	outpath = args.pop()
+	prop_names = ACPProperty.get_supported_property_names()
+	
+	def dump(client):
+		# small requests, like dumpprop, so one rejected request does not lose every property
+		batch = ACPPropertyBatch()
+		for i in range(0, len(prop_names), 32):
+			try:
+				client.get_property_batch(prop_names[i:i+32], batch)
+			except ACPReplyError as e:
+				logging.error("{0}: {1!s}".format(client.target, e))
+		return batch
+	
+	with ACPSnapshotWriter(outpath) as snapshot:
+		for result in fan_out(targets, dump, password):
+			if result.error is not None:
+				logging.error("failed to dump properties of {0}: {1!s}".format(result.target, result.error))
+				continue
+			snapshot.add_batch(result.value)
+	print "Wrote {0} properties of {1} routers to {2}".format(len(snapshot), len(snapshot.targets), outpath)
+
 def _cmd_acpprop(client, unused):
 	props_reply = client.get_properties(["prop"])
 	props_raw = props_reply[0].value
@@ -102,10 +131,8 @@ def _cmd_factory_reset(client, unused):
 def _cmd_flash_primary(client, args):
 	fw_path = args.pop()
 	if os.path.exists(fw_path):
-		with open(fw_path, "rb") as fw_file:
-			fw_data = fw_file.read()
 		print "Flashing primary firmware partition"
-		client.flash_primary(fw_data)
+		client.flash_primary_stream(fw_path)
 	else:
 		logging.error("Basebinary not readable at path: {0}".format(fw_path))
 
@@ -115,16 +142,14 @@ def _cmd_do_feat_command(client, unused):
 def _cmd_decrypt(args):
 	(inpath, outpath) = args
 	with open(inpath, "rb") as infile:
-		indata = infile.read()
-	
-	#XXX: lazy, fixme
-	try:
-		outdata = Basebinary.parse(indata)
-	except BasebinaryError:
-		raise
-	else:
-		with open(outpath, "wb") as outfile:
-			outfile.write(outdata)
+		outfile = open(outpath, "wb")
+		try:
+			with outfile:
+				Basebinary.parse_stream(infile, outfile)
+		except:
+			# the output is written before the checksum can be verified, don't leave it behind
+			os.remove(outpath)
+			raise
 
 def _cmd_extract(args):
 	(inpath, outpath) = args
@@ -153,7 +178,7 @@ def main():
 	parser = _ArgParser()
 	
 	parameters_group = parser.add_argument_group("AirPort client parameters")
-	parameters_group.add_argument("-t", "--target", metavar="address", help="IP address or hostname of the target router")
+	parameters_group.add_argument("-t", "--target", metavar="address", help="IP address or hostname of the target router, comma separated for --snapshot")
 	parameters_group.add_argument("-p", "--password", metavar="password", help="router admin password")
 	
 	airport_client_group = parser.add_argument_group("AirPort client commands")
@@ -162,6 +187,7 @@ def main():
 	airport_client_group.add_argument("--getprop", metavar="property", nargs=1, help="get the value of the specified property")
 	airport_client_group.add_argument("--setprop", metavar=("property", "value"), nargs=2, help="set the value of the specified property")
 	airport_client_group.add_argument("--dumpprop", action="store_const", const=True, help="dump values of all supported properties")
+	airport_client_group.add_argument("--snapshot", metavar="outpath", nargs=1, help="dump all supported properties of every target into a snapshot file")
 	airport_client_group.add_argument("--acpprop", action="store_const", const=True, help="get acp acpprop list")
 	airport_client_group.add_argument("--dump-syslog", action="store_const", const=True, help="dump the router system log")
 	airport_client_group.add_argument("--reboot", action="store_const", const=True, help="reboot device")
@@ -185,6 +211,7 @@ def main():
 		"getprop": "remote_admin",
 		"setprop": "remote_admin",
 		"dumpprop": "remote_admin",
+		"snapshot": "remote_admin_multi",
 		"acpprop": "remote_admin",
 		"dump_syslog": "remote_admin",
 		"reboot": "remote_admin",
@@ -206,7 +233,7 @@ def main():
 	elif len(command_args) == 1:
 		#TODO: clean this up a bit
 		cmd, arg = command_args.popitem()
-		assert commands[cmd] in ["local", "remote_noauth", "remote_admin"], "unknown command type \"{0}\"".format(commands[cmd])
+		assert commands[cmd] in ["local", "remote_noauth", "remote_admin", "remote_admin_multi"], "unknown command type \"{0}\"".format(commands[cmd])
 		cmd_handler_name = "_cmd_{0}".format(cmd)
 		cmd_handler = globals().get(cmd_handler_name, _cmd_not_implemented)
 		
@@ -230,6 +257,12 @@ def main():
 				c.close()
 			else:
 				logging.error("must specify a target and administrator password")
+		
+		if commands[cmd] == "remote_admin_multi":
+			if target is not None and password is not None:
+				cmd_handler([t.strip() for t in target.split(",") if t.strip()], password, arg)
+			else:
+				logging.error("must specify targets and administrator password")
 				
 	else:
 		logging.error("multiple commands not supported, choose only one")
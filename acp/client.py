@@ -3,13 +3,22 @@ import os
 import struct
 import time
 
-from .cflbinary import CFLBinaryPListComposer, CFLBinaryPListParser
+from .cflbinary import CFLBinaryPListComposer, CFLBinaryPListIncrementalParser
+from .exception import ACPClientError, ACPReplyError
 from .message import ACPMessage
 from .property import ACPProperty
-from .session import ACPClientSession
+from .propertybatch import ACPPropertyBatch
+from .session import ACP_SERVER_PORT, ACPClientSession
 
 
 class ACPClient(object):
+	# chunk size for handing large property values to a sink, must fit the session receive buffer
+	_sink_chunk_size = 0x8000
+	# getprop reply error codes for a request with a name the router does not know or with too many names,
+	# after which get_properties_batched splits the batch; device codes are undocumented, these are the
+	# server emulator's
+	getprop_split_error_codes = frozenset([-10, -11])
+	
 	def __init__(self, target, password=""):
 		self.target = target
 		self.password = password
@@ -17,8 +26,8 @@ class ACPClient(object):
 		self.session = ACPClientSession(target, password)
 	
 	
-	def connect(self):
-		self.session.connect()
+	def connect(self, port=ACP_SERVER_PORT, timeout=None, connect_timeout=None):
+		self.session.connect(port, timeout, connect_timeout)
 	
 	
 	def close(self):
@@ -29,8 +38,30 @@ class ACPClient(object):
 		self.session.send(data)
 	
 	
-	def recv(self, size):
-		return self.session.recv(size)
+	def recv(self, size, timeout=0, first_byte_timeout=None):
+		return self.session.recv(size, timeout, first_byte_timeout)
+	
+	
+	def recv_plist(self, size, handler=None):
+		"""Receive a cflbinary plist message body, parsing it while it arrives
+		
+		Args:
+			size (int): body size from the message header
+			handler (CFLBinaryPListHandler): event receiver, by default the plist is built into Python objects
+		
+		Returns:
+			the parsed object, or the result of handler
+		
+		"""
+		parser = CFLBinaryPListIncrementalParser(handler)
+		remaining_size = size
+		while remaining_size:
+			chunk = self.session.recv_view(min(remaining_size, self._sink_chunk_size))
+			if not len(chunk):
+				break
+			parser.feed(chunk.tobytes())
+			remaining_size -= len(chunk)
+		return parser.close()
 	
 	
 	def recv_message_header(self):
@@ -41,58 +72,249 @@ class ACPClient(object):
 		return self.recv(ACPProperty.element_header_size)
 	
 	
-	def get_properties(self, prop_names=[]):
+	def recv_property_element_header_fields(self):
+		"""Receive and unpack a property element header straight from the session receive buffer
+		
+		Returns:
+			(name, flags, size)
+		
+		"""
+		return ACPProperty.parse_raw_element_header(self.session.recv_view(ACPProperty.element_header_size))
+	
+	
+	def iter_property_elements(self, prop_names=[], sink=None, sink_threshold=0x10000):
+		"""Request properties and yield the raw reply elements as soon as each one is received
+		
+		Note:
+			If iteration is abandoned early, the remaining elements are read and discarded so the
+			connection stays usable
+		
+		Args:
+			prop_names (list): names of the properties to request
+			sink (callable): called as sink(name, chunk) with memoryview chunks of large cfb and log values,
+			                 which are then not kept in memory; chunks are only valid during the call
+			sink_threshold (int): values larger than this many bytes are handed to sink
+		
+		Yields:
+			(name, flags, data), where data is the raw value, the packed error code if flags & 1 is set,
+			or None if the value was handed to sink
+		
+		Raises:
+			ACPReplyError if the router rejected the whole request
+		
+		"""
+		self._send_getprop_request(prop_names)
+		
+		raw_reply = self.recv_message_header()
+		reply_header = ACPMessage.parse_raw(raw_reply)
+		
+		if reply_header.error_code != 0:
+			raise ACPReplyError("get_properties error code: {0:#x}".format(reply_header.error_code), reply_header.error_code)
+		
+		elements = self._iter_getprop_reply_elements(sink, sink_threshold)
+		try:
+			for element in elements:
+				yield element
+		finally:
+			elements.close()
+	
+	
+	def _send_getprop_request(self, prop_names):
 		# request property by sending name and "null" value
-		payload = ""
-		for name in prop_names:
-			payload += ACPProperty.compose_raw_element(0, ACPProperty(name))
+		props = [ACPProperty(name) for name in prop_names]
+		payload = ACPProperty.compose_raw_elements([(prop.name, 0, prop.value) for prop in props])
 		
 		request = ACPMessage.compose_getprop_command(4, self.password, payload)
 		self.send(request)
+	
+	
+	def _iter_getprop_reply_elements(self, sink=None, sink_threshold=0x10000):
+		"""Yield the raw elements of a getprop reply whose header has already been received
+		
+		Note:
+			The rest of an abandoned reply is drained when the generator is closed, which can happen during
+			garbage collection, so a failure to drain it is logged and closes the connection instead of raising
+		
+		"""
+		discard = False
+		try:
+			while True:
+				name, flags, size = self.recv_property_element_header_fields()
+				if logging.getLogger().isEnabledFor(logging.DEBUG):
+					logging.debug("element name {0!r} flags {1:#x} size {2:#x}".format(name, flags, size))
+				
+				if (sink is not None or discard) and not flags & 1 and size > sink_threshold and \
+				   ACPProperty.get_property_info_string(name, "type") in ["cfb", "log"]:
+					remaining_size = size
+					while remaining_size:
+						chunk = self.session.recv_view(min(remaining_size, self._sink_chunk_size))
+						if not len(chunk):
+							raise ACPClientError("connection closed while receiving property \"{0}\"".format(name))
+						if not discard:
+							sink(name, chunk)
+						remaining_size -= len(chunk)
+					prop_data = None
+				else:
+					prop_data = self.recv(size)
+				
+				#XXX: this is still a bit ugly
+				if name == ACPProperty.null_name and prop_data == ACPProperty.null_value:
+					logging.debug("found empty prop end marker")
+					break
+				
+				if discard:
+					continue
+				
+				try:
+					yield name, flags, prop_data
+				except GeneratorExit:
+					discard = True
+		except Exception as e:
+			if not discard:
+				raise
+			logging.error("closing connection to {0}, failed to drain an abandoned getprop reply: {1!s}".format(self.target, e))
+			self.close()
+	
+	
+	def iter_properties(self, prop_names=[], sink=None, sink_threshold=0x10000):
+		"""Request properties and yield each ACPProperty as soon as its element is received
+		
+		Properties that could not be read are reported and skipped, as is the whole request if the router
+		rejects it. Properties whose value was handed to sink are yielded with a value of None. See
+		iter_property_elements for the arguments.
+		
+		"""
+		try:
+			for name, flags, prop_data in self.iter_property_elements(prop_names, sink, sink_threshold):
+				if flags & 1:
+					(error_code, ) = struct.unpack(">I", prop_data)
+					print "error requesting value for property \"{0}\": {1:#x}".format(name, error_code)
+					continue
+				
+				#XXX: should we should yield dict(name=name, prop=ACPProperty(name, value)) instead?
+				yield ACPProperty(name, prop_data)
+		except ACPReplyError as e:
+			logging.error(str(e))
+	
+	
+	def get_properties(self, prop_names=[]):
+		return list(self.iter_properties(prop_names))
+	
+	
+	def get_property_batch(self, prop_names=[], batch=None):
+		"""Request properties into a columnar ACPPropertyBatch instead of ACPProperty objects
 		
-		raw_reply = self.recv_message_header()
-		reply_header = ACPMessage.parse_raw(raw_reply)
+		Args:
+			prop_names (list): names of the properties to request
+			batch (ACPPropertyBatch): batch to append to, so one batch can collect many routers
+		
+		Returns:
+			the batch, with one record per returned element including those with error flags
+		
+		Raises:
+			ACPReplyError if the router rejected the whole request
+		
+		"""
+		if batch is None:
+			batch = ACPPropertyBatch()
+		for name, flags, prop_data in self.iter_property_elements(prop_names):
+			batch.add(self.target, name, flags, prop_data)
+		return batch
+	
+	
+	def _recv_getprop_reply(self):
+		"""Receive a whole getprop reply
+		
+		Returns:
+			(error_code, elements), where elements is a list of raw (name, flags, data) tuples
 		
+		"""
+		reply_header = ACPMessage.parse_raw(self.recv_message_header())
 		if reply_header.error_code != 0:
-			print "get_properties error code: {0:#x}".format(reply_header.error_code)
-			#XXX: blah, what to do...
-			return []
-		
-		props = []
-		while True:
-			prop_header = self.recv_property_element_header()
-			name, flags, size = ACPProperty.parse_raw_element_header(prop_header)
-			logging.debug("name  ".format(name))
-			logging.debug("flags ".format(flags))
-			logging.debug("size  ".format(size))
-			
-			prop_data = self.recv(size)
-			logging.debug("prop_data {0!r}".format(prop_data))
-			
-			if flags & 1:
-				(error_code, ) = struct.unpack(">I", prop_data)
-				print "error requesting value for property \"{0}\": {1:#x}".format(name, error_code)
-				continue
-			
-			prop = ACPProperty(name, prop_data)
-			logging.debug("prop {0!r}".format(prop))
+			return reply_header.error_code, []
+		return 0, list(self._iter_getprop_reply_elements())
+	
+	
+	def get_properties_batched(self, prop_names=[], batch_size=32, pipeline=False):
+		"""Request a large set of properties as several smaller getprop requests on one connection
+		
+		Batches the router rejects with one of getprop_split_error_codes are split in half and retried,
+		and properties it flags as failed are retried once each on their own, so one bad name does not
+		lose the others. Any other rejection, like a wrong password, applies to every request and ends
+		the fetch.
+		
+		Args:
+			prop_names (list): names of the properties to request
+			batch_size (int): maximum number of names per request
+			pipeline (bool): send all requests of a round before reading any of the replies
+		
+		Returns:
+			list of ACPProperty in the order of prop_names, properties that could not be read are left out
+		
+		Raises:
+			ACPReplyError if the router rejected a request for any other reason than its names
+		
+		"""
+		values = {}
+		failed_names = []
+		request_count = 0
+		
+		pending = [prop_names[i:i+batch_size] for i in range(0, len(prop_names), batch_size)]
+		while pending:
+			replies = []
+			if pipeline:
+				for batch in pending:
+					self._send_getprop_request(batch)
+				for batch in pending:
+					replies.append(self._recv_getprop_reply())
+			else:
+				for batch in pending:
+					self._send_getprop_request(batch)
+					replies.append(self._recv_getprop_reply())
+					if replies[-1][0] != 0 and replies[-1][0] not in self.getprop_split_error_codes:
+						break
+			request_count += len(replies)
 			
-			#XXX: this is still a bit ugly
-			if prop.name is None and prop.value is None:
-				logging.debug("found empty prop end marker")
-				break
+			# only raised once every reply that was sent is received, so the connection stays usable
+			for error_code, elements in replies:
+				if error_code != 0 and error_code not in self.getprop_split_error_codes:
+					raise ACPReplyError("get_properties error code: {0:#x}".format(error_code), error_code)
 			
-			#XXX: should we should return dict(name=name, prop=ACPProperty(name, value)) instead?
-			props.append(prop)
+			rejected = []
+			for batch, (error_code, elements) in zip(pending, replies):
+				if error_code != 0:
+					if len(batch) > 1:
+						logging.debug("batch of {0} properties rejected with {1:#x}, splitting".format(len(batch), error_code))
+						half = len(batch) // 2
+						rejected.extend([batch[:half], batch[half:]])
+					else:
+						print "get_properties error code: {0:#x}".format(error_code)
+					continue
+				
+				for name, flags, prop_data in elements:
+					if flags & 1:
+						# retried on its own below, unless it already was
+						if len(batch) > 1:
+							failed_names.append(name)
+						else:
+							(error_code, ) = struct.unpack(">I", prop_data)
+							print "error requesting value for property \"{0}\": {1:#x}".format(name, error_code)
+						continue
+					values[name] = prop_data
 			
-		return props
+			pending = rejected
+			if not pending and failed_names:
+				pending = [[name] for name in failed_names]
+				failed_names = []
+		
+		logging.debug("fetched {0} of {1} properties in {2} requests".format(len(values), len(prop_names), request_count))
+		return [ACPProperty(name, values[name]) for name in prop_names if name in values]
 	
 	
 	def set_properties(self, props_dict={}):
-		payload = ""
 		for name, prop in props_dict.iteritems():
 			logging.debug("prop: {0!r}".format(prop))
-			payload += ACPProperty.compose_raw_element(0, prop)
+		payload = ACPProperty.compose_raw_elements([(prop.name, 0, prop.value) for prop in props_dict.itervalues()])
 		request = ACPMessage.compose_setprop_command(0, self.password, payload)
 		self.send(request)
 		
@@ -104,8 +326,7 @@ class ACPClient(object):
 			#XXX: blah, what to do...
 			return
 		
-		prop_header = self.recv_property_element_header()
-		name, flags, size = ACPProperty.parse_raw_element_header(prop_header)
+		name, flags, size = self.recv_property_element_header_fields()
 		logging.debug("name  {0!r}".format(name))
 		logging.debug("flags {0!r}".format(flags))
 		logging.debug("size  {0!r}".format(size))
@@ -117,7 +338,7 @@ class ACPClient(object):
 			(error_code, ) = struct.unpack(">I", prop_data)
 			print "error setting value for property \"{0}\": {1:#x}".format(name, error_code)
 			return
-			
+		
 		prop = ACPProperty(name, prop_data)
 		logging.debug("prop {0!r}".format(prop))
 		
@@ -131,9 +352,7 @@ class ACPClient(object):
 		
 		reply_header = ACPMessage.parse_raw(self.recv_message_header())
 		
-		reply = self.recv(reply_header.body_size)
-		
-		return CFLBinaryPListParser.parse(reply)
+		return self.recv_plist(reply_header.body_size)
 	
 	
 	def flash_primary(self, payload):
@@ -144,6 +363,53 @@ class ACPClient(object):
 		return self.recv(reply_header.body_size)
 	
 	
+	def flash_primary_stream(self, fw, chunk_size=0x10000, progress=None):
+		"""Flash the primary partition without holding the firmware image in memory
+		
+		The image is read twice, once to checksum it and once to send it in chunks.
+		
+		Args:
+			fw (str or file): path of the basebinary, or a seekable file object opened in binary mode
+			chunk_size (int): size of the reads and sends
+			progress (callable): called as progress(sent_size, total_size, elapsed) after each chunk
+		
+		Returns:
+			reply body
+		
+		"""
+		if isinstance(fw, basestring):
+			with open(fw, "rb") as fw_file:
+				return self.flash_primary_stream(fw_file, chunk_size, progress)
+		
+		begin = fw.tell()
+		body_size = 0
+		body_checksum = 1
+		for chunk in iter(lambda: fw.read(chunk_size), ""):
+			body_checksum = ACPMessage.compute_body_checksum([chunk], body_checksum)
+			body_size += len(chunk)
+		fw.seek(begin)
+		
+		self.send(ACPMessage.compose_flash_primary_header(0, self.password, body_size, body_checksum))
+		
+		start_time = time.time()
+		sent_size = 0
+		while sent_size < body_size:
+			chunk = fw.read(min(chunk_size, body_size - sent_size))
+			if not chunk:
+				raise ACPClientError("firmware image shrank while it was being sent")
+			self.send(chunk)
+			sent_size += len(chunk)
+			if progress is not None:
+				progress(sent_size, body_size, time.time() - start_time)
+		
+		elapsed = time.time() - start_time
+		logging.info("sent {0:#x} bytes of firmware in {1:.2f}s ({2:.1f} KiB/s)".format(body_size, elapsed, body_size / 1024.0 / max(elapsed, 1e-6)))
+		
+		reply_header = ACPMessage.parse_raw(self.recv_message_header())
+		
+		return self.recv(reply_header.body_size)
+	
+	
 	def authenticate_AppleSRP(self):
 		#XXX: STILL TESTING SHIT
 		import ctypes
@@ -166,9 +432,7 @@ class ACPClient(object):
 			return
 		
 		logging.debug("recv_size: {0}".format(reply_header.body_size))
-		raw_message = self.recv(reply_header.body_size)
-		logging.debug("raw_message: {0!r}".format(raw_message))
-		params1 = CFLBinaryPListParser.parse(raw_message)
+		params1 = self.recv_plist(reply_header.body_size)
 		logging.debug(params1)
 		
 		n = params1[u"modulus"]
@@ -202,7 +466,7 @@ class ACPClient(object):
 		client_gen_pubkey = client_gen_pubkey_ptr.contents
 		logging.debug(client_gen_pubkey)
 		#logging.debug(asrp.contents)
-
+		
 		# set password
 		logging.debug("SRP_set_auth_password: {0}".format(AppleSRP.SRP_set_auth_password(asrp, self.password, len(self.password))))
 		#logging.debug(asrp.contents)
@@ -240,11 +504,9 @@ class ACPClient(object):
 			return
 		
 		logging.debug("recv_size: {0}".format(reply_header.body_size))
-		raw_message = self.recv(reply_header.body_size)
-		logging.debug("raw_message: {0!r}".format(raw_message))
-		params2 = CFLBinaryPListParser.parse(raw_message)
+		params2 = self.recv_plist(reply_header.body_size)
 		logging.debug(params2)
-	
+		
 		server_proof = params2[u"response"]
 		server_iv = params2[u"iv"]
 		
@@ -0,0 +1,192 @@
+import hashlib
+import pprint
+import struct
+import threading
+from collections import namedtuple, OrderedDict
+
+from .cflbinary import CFLBinaryPListParseError, CFLBinaryPListParser
+from .exception import ACPPropertyError
+from .property import ACPProperty
+
+
+"""One difference between two values of a property
+
+path is a tuple of dict keys and list indices into a cfb value, empty for other property types
+kind is "added", "removed" or "changed", old or new is None for added and removed paths
+"""
+ACPPropertyDiff = namedtuple("ACPPropertyDiff", ["path", "kind", "old", "new"])
+
+"""A property value that differs from the cached one
+
+value is the formatted value, diffs is a list of ACPPropertyDiff, empty the first time a property is seen
+"""
+ACPPropertyChange = namedtuple("ACPPropertyChange", ["target", "name", "value", "diffs"])
+
+
+def _diff_values(old, new, path=()):
+	"""Diff two parsed cfb values by key path"""
+	if isinstance(old, dict) and isinstance(new, dict):
+		diffs = []
+		for key in old:
+			if key not in new:
+				diffs.append(ACPPropertyDiff(path + (key, ), "removed", old[key], None))
+			else:
+				diffs.extend(_diff_values(old[key], new[key], path + (key, )))
+		for key in new:
+			if key not in old:
+				diffs.append(ACPPropertyDiff(path + (key, ), "added", None, new[key]))
+		return diffs
+	
+	if isinstance(old, list) and isinstance(new, list):
+		diffs = []
+		for i in range(min(len(old), len(new))):
+			diffs.extend(_diff_values(old[i], new[i], path + (i, )))
+		for i in range(len(new), len(old)):
+			diffs.append(ACPPropertyDiff(path + (i, ), "removed", old[i], None))
+		for i in range(len(old), len(new)):
+			diffs.append(ACPPropertyDiff(path + (i, ), "added", None, new[i]))
+		return diffs
+	
+	if type(old) != type(new) or old != new:
+		return [ACPPropertyDiff(path, "changed", old, new)]
+	return []
+
+
+class ACPDeltaCache(object):
+	"""Bounded cache of the last raw value of every (target, property) pair
+	
+	Small raw values and cfb values are kept and compared as they are, other values by size and SHA-1
+	digest, so unchanged values are never parsed or formatted. Entries of all targets share one LRU order.
+	
+	Memory use is bounded by entry count and by bytes. An entry costs _entry_overhead bytes plus the
+	formatted value, or for cfb properties the raw value, which is parsed again only to diff it against a
+	changed value. Digests and small raw values count too.
+	
+	"""
+	
+	# raw values up to this size are kept instead of a digest
+	_inline_size = 0x40
+	# rough per-entry cost of the key, entry tuple and dict slot
+	_entry_overhead = 0x100
+	
+	def __init__(self, max_entries=0x10000, max_bytes=0x4000000):
+		"""
+		Args:
+			max_entries (int): number of (target, property) values kept before the least recently used is evicted
+			max_bytes (int): approximate memory kept before the least recently used values are evicted
+		
+		"""
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		
+		self._lock = threading.Lock()
+		# (target, name) -> (size, raw value or digest, formatted value or None, raw cfb value or None, cost)
+		self._entries = OrderedDict()
+		self._bytes = 0
+		
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+	
+	
+	def __len__(self):
+		return len(self._entries)
+	
+	
+	def update(self, target, name, data):
+		"""Check a raw property value against the cached one and cache it
+		
+		A value that fails to parse leaves the cached one in place.
+		
+		Args:
+			target (str): router the value came from
+			name (str): property name
+			data (str): raw element value
+		
+		Returns:
+			None if the value is unchanged, otherwise an ACPPropertyChange
+		
+		Raises:
+			ACPPropertyError if a changed value is invalid for the property
+		
+		"""
+		key = (target, name)
+		size = len(data)
+		is_cfb = ACPProperty.get_property_info_string(name, "type") == "cfb"
+		# cfb values are kept raw for diffing, so they are compared as they are whatever their size
+		fingerprint = data if is_cfb or size <= self._inline_size else hashlib.sha1(data).digest()
+		
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry[0] == size and entry[1] == fingerprint:
+				# reinsert to mark as most recently used
+				del self._entries[key]
+				self._entries[key] = entry
+				self.hits += 1
+				return None
+			self.misses += 1
+		
+		# parse and format outside the lock, only for changed values
+		diffs = []
+		try:
+			if is_cfb:
+				prop = ACPProperty(name, data)
+				parsed = CFLBinaryPListParser.parse(prop.value)
+				value = pprint.pformat(parsed)
+				if entry is not None:
+					diffs = _diff_values(CFLBinaryPListParser.parse(entry[3]), parsed)
+			else:
+				value = str(ACPProperty(name, data))
+				if entry is not None:
+					diffs = [ACPPropertyDiff((), "changed", entry[2], value)]
+		except (CFLBinaryPListParseError, struct.error, ValueError, OverflowError) as e:
+			raise ACPPropertyError("malformed value for property \"{0}\": {1!s}".format(name, e))
+		
+		if is_cfb:
+			new_entry = (size, fingerprint, None, data, self._entry_overhead + size)
+		else:
+			new_entry = (size, fingerprint, value, None, self._entry_overhead + len(fingerprint) + len(value))
+		
+		with self._lock:
+			self._remove_locked(key)
+			self._entries[key] = new_entry
+			self._bytes += new_entry[4]
+			while len(self._entries) > self.max_entries or (self._bytes > self.max_bytes and len(self._entries) > 1):
+				evicted_key, evicted_entry = self._entries.popitem(last=False)
+				self._bytes -= evicted_entry[4]
+				self.evictions += 1
+		
+		return ACPPropertyChange(target, name, value, diffs)
+	
+	
+	def _remove_locked(self, key):
+		entry = self._entries.pop(key, None)
+		if entry is not None:
+			self._bytes -= entry[4]
+	
+	
+	def invalidate(self, target, name=None):
+		"""Forget the cached value of one property of a target, or of all its properties"""
+		with self._lock:
+			if name is not None:
+				self._remove_locked((target, name))
+				return
+			for key in [key for key in self._entries if key[0] == target]:
+				self._remove_locked(key)
+	
+	
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._bytes = 0
+	
+	
+	def stats(self):
+		with self._lock:
+			lookups = self.hits + self.misses
+			return dict(hits=self.hits,
+			            misses=self.misses,
+			            evictions=self.evictions,
+			            entries=len(self._entries),
+			            bytes=self._bytes,
+			            hit_rate=float(self.hits) / lookups if lookups else 0.0)
@@ -10,6 +10,14 @@ class ACPClientError(ACPError):
 	pass
 
 
+class ACPReplyError(ACPClientError):
+	"""Exception raised when the router replies to a request with an error code"""
+	
+	def __init__(self, message, error_code):
+		ACPClientError.__init__(self, message)
+		self.error_code = error_code
+
+
 class ACPCommandLineError(ACPError):
 	"""Exception raised for command line invocation errors"""
 	pass
@@ -24,3 +32,38 @@ class ACPPropertyError(ACPError):
 	"""Exception raised for errors processing ACP properties"""
 	pass
 
+
+class ACPSessionError(ACPError):
+	"""Exception raised for errors on an ACP session connection"""
+	pass
+
+
+class ACPTimeoutError(ACPSessionError):
+	"""Base class for ACP session deadline expiry"""
+	pass
+
+
+class ACPConnectTimeoutError(ACPTimeoutError):
+	"""Exception raised when connecting to the target takes too long"""
+	pass
+
+
+class ACPFirstByteTimeoutError(ACPTimeoutError):
+	"""Exception raised when no reply data arrives before the first byte deadline"""
+	pass
+
+
+class ACPRecvTimeoutError(ACPTimeoutError):
+	"""Exception raised when a receive does not complete before its total deadline or the socket timeout"""
+	pass
+
+
+class ACPSendTimeoutError(ACPTimeoutError):
+	"""Exception raised when a send does not complete before the socket timeout"""
+	pass
+
+
+class ACPDeadlineError(ACPTimeoutError):
+	"""Exception raised when an operation on a target does not finish before its overall deadline"""
+	pass
+
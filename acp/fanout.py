@@ -0,0 +1,117 @@
+import logging
+import Queue
+import threading
+import time
+from collections import namedtuple
+
+from .client import ACPClient
+from .exception import ACPDeadlineError
+from .session import ACP_SERVER_PORT
+
+
+"""Result of running one operation against one target
+
+error is None on success, otherwise it holds the exception raised for the target
+"""
+ACPFanOutResult = namedtuple("ACPFanOutResult", ["target", "value", "error", "elapsed"])
+
+
+def _start_deadline_timer(client, delay, expired):
+	"""Abort the client's connection after delay seconds, appending to expired when that happens"""
+	def expire():
+		expired.append(True)
+		client.session.abort()
+	
+	timer = threading.Timer(max(delay, 0.0), expire)
+	timer.daemon = True
+	timer.start()
+	return timer
+
+
+def _run_operation(target, password, operation, port, timeout, pool, deadline):
+	begin = time.time()
+	expired = []
+	timer = None
+	try:
+		if pool is not None:
+			with pool.connection(target, password, port, timeout) as client:
+				if deadline is not None:
+					timer = _start_deadline_timer(client, deadline - (time.time() - begin), expired)
+				value = operation(client)
+		else:
+			client = ACPClient(target, password)
+			try:
+				# the deadline timer can't abort a connection that is still being set up
+				connect_timeout = timeout if deadline is None else min(deadline, timeout or deadline)
+				client.connect(port, timeout, connect_timeout)
+				if deadline is not None:
+					timer = _start_deadline_timer(client, deadline - (time.time() - begin), expired)
+				value = operation(client)
+			finally:
+				client.close()
+	except Exception as e:
+		if expired:
+			e = ACPDeadlineError("operation on {0} did not finish within {1}s".format(target, deadline))
+		logging.debug("fan-out operation failed for {0}: {1!r}".format(target, e))
+		return ACPFanOutResult(target, None, e, time.time() - begin)
+	finally:
+		if timer is not None:
+			timer.cancel()
+	
+	return ACPFanOutResult(target, value, None, time.time() - begin)
+
+
+def fan_out(targets, operation, password="", port=ACP_SERVER_PORT, concurrency=16, timeout=None, pool=None, deadline=None):
+	"""Run one client operation against many targets concurrently
+	
+	Each target gets its own connected ACPClient, which is passed to operation and closed afterwards,
+	unless a connection pool is given, in which case connections are taken from and returned to the pool.
+	
+	Args:
+		targets (iterable): target addresses, or (address, password) tuples to override password per target
+		operation (callable): called as operation(client), its return value is reported for the target
+		password (str): default router admin password
+		port (int): ACP server port
+		concurrency (int): maximum number of targets being worked on at once
+		timeout (float): socket timeout for connecting and for each send or recv, None uses the pool's timeout
+		                 if there is a pool, otherwise blocks forever; a target that keeps trickling data in
+		                 never hits it, see deadline
+		pool (ACPConnectionPool): optional pool to reuse connections from
+		deadline (float): seconds each target may take from start to finish, after which its connection is
+		                  shut down and it is reported with ACPDeadlineError; None sets no limit
+	
+	Yields:
+		ACPFanOutResult for each target, in order of completion
+	
+	"""
+	jobs = Queue.Queue()
+	results = Queue.Queue()
+	stop = threading.Event()
+	
+	job_count = 0
+	for target in targets:
+		if isinstance(target, tuple):
+			jobs.put(target)
+		else:
+			jobs.put((target, password))
+		job_count += 1
+	
+	def worker():
+		while not stop.is_set():
+			try:
+				target, target_password = jobs.get_nowait()
+			except Queue.Empty:
+				return
+			results.put(_run_operation(target, target_password, operation, port, timeout, pool, deadline))
+	
+	for i in range(min(concurrency, job_count)):
+		t = threading.Thread(target=worker, name="acp-fan-out-{0}".format(i))
+		t.daemon = True
+		t.start()
+	
+	try:
+		for i in range(job_count):
+			yield results.get()
+	finally:
+		# abandon queued targets if the caller stops iterating early
+		stop.set()
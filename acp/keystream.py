@@ -1,6 +1,19 @@
 """Static key/seed for keystream generation"""
 ACP_STATIC_KEY = "5b6faf5d9d5b0e1351f2da1de7e8d673".decode("hex")
 
+"""Keystream period"""
+_keystream_period = 0x100
+
+def _generate_acp_keystream_table():
+	key = bytearray(_keystream_period)
+	static_key = bytearray(ACP_STATIC_KEY)
+	for key_idx in range(_keystream_period):
+		key[key_idx] = (key_idx + 0x55 & 0xFF) ^ static_key[key_idx % len(static_key)]
+	return str(key)
+
+"""One full period of the keystream, precomputed at import"""
+_acp_keystream_table = _generate_acp_keystream_table()
+
 def generate_acp_keystream(length):
 	"""Get key used to encrypt the header key (and some message data?)
 	
@@ -14,11 +27,8 @@ def generate_acp_keystream(length):
 		Keystream repeats every 256 bytes
 	
 	"""
-	key = ""
-	key_idx = 0
-	
-	while (key_idx < length):
-		key += chr((key_idx + 0x55 & 0xFF) ^ ord(ACP_STATIC_KEY[key_idx % len(ACP_STATIC_KEY)]))
-		key_idx += 1
+	if length <= _keystream_period:
+		return _acp_keystream_table[:length]
 	
-	return key
+	repeat_count = length // _keystream_period + 1
+	return (_acp_keystream_table * repeat_count)[:length]
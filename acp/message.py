@@ -6,6 +6,14 @@ from .exception import ACPMessageError
 from .keystream import *
 
 
+_header_key_size = 0x20
+_header_key_words = struct.Struct("!4Q")
+_header_keystream_words = _header_key_words.unpack(generate_acp_keystream(_header_key_size))
+
+# password -> encrypted header key, cleared when full so it stays small
+_header_key_cache = {}
+_header_key_cache_size = 64
+
 def _generate_acp_header_key(password):
 	"""
 	Encrypt password for ACP message header key field
@@ -20,18 +28,27 @@ def _generate_acp_header_key(password):
 		String containing encrypted password of proper length for the header field
 	
 	"""
-	pw_len = 0x20
-	pw_key = generate_acp_keystream(pw_len)
+	enc_pw_buf = _header_key_cache.get(password)
+	if enc_pw_buf is not None:
+		return enc_pw_buf
 	
 	# pad with NULLs
-	pw_buf = password[:pw_len].ljust(pw_len, "\x00")
-	enc_pw_buf = ""
-	for i in range(pw_len):
-		enc_pw_buf += chr(ord(pw_key[i]) ^ ord(pw_buf[i]))	
+	pw_buf = password[:_header_key_size].ljust(_header_key_size, "\x00")
+	pw_words = _header_key_words.unpack(pw_buf)
+	enc_pw_buf = _header_key_words.pack(*[k ^ p for k, p in zip(_header_keystream_words, pw_words)])
+	
+	if len(_header_key_cache) >= _header_key_cache_size:
+		_header_key_cache.clear()
+	_header_key_cache[password] = enc_pw_buf
 	
 	return enc_pw_buf
 
 
+def _bytes(data):
+	"""Copy a str, buffer or memoryview into a str, Python 2 zlib.adler32 and str() can't read memoryviews"""
+	return data.tobytes() if isinstance(data, memoryview) else str(data)
+
+
 class ACPMessage(object):
 	"""ACP message composition and parsing"""
 	
@@ -40,10 +57,19 @@ class ACPMessage(object):
 	_header_format = struct.Struct("!4s8i12x32s48x")
 	_header_magic  = "acpp"
 	
+	# header_checksum field, checksummed as zero
+	_header_checksum_format = struct.Struct("!i")
+	_header_checksum_offset = 8
+	_header_checksum_end    = _header_checksum_offset + _header_checksum_format.size
+	_header_checksum_zero   = "\x00" * _header_checksum_format.size
+	
 	header_size = _header_format.size
 	
+	_header_versions = frozenset([0x00000001, 0x00030001])
+	_header_commands = frozenset([1, 3, 4, 5, 6, 0x14, 0x15, 0x16, 0x17, 0x18, 0x19, 0x1a, 0x1b])
 	
-	def __init__(self, version, flags, unused, command, error_code, key, body=None, body_size=None):
+	
+	def __init__(self, version, flags, unused, command, error_code, key, body=None, body_size=None, body_checksum=None):
 		self.version = version
 		self.flags = flags
 		self.unused = unused
@@ -54,11 +80,12 @@ class ACPMessage(object):
 		if body == None:
 			# the body size is already specified, don't override it
 			self.body_size = body_size if body_size != None else -1
-			self.body_checksum = 1 # equivalent to zlib.adler32("")
+			# the body checksum may be specified for a body that is streamed separately
+			self.body_checksum = body_checksum if body_checksum != None else 1 # equivalent to zlib.adler32("")
 		else:
 			# the body size is already specified, don't override it
 			self.body_size = body_size if body_size != None else len(body)
-			self.body_checksum = zlib.adler32(body)
+			self.body_checksum = body_checksum if body_checksum != None else zlib.adler32(body)
 		
 		self.key = key
 		self.body = body
@@ -77,56 +104,124 @@ class ACPMessage(object):
 	
 	
 	@classmethod
-	def parse_raw(cls, data):
+	def parse_raw(cls, data, strict=True):
+		"""Parse a message header and the body attached to it, if any
+		
+		Args:
+			data (str): packed message data, a memoryview, or any other read-only buffer object
+			strict (bool): verify the header and body checksums now, False defers that to verify_checksums()
+		
+		Returns:
+			ACPMessage whose body is a read-only buffer, or a memoryview for memoryview data, into data instead
+			of a copy
+		
+		Raises:
+			ACPMessageError if the message is malformed
+		
+		"""
 		# bail early if there is not enough data
-		if len(data) < cls.header_size:
+		data_size = len(data)
+		if data_size < cls.header_size:
 			raise ACPMessageError("need to pass at least {0} bytes".format(cls.header_size))
-		header_data = data[:cls.header_size]
 		# make sure there's data beyond the header before we try to access it
-		body_data = data[cls.header_size:] if len(data) > cls.header_size else None
-		
-		(magic, version, header_checksum, body_checksum, body_size, flags, unused, command, error_code, key) = cls._header_format.unpack(header_data)
-		logging.debug("ACP message header fields, parsed not validated")
-		logging.debug("magic           {0!r}".format(magic))
-		logging.debug("header_checksum {0:#x}".format(header_checksum))
-		logging.debug("body_checksum   {0:#x}".format(body_checksum))
-		logging.debug("body_size       {0:#x}".format(body_size))
-		logging.debug("flags           {0:#x}".format(flags))
-		logging.debug("unused          {0:#x}".format(unused))
-		logging.debug("command         {0:#x}".format(command))
-		logging.debug("error_code      {0:#x}".format(error_code))
-		logging.debug("key             {0!r}".format(key))
+		if data_size <= cls.header_size:
+			body_data = None
+		elif isinstance(data, memoryview):
+			# buffer() does not accept memoryviews, slicing one does not copy either
+			body_data = data[cls.header_size:]
+		else:
+			body_data = buffer(data, cls.header_size)
+		
+		(magic, version, header_checksum, body_checksum, body_size, flags, unused, command, error_code, key) = cls._header_format.unpack_from(data)
+		if logging.getLogger().isEnabledFor(logging.DEBUG):
+			logging.debug("ACP message header fields, parsed not validated")
+			logging.debug("magic           {0!r}".format(magic))
+			logging.debug("header_checksum {0:#x}".format(header_checksum))
+			logging.debug("body_checksum   {0:#x}".format(body_checksum))
+			logging.debug("body_size       {0:#x}".format(body_size))
+			logging.debug("flags           {0:#x}".format(flags))
+			logging.debug("unused          {0:#x}".format(unused))
+			logging.debug("command         {0:#x}".format(command))
+			logging.debug("error_code      {0:#x}".format(error_code))
+			logging.debug("key             {0!r}".format(key))
 		
 		if magic != cls._header_magic:
 			raise ACPMessageError("bad header magic")
 		
-		if version not in [0x00000001, 0x00030001]:
+		if version not in cls._header_versions:
 			raise ACPMessageError("invalid version")
 		
-		#TODO: can we zero the header_checksum field without recreating the struct (how?)
-		tmphdr = cls._header_format.pack(magic, version, 0, body_checksum, body_size, flags, unused, command, error_code, key)
-		if header_checksum != zlib.adler32(tmphdr):
-			raise ACPMessageError("header checksum does not match")
-		
 		if body_data and body_size == -1:
 			raise ACPMessageError("cannot handle stream header with data attached")
 		
 		if body_data and body_size != len(body_data):
 			raise ACPMessageError("message body size does not match available data")
 		
-		if body_data and body_checksum != zlib.adler32(body_data):
-			raise ACPMessageError("body checksum does not match")
-		
 		#TODO: check flags
 		
 		#TODO: check status
 		
-		if command not in [1, 3, 4, 5, 6, 0x14, 0x15, 0x16, 0x17, 0x18, 0x19, 0x1a, 0x1b]:
+		if command not in cls._header_commands:
 			raise ACPMessageError("unknown command")
 		
 		#TODO: check error code
 		
-		return cls(version, flags, unused, command, error_code, key, body_data, body_size)
+		message = cls(version, flags, unused, command, error_code, key, body_data, body_size, body_checksum)
+		message._raw_data = data
+		message._raw_header_checksum = header_checksum
+		if strict:
+			message.verify_checksums()
+		return message
+	
+	
+	def verify_checksums(self):
+		"""Verify the checksums of a message returned by parse_raw, once
+		
+		A memoryview body is copied for its checksum, as zlib can't read memoryviews.
+		
+		Raises:
+			ACPMessageError if the header or body checksum does not match
+		
+		"""
+		data = getattr(self, "_raw_data", None)
+		if data is None:
+			return
+		
+		if self._raw_header_checksum != self._compute_header_checksum(data):
+			raise ACPMessageError("header checksum does not match")
+		
+		body = self.body.tobytes() if isinstance(self.body, memoryview) else self.body
+		if body and self.body_checksum != zlib.adler32(body):
+			raise ACPMessageError("body checksum does not match")
+		
+		# don't keep the packed data alive longer than needed, the body still refers to it
+		self._raw_data = None
+	
+	
+	@classmethod
+	def _compute_header_checksum(cls, header_data):
+		"""Checksum packed header data as if its header_checksum field was zero, without repacking it"""
+		if not isinstance(header_data, str):
+			header_data = _bytes(header_data[:cls.header_size])
+		# joining the header slices is cheaper than three adler32 calls over buffer objects
+		return zlib.adler32(header_data[:cls._header_checksum_offset] + cls._header_checksum_zero + header_data[cls._header_checksum_end:cls.header_size])
+	
+	
+	@staticmethod
+	def compute_body_checksum(chunks, checksum=1):
+		"""Incrementally checksum a body that is produced in chunks
+		
+		Args:
+			chunks (iterable): body data chunks, in order
+			checksum (int): running checksum to continue from, 1 starts a new one
+		
+		Returns:
+			body checksum suitable for the body_checksum header field
+		
+		"""
+		for chunk in chunks:
+			checksum = zlib.adler32(chunk, checksum)
+		return checksum
 	
 	
 	@classmethod
@@ -139,6 +234,11 @@ class ACPMessage(object):
 		return cls(0x00030001, flags, 0, 3, 0, _generate_acp_header_key(password), payload)._compose_raw_packet()
 	
 	
+	@classmethod
+	def compose_flash_primary_header(cls, flags, password, body_size, body_checksum):
+		return cls.compose_header_ex(0x00030001, flags, 0, 3, 0, password, body_size, body_checksum)
+	
+	
 	@classmethod
 	def compose_flash_secondary_command(cls, flags, password, payload):
 		return cls(0x00030001, flags, 0, 5, 0, _generate_acp_header_key(password), payload)._compose_raw_packet()
@@ -189,6 +289,21 @@ class ACPMessage(object):
 		return cls(version, flags, unused, command, error_code, _generate_acp_header_key(password), payload, payload_size)._compose_raw_packet()
 	
 	
+	@classmethod
+	def compose_header_ex(cls, version, flags, unused, command, error_code, password, body_size, body_checksum):
+		"""Compose only the header of a message whose body is sent separately
+		
+		Args:
+			body_size (int): size of the body that will follow
+			body_checksum (int): checksum of that body, see compute_body_checksum
+		
+		Returns:
+			String containing header data
+		
+		"""
+		return cls(version, flags, unused, command, error_code, _generate_acp_header_key(password), None, body_size, body_checksum)._compose_header()
+	
+	
 	def _compose_raw_packet(self):
 		"""Compose a request from the client to ACP daemon
 		
@@ -198,7 +313,8 @@ class ACPMessage(object):
 		"""
 		reply = self._compose_header()
 		if self.body:
-			reply += self.body
+			# parsed messages hold their body as a buffer or memoryview
+			reply += _bytes(self.body)
 		
 		return reply
 	
@@ -210,20 +326,9 @@ class ACPMessage(object):
 			String containing header data
 		
 		"""
-		tmphdr = self._header_format.pack(self._header_magic,
-		                                  self.version,
-		                                  0,
-		                                  self.body_checksum,
-		                                  self.body_size,
-		                                  self.flags,
-		                                  self.unused,
-		                                  self.command,
-		                                  self.error_code,
-		                                  self.key)
-		
 		header = self._header_format.pack(self._header_magic,
 		                                  self.version,
-		                                  zlib.adler32(tmphdr),
+		                                  0,
 		                                  self.body_checksum,
 		                                  self.body_size,
 		                                  self.flags,
@@ -232,4 +337,7 @@ class ACPMessage(object):
 		                                  self.error_code,
 		                                  self.key)
 		
-		return header
+		# splice the checksum of the zeroed header into place
+		return (header[:self._header_checksum_offset] +
+		        self._header_checksum_format.pack(zlib.adler32(header)) +
+		        header[self._header_checksum_end:])
@@ -0,0 +1,409 @@
+import csv
+import datetime
+import heapq
+import json
+import logging
+import Queue
+import random
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from .cflbinary import CFLBinaryPListParseError
+from .exception import *
+from .pool import ACPConnectionPool
+from .property import ACPProperty
+from .session import ACP_SERVER_PORT
+
+
+"""One polled property value
+
+value is the formatted property value, None if error is set
+error is the element error code for properties the router refused, or the exception message if the poll failed
+diffs is the list of ACPPropertyDiff against the previous value if the poller has a delta cache, None otherwise
+"""
+ACPPollSample = namedtuple("ACPPollSample", ["timestamp", "target", "name", "value", "error", "diffs"])
+
+# errors a malformed element value can raise while it is parsed and formatted
+_element_errors = (ACPPropertyError, CFLBinaryPListParseError, struct.error, ValueError, OverflowError)
+
+
+def _jsonable(obj):
+	"""Convert a sample field, including parsed cfb values in diffs, to something json can encode"""
+	if isinstance(obj, str):
+		return obj.decode("utf-8", "replace")
+	if isinstance(obj, dict):
+		return dict((_jsonable(key), _jsonable(value)) for key, value in obj.iteritems())
+	if isinstance(obj, (list, tuple)):
+		if hasattr(obj, "_asdict"):
+			return _jsonable(obj._asdict())
+		return [_jsonable(item) for item in obj]
+	if isinstance(obj, datetime.datetime):
+		return obj.isoformat()
+	return obj
+
+
+class ACPJSONLinesSink(object):
+	"""Write samples as one JSON object per line"""
+	
+	def __init__(self, f):
+		"""
+		Args:
+			f (str or file): output path, opened for appending, or a file object opened for writing
+		
+		"""
+		self._owned = isinstance(f, basestring)
+		self.file = open(f, "a") if self._owned else f
+	
+	
+	def write(self, sample):
+		self.file.write(json.dumps(_jsonable(sample)) + "\n")
+	
+	
+	def flush(self):
+		self.file.flush()
+	
+	
+	def close(self):
+		self.file.flush()
+		if self._owned:
+			self.file.close()
+
+
+class ACPCSVSink(object):
+	"""Write samples as CSV rows, with a header row if the output is new"""
+	
+	def __init__(self, f, header=True):
+		"""
+		Args:
+			f (str or file): output path, opened for appending, or a file object opened for writing
+			header (bool): write a header row first, skipped when appending to a non-empty file
+		
+		"""
+		self._owned = isinstance(f, basestring)
+		self.file = open(f, "ab") if self._owned else f
+		self._writer = csv.writer(self.file)
+		if header and not (self._owned and self.file.tell()):
+			self._writer.writerow(ACPPollSample._fields)
+	
+	
+	def write(self, sample):
+		self._writer.writerow(sample)
+	
+	
+	def flush(self):
+		self.file.flush()
+	
+	
+	def close(self):
+		self.file.flush()
+		if self._owned:
+			self.file.close()
+
+
+class ACPCallbackSink(object):
+	"""Pass samples to a callable"""
+	
+	def __init__(self, callback):
+		self.callback = callback
+	
+	
+	def write(self, sample):
+		self.callback(sample)
+	
+	
+	def flush(self):
+		pass
+	
+	
+	def close(self):
+		pass
+
+
+class _ACPPollJob(object):
+	"""Properties of one target that share a poll interval"""
+	
+	def __init__(self, target, password, interval, names):
+		self.target = target
+		self.password = password
+		self.interval = interval
+		self.names = names
+		self.in_flight = False
+
+
+class _ACPPollTargetState(object):
+	def __init__(self):
+		self.failures = 0
+		self.backoff_until = 0.0
+
+
+class ACPPoller(object):
+	"""Long-running poller for properties of many routers
+	
+	Jobs are kept in a heap ordered by due time and handed to a bounded set of worker threads, which
+	reuse connections from an ACPConnectionPool. Unreachable routers are backed off exponentially.
+	
+	"""
+	
+	def __init__(self, targets, intervals, sinks, password="", port=ACP_SERVER_PORT, concurrency=16, jitter=0.1,
+	             backoff_base=1.0, backoff_max=300.0, timeout=10.0, pool=None, cache=None):
+		"""
+		Args:
+			targets (iterable): target addresses, or (address, password) tuples to override password per target
+			intervals (dict): property name -> poll interval in seconds
+			sinks (list): objects with write(sample), flush() and close() methods, e.g. ACPJSONLinesSink
+			password (str): default router admin password
+			port (int): ACP server port
+			concurrency (int): maximum number of polls, and so connections, in progress at once
+			jitter (float): fraction of the interval each poll is randomly moved by
+			backoff_base (float): first backoff delay for an unreachable router, doubled on every failure
+			backoff_max (float): maximum backoff delay
+			timeout (float): socket timeout for new connections, used if no pool is given
+			pool (ACPConnectionPool): pool to take connections from
+			cache (ACPDeltaCache): only report values that changed since the last poll, with their diffs
+		
+		"""
+		self.sinks = list(sinks)
+		self.port = port
+		self.concurrency = concurrency
+		self.jitter = jitter
+		self.backoff_base = backoff_base
+		self.backoff_max = backoff_max
+		self.pool = pool if pool is not None else ACPConnectionPool(max_idle_per_key=1, timeout=timeout)
+		self.cache = cache
+		
+		# group properties by interval so each target gets one request per interval
+		names_by_interval = {}
+		for name, interval in intervals.iteritems():
+			if interval <= 0:
+				raise ValueError("poll interval for \"{0}\" must be positive".format(name))
+			names_by_interval.setdefault(interval, []).append(name)
+		
+		self._jobs = []
+		self._targets = {}
+		for target in targets:
+			target, target_password = target if isinstance(target, tuple) else (target, password)
+			self._targets[target] = _ACPPollTargetState()
+			for interval, names in sorted(names_by_interval.iteritems()):
+				self._jobs.append(_ACPPollJob(target, target_password, interval, sorted(names)))
+		
+		self._heap = []
+		self._sequence = 0
+		self._work = Queue.Queue()
+		self._lock = threading.Lock()
+		# sinks are written outside _lock, so they can call stats() and slow sinks don't stall the scheduler
+		self._sink_lock = threading.Lock()
+		self._stop = threading.Event()
+		self._threads = []
+		
+		self.start_time = None
+		self.polls = 0
+		self.poll_errors = 0
+		self.samples = 0
+		self.skipped = 0
+		self.lag_total = 0.0
+		self.lag_max = 0.0
+	
+	
+	def _schedule(self, due, job):
+		# the sequence number keeps jobs with equal due times from being compared
+		self._sequence += 1
+		heapq.heappush(self._heap, (due, self._sequence, job))
+	
+	
+	def _next_due(self, due, interval):
+		return due + interval * (1.0 + random.uniform(-self.jitter, self.jitter))
+	
+	
+	def start(self):
+		"""Start the scheduler and worker threads"""
+		self._stop.clear()
+		self.start_time = time.time()
+		
+		# spread the first polls over one interval
+		for job in self._jobs:
+			self._schedule(self.start_time + random.uniform(0, job.interval), job)
+		
+		for i in range(self.concurrency):
+			t = threading.Thread(target=self._worker, name="acp-poller-worker-{0}".format(i))
+			t.daemon = True
+			t.start()
+			self._threads.append(t)
+		
+		t = threading.Thread(target=self._scheduler, name="acp-poller-scheduler")
+		t.daemon = True
+		t.start()
+		self._threads.append(t)
+	
+	
+	def stop(self):
+		"""Stop polling, wait for polls in progress, then flush and close the sinks and pool"""
+		self._stop.set()
+		for i in range(self.concurrency):
+			self._work.put(None)
+		for t in self._threads:
+			t.join()
+		self._threads = []
+		self._heap = []
+		
+		for sink in self.sinks:
+			sink.close()
+		self.pool.close()
+	
+	
+	def run(self, duration=None):
+		"""Poll on the calling thread until duration seconds have passed or until interrupted"""
+		self.start()
+		deadline = time.time() + duration if duration is not None else None
+		try:
+			# waiting in short steps keeps KeyboardInterrupt deliverable
+			while not self._stop.is_set() and (deadline is None or time.time() < deadline):
+				self._stop.wait(1.0 if deadline is None else min(1.0, max(deadline - time.time(), 0)))
+		finally:
+			self.stop()
+	
+	
+	def _scheduler(self):
+		while not self._stop.is_set():
+			if not self._heap:
+				self._stop.wait(1.0)
+				continue
+			
+			due, sequence, job = self._heap[0]
+			now = time.time()
+			if due > now:
+				self._stop.wait(due - now)
+				continue
+			heapq.heappop(self._heap)
+			
+			with self._lock:
+				backoff_until = self._targets[job.target].backoff_until
+				in_flight = job.in_flight
+				if backoff_until <= now and not in_flight:
+					job.in_flight = True
+				elif in_flight:
+					self.skipped += 1
+			
+			if backoff_until > now:
+				self._schedule(backoff_until + random.uniform(0, self.jitter * job.interval), job)
+				continue
+			
+			self._schedule(self._next_due(due, job.interval), job)
+			if not in_flight:
+				self._work.put((due, job))
+	
+	
+	def _worker(self):
+		while True:
+			item = self._work.get()
+			if item is None:
+				return
+			due, job = item
+			try:
+				self._poll(due, job)
+			except Exception as e:
+				# keep the worker alive, the failure is reported like any other failed poll
+				logging.exception("unexpected error polling {0}".format(job.target))
+				self._poll_failed(job, time.time(), max(time.time() - due, 0.0), e)
+			finally:
+				with self._lock:
+					job.in_flight = False
+	
+	
+	def _poll(self, due, job):
+		begin = time.time()
+		lag = max(begin - due, 0.0)
+		
+		try:
+			with self.pool.connection(job.target, job.password, self.port) as client:
+				elements = list(client.iter_property_elements(job.names))
+		except (ACPError, socket.error, struct.error) as e:
+			self._poll_failed(job, begin, lag, e)
+			return
+		
+		samples = []
+		for name, flags, data in elements:
+			try:
+				sample = self._element_sample(begin, job.target, name, flags, data)
+			except _element_errors as e:
+				logging.debug("bad value for property \"{0}\" of {1}: {2!r}".format(name, job.target, e))
+				sample = ACPPollSample(begin, job.target, name, None, str(e) or type(e).__name__, None)
+			if sample is not None:
+				samples.append(sample)
+		
+		with self._lock:
+			state = self._targets[job.target]
+			state.failures = 0
+			state.backoff_until = 0.0
+			self._record_poll_locked(lag, samples)
+		self._write_samples(samples)
+	
+	
+	def _element_sample(self, timestamp, target, name, flags, data):
+		"""Build the sample for one reply element, None if the delta cache reports it unchanged"""
+		if flags & 1:
+			(error_code, ) = struct.unpack(">i", data)
+			# report the value again once it can be read
+			if self.cache is not None:
+				self.cache.invalidate(target, name)
+			return ACPPollSample(timestamp, target, name, None, error_code, None)
+		
+		if self.cache is None:
+			return ACPPollSample(timestamp, target, name, str(ACPProperty(name, data)), None, None)
+		change = self.cache.update(target, name, data)
+		if change is None:
+			return None
+		return ACPPollSample(timestamp, target, name, change.value, None, change.diffs)
+	
+	
+	def _poll_failed(self, job, begin, lag, e):
+		logging.debug("poll of {0} failed: {1!r}".format(job.target, e))
+		samples = [ACPPollSample(begin, job.target, name, None, str(e) or type(e).__name__, None) for name in job.names]
+		
+		with self._lock:
+			state = self._targets[job.target]
+			delay = min(self.backoff_base * 2 ** state.failures, self.backoff_max)
+			state.failures += 1
+			state.backoff_until = max(state.backoff_until, time.time() + delay)
+			self.poll_errors += 1
+			self._record_poll_locked(lag, samples)
+		self._write_samples(samples)
+	
+	
+	def _record_poll_locked(self, lag, samples):
+		self.polls += 1
+		self.samples += len(samples)
+		self.lag_total += lag
+		self.lag_max = max(self.lag_max, lag)
+	
+	
+	def _write_samples(self, samples):
+		with self._sink_lock:
+			for sample in samples:
+				for sink in self.sinks:
+					try:
+						sink.write(sample)
+					except Exception as e:
+						logging.error("poll sink {0!r} failed: {1!r}".format(sink, e))
+	
+	
+	def stats(self):
+		"""Get polling metrics
+		
+		Returns:
+			dict with poll, error, sample and skipped counts, achieved polls_per_sec, and the mean and
+			maximum scheduling lag in seconds, which is the delay between a poll being due and starting
+		
+		"""
+		with self._lock:
+			elapsed = time.time() - self.start_time if self.start_time else 0.0
+			return dict(polls=self.polls,
+			            poll_errors=self.poll_errors,
+			            samples=self.samples,
+			            skipped=self.skipped,
+			            polls_per_sec=self.polls / elapsed if elapsed else 0.0,
+			            lag_mean=self.lag_total / self.polls if self.polls else 0.0,
+			            lag_max=self.lag_max,
+			            backoff_targets=sum(1 for state in self._targets.values() if state.failures))
@@ -0,0 +1,214 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from .client import ACPClient
+from .session import ACP_SERVER_PORT
+
+
+class ACPConnectionPool(object):
+	"""Thread-safe pool of connected ACPClient objects
+	
+	Idle clients are keyed by (target, port, password) and are health checked before they are handed out again.
+	A timer closes idle clients once they pass idle_ttl, so their sockets don't wait for the next acquire().
+	
+	"""
+	
+	def __init__(self, idle_ttl=60.0, max_idle_per_key=4, timeout=None):
+		"""
+		Args:
+			idle_ttl (float): seconds an idle connection is kept before it is closed
+			max_idle_per_key (int): maximum number of idle connections kept per key
+			timeout (float): socket timeout passed to ACPClient.connect for new connections
+		
+		"""
+		self.idle_ttl = idle_ttl
+		self.max_idle_per_key = max_idle_per_key
+		self.timeout = timeout
+		
+		self._lock = threading.Lock()
+		# key -> list of (client, released_time), most recently released last
+		self._idle = {}
+		# timer for the next idle expiry, only pending while there are idle clients
+		self._reaper = None
+		
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+	
+	
+	@staticmethod
+	def _key(target, port, password):
+		return (target, port, password)
+	
+	
+	def _evict_expired_locked(self, now):
+		expired = []
+		for key, entries in self._idle.items():
+			fresh = []
+			for client, released in entries:
+				if now - released >= self.idle_ttl:
+					expired.append(client)
+				else:
+					fresh.append((client, released))
+			if fresh:
+				self._idle[key] = fresh
+			else:
+				del self._idle[key]
+		self.evictions += len(expired)
+		return expired
+	
+	
+	def _schedule_reaper_locked(self, now):
+		if self._reaper is not None:
+			return
+		# acquire() can leave empty lists behind
+		released_times = [released for entries in self._idle.itervalues() for client, released in entries]
+		if not released_times:
+			return
+		self._reaper = threading.Timer(max(min(released_times) + self.idle_ttl - now, 0.0), self._reap)
+		self._reaper.daemon = True
+		self._reaper.start()
+	
+	
+	def _reap(self):
+		with self._lock:
+			self._reaper = None
+			now = time.time()
+			expired = self._evict_expired_locked(now)
+			self._schedule_reaper_locked(now)
+		for client in expired:
+			client.close()
+	
+	
+	def acquire(self, target, password="", port=ACP_SERVER_PORT, timeout=None):
+		"""Get a connected client, reusing an idle one if a healthy one is available
+		
+		Args:
+			timeout (float): socket timeout while the client is out of the pool, None uses the pool's timeout
+		
+		Returns:
+			ACPClient, which must be handed back with release()
+		
+		"""
+		key = self._key(target, port, password)
+		with self._lock:
+			expired = self._evict_expired_locked(time.time())
+			entries = self._idle.get(key, [])
+			candidates = []
+			while entries:
+				candidates.append(entries.pop())
+		
+		for client in expired:
+			client.close()
+		
+		# health checks happen outside the lock, stale clients are dropped
+		client = None
+		for i, (candidate, released) in enumerate(candidates):
+			if candidate.session.is_connected():
+				client = candidate
+				# hand unused candidates back unchecked, keeping their release times so they still expire
+				self._restore_idle(key, candidates[i+1:])
+				break
+			logging.debug("dropping stale pooled connection to {0}:{1}".format(target, port))
+			candidate.close()
+			with self._lock:
+				self.evictions += 1
+		
+		if client is not None:
+			with self._lock:
+				self.hits += 1
+			if timeout is not None:
+				client.session.sock.settimeout(timeout)
+			return client
+		
+		with self._lock:
+			self.misses += 1
+		client = ACPClient(target, password)
+		client.connect(port, self.timeout if timeout is None else timeout)
+		return client
+	
+	
+	def _restore_idle(self, key, candidates):
+		"""Put candidates taken by acquire() back in front of the idle list, they were released before any entry in it"""
+		if not candidates:
+			return
+		with self._lock:
+			entries = candidates[::-1] + self._idle.get(key, [])
+			# keep the most recently released
+			excess = max(len(entries) - self.max_idle_per_key, 0)
+			self._idle[key] = entries[excess:]
+			self.evictions += excess
+			self._schedule_reaper_locked(time.time())
+		for client, released in entries[:excess]:
+			client.close()
+	
+	
+	def release(self, client, reuse=True):
+		"""Hand a client back to the pool
+		
+		Args:
+			client (ACPClient): client returned by acquire()
+			reuse (bool): False closes the connection, use this when an operation failed midway
+		
+		"""
+		if not reuse or client.session.sock is None:
+			client.close()
+			return
+		# undo a timeout given to acquire()
+		client.session.sock.settimeout(self.timeout)
+		
+		key = self._key(client.target, client.session.port, client.password)
+		with self._lock:
+			entries = self._idle.setdefault(key, [])
+			if len(entries) < self.max_idle_per_key:
+				now = time.time()
+				entries.append((client, now))
+				self._schedule_reaper_locked(now)
+				return
+		client.close()
+	
+	
+	@contextmanager
+	def connection(self, target, password="", port=ACP_SERVER_PORT, timeout=None):
+		"""Context manager wrapping acquire() and release()
+		
+		The connection is closed instead of pooled if the block raises.
+		
+		"""
+		client = self.acquire(target, password, port, timeout)
+		try:
+			yield client
+		except:
+			self.release(client, reuse=False)
+			raise
+		else:
+			self.release(client)
+	
+	
+	def evict_idle(self):
+		"""Close idle connections older than idle_ttl"""
+		with self._lock:
+			expired = self._evict_expired_locked(time.time())
+		for client in expired:
+			client.close()
+	
+	
+	def close(self):
+		"""Close all idle connections"""
+		with self._lock:
+			entries = self._idle
+			self._idle = {}
+			if self._reaper is not None:
+				self._reaper.cancel()
+				self._reaper = None
+		for key in entries:
+			for client, released in entries[key]:
+				client.close()
+	
+	
+	def stats(self):
+		with self._lock:
+			idle = sum(len(entries) for entries in self._idle.values())
+			return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, idle=idle)
@@ -1,6 +1,7 @@
 import logging
 import pprint
 import struct
+from collections import namedtuple
 
 from .cflbinary import CFLBinaryPListParser
 from .exception import ACPPropertyError
@@ -13,7 +14,7 @@ _acp_properties = [
 	# name (required) is a 4 character string,
 	# type (required) is a valid property type (str, dec, hex, log, mac, cfb, bin)
 	# description (required) is a short, one-line description of the property
-	# validation (optional) is eval()d to verify the input value for setting a property
+	# validation (optional) is an expression of "value", compiled once and used to verify the input value for setting a property
 	("buil","str","Build string?",""),
 	("DynS","cfb","DNS",""),
 	#("cfpf","","",""),
@@ -565,39 +566,47 @@ class ACPPropertyInitValueError(ACPPropertyError):
 	pass
 
 
-class ACPProperty(object):
+class _ACPPropertyBase(object):
+	"""Implementation shared by ACPProperty and ACPCompactProperty"""
+	__slots__ = ()
+	
 	_acpprop = _generate_acp_property_dict()
 	
 	_element_header_format = struct.Struct("!4s2I")
 	element_header_size = _element_header_format.size
 	
+	_element_int_format = struct.Struct(">I")
+	
+	# packed name and value of the "null" property element that terminates a list of elements
+	null_name = "\x00\x00\x00\x00"
+	null_value = "\x00\x00\x00\x00"
+	
 	
 	def __init__(self, name=None, value=None):
 		# handle "null" property packed name and value first
-		if name == "\x00\x00\x00\x00" and value == "\x00\x00\x00\x00":
+		if name == self.null_name and value == self.null_value:
 			name = None
 			value = None
 		
-		if name and name not in self.get_supported_property_names():
+		if name and name not in self._schema:
 			raise ACPPropertyError("invalid property name passed to initializer: {0}".format(name))
 		
 		if value is not None:
 			# accept value as packed binary string or Python type
-			prop_type = self.get_property_info_string(name, "type")
-			_init_handler_name = "_init_{0}".format(prop_type)
-			assert hasattr(self, _init_handler_name), "missing init handler for \"{0}\" property type".format(prop_type)
-			_init_handler = getattr(self, _init_handler_name)
+			schema = self._schema.get(name)
+			assert schema is not None, "missing schema for property \"{0}\"".format(name)
 			
-			logging.debug("old value: {0!r} type: {1}".format(value, type(value)))
+			debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+			if debug:
+				logging.debug("old value: {0!r} type: {1}".format(value, type(value)))
 			try:
-				value = _init_handler(value)
+				value = schema.init(self, value)
 			except ACPPropertyInitValueError as e:
-				raise ACPPropertyError("{0!s} provided for \"{1}\" property type: {2!r}".format(e, prop_type, value))
-			logging.debug("new value: {0!r} type: {1}".format(value, type(value)))
+				raise ACPPropertyError("{0!s} provided for \"{1}\" property type: {2!r}".format(e, schema.type, value))
+			if debug:
+				logging.debug("new value: {0!r} type: {1}".format(value, type(value)))
 			
-			#XXX: this is still really hacky, should probably do something with anonymous functions or introspection
-			validation_expr = self.get_property_info_string(name, "validation")
-			if validation_expr and not eval(validation_expr):
+			if schema.validate is not None and not schema.validate(value):
 				raise ACPPropertyError("invalid value passed to initializer for property \"{0}\": {1}".format(name, repr(value)))
 		
 		self.name = name
@@ -678,10 +687,7 @@ class ACPProperty(object):
 		if self.name is None or self.value is None:
 			return ""
 		
-		prop_type = self.get_property_info_string(self.name, "type")
-		_format_handler_name = "_format_{0}".format(prop_type)
-		assert hasattr(self, _format_handler_name), "missing format handler for \"{0}\" property type".format(prop_type)
-		return getattr(self, _format_handler_name)(self.value)
+		return self._schema[self.name].format(self, self.value)
 	
 	def _format_dec(self, value):
 		return str(value)
@@ -701,6 +707,18 @@ class ACPProperty(object):
 	def _format_cfb(self, value):
 		return pprint.pformat(CFLBinaryPListParser.parse(value))
 	
+	
+	def get_cfb_view(self):
+		"""Get a lazy view of a cfb property value that only unpacks the parts that are accessed
+		
+		Returns:
+			see CFLBinaryPListParser.parse_lazy
+		
+		"""
+		if self.get_property_info_string(self.name, "type") != "cfb":
+			raise ACPPropertyError("property \"{0}\" is not a cfb property".format(self.name))
+		return CFLBinaryPListParser.parse_lazy(self.value)
+	
 	def _format_log(self, value):
 		s = ""
 		for line in value.strip("\x00").split("\x00"):
@@ -756,7 +774,7 @@ class ACPProperty(object):
 		name = property.name if property.name is not None else "\x00\x00\x00\x00"
 		value = property.value if property.value is not None else "\x00\x00\x00\x00"
 		if   type(value) == int:
-			st = struct.Struct(">I")
+			st = cls._element_int_format
 			#XXX: this could throw an exception, we need to range check int/hex values to ensure they pack into 32 bits still
 			return cls.compose_raw_element_header(name, flags, st.size) + st.pack(value)
 		elif type(value) == str:
@@ -771,3 +789,119 @@ class ACPProperty(object):
 			return cls._element_header_format.pack(name, flags, size)
 		except struct.error:
 			raise ACPPropertyError("failed to compose property header")
+	
+	
+	@classmethod
+	def compose_raw_elements(cls, elements, terminate=False):
+		"""Compose many property elements into one string
+		
+		Only the element headers and int values are packed, string values are joined in as they are.
+		
+		Args:
+			elements (iterable): (name, flags, value) tuples, value is an int, a packed string, or None for a "null" value
+			terminate (bool): append the "null" element that ends a list of elements
+		
+		Returns:
+			String containing the packed elements
+		
+		Raises:
+			ACPPropertyError if a value can't be packed
+		
+		"""
+		header_format = cls._element_header_format
+		int_format = cls._element_int_format
+		parts = []
+		for name, flags, value in elements:
+			if name is None:
+				name = cls.null_name
+			if value is None:
+				value = cls.null_value
+			
+			try:
+				if type(value) == int:
+					parts.append(header_format.pack(name, flags, int_format.size))
+					parts.append(int_format.pack(value))
+				elif type(value) == str:
+					parts.append(header_format.pack(name, flags, len(value)))
+					parts.append(value)
+				else:
+					raise ACPPropertyError("unhandled property type for raw element composition")
+			except struct.error:
+				raise ACPPropertyError("failed to compose property element for \"{0}\"".format(name))
+		
+		if terminate:
+			parts.append(header_format.pack(cls.null_name, 0, len(cls.null_value)))
+			parts.append(cls.null_value)
+		return "".join(parts)
+	
+	
+	@classmethod
+	def iter_raw_elements(cls, data, offset=0):
+		"""Iterate over packed property elements up to the "null" element or the end of data
+		
+		Yields:
+			(name, flags, value) tuples with the raw value
+		
+		Raises:
+			ACPPropertyError if an element is truncated
+		
+		"""
+		header_size = cls.element_header_size
+		data_size = len(data)
+		while offset < data_size:
+			try:
+				name, flags, size = cls._element_header_format.unpack_from(data, offset)
+			except struct.error:
+				raise ACPPropertyError("failed to parse property element header")
+			offset += header_size
+			if offset + size > data_size:
+				raise ACPPropertyError("property element value extends past end of data")
+			value = data[offset:offset + size]
+			offset += size
+			
+			if name == cls.null_name and value == cls.null_value:
+				return
+			yield name, flags, value
+	
+	
+	@classmethod
+	def parse_raw_elements(cls, data, offset=0):
+		"""Parse packed property elements up to the "null" element, see iter_raw_elements
+		
+		Returns:
+			list of (name, flags, value) tuples
+		
+		"""
+		return list(cls.iter_raw_elements(data, offset))
+
+
+class ACPProperty(_ACPPropertyBase):
+	pass
+
+
+class ACPCompactProperty(_ACPPropertyBase):
+	"""ACPProperty without a per-instance __dict__, for code that creates very many short-lived properties"""
+	__slots__ = ("name", "value")
+
+
+"""Compiled per-property record, built once at import"""
+_ACPPropertySchema = namedtuple("_ACPPropertySchema", ["name", "type", "description", "init", "format", "validate"])
+
+def _compile_acp_property_schema(cls):
+	schema = {}
+	for name, info in cls._acpprop.iteritems():
+		prop_type = info["type"]
+		init_handler = cls.__dict__.get("_init_{0}".format(prop_type))
+		format_handler = cls.__dict__.get("_format_{0}".format(prop_type))
+		assert init_handler is not None, "missing init handler for \"{0}\" property type".format(prop_type)
+		assert format_handler is not None, "missing format handler for \"{0}\" property type".format(prop_type)
+		
+		# validation expressions see the initialized value as "value"
+		validate = None
+		if info["validation"]:
+			validate = eval(compile("lambda value: ({0})".format(info["validation"]), "<validation for {0}>".format(name), "eval"))
+		
+		schema[name] = _ACPPropertySchema(name, prop_type, info["description"], init_handler, format_handler, validate)
+	return schema
+
+_ACPPropertyBase._schema = _compile_acp_property_schema(_ACPPropertyBase)
@@ -0,0 +1,126 @@
+import struct
+from array import array
+
+from .property import ACPProperty
+
+
+_scalar_format = struct.Struct("!I")
+
+
+class ACPPropertyBatch(object):
+	"""Columnar store for one poll's property elements, from one or many routers
+	
+	Every element is a record in a set of parallel arrays instead of an ACPProperty object. Raw values
+	share one payload buffer, and well-formed dec/hex values are also decoded into the scalars array,
+	with the decoded array marking which ones were.
+	
+	"""
+	
+	def __init__(self):
+		# distinct targets, records refer to them by index
+		self.targets = []
+		self._target_ids = {}
+		
+		self.target_ids = array("L")
+		self.names = []
+		self.flags = array("L")
+		self.offsets = array("L")
+		self.sizes = array("L")
+		self.scalars = array("L")
+		self.decoded = array("B")
+		self.payload = bytearray()
+		
+		# name -> list of record indices
+		self._name_index = {}
+	
+	
+	def __len__(self):
+		return len(self.names)
+	
+	
+	def add(self, target, name, flags, data):
+		"""Append one raw property element
+		
+		Args:
+			target (str): router the element came from
+			name (str): property name
+			flags (int): element flags, bit 0 set means data is a packed error code
+			data (str): raw element value
+		
+		Returns:
+			index of the new record
+		
+		"""
+		target_id = self._target_ids.get(target)
+		if target_id is None:
+			target_id = self._target_ids[target] = len(self.targets)
+			self.targets.append(target)
+		
+		scalar = 0
+		decoded = 0
+		if not flags & 1 and len(data) == _scalar_format.size and \
+		   ACPProperty.get_property_info_string(name, "type") in ["dec", "hex"]:
+			(scalar, ) = _scalar_format.unpack(data)
+			decoded = 1
+		
+		index = len(self.names)
+		self.target_ids.append(target_id)
+		self.names.append(name)
+		self.flags.append(flags)
+		self.offsets.append(len(self.payload))
+		self.sizes.append(len(data))
+		self.scalars.append(scalar)
+		self.decoded.append(decoded)
+		self.payload += data
+		self._name_index.setdefault(name, []).append(index)
+		return index
+	
+	
+	def add_raw_elements(self, target, data):
+		"""Append every packed property element in data, up to the "null" element"""
+		for name, flags, value in ACPProperty.iter_raw_elements(data):
+			self.add(target, name, flags, value)
+	
+	
+	def find(self, name, target=None):
+		"""Get the indices of the records for a property, optionally only those of one target"""
+		indices = self._name_index.get(name, [])
+		if target is None:
+			return list(indices)
+		target_id = self._target_ids.get(target)
+		return [i for i in indices if self.target_ids[i] == target_id]
+	
+	
+	def get_raw(self, index):
+		"""Get the raw value of a record as a read-only buffer into the payload, without copying it"""
+		return buffer(self.payload, self.offsets[index], self.sizes[index])
+	
+	
+	def get_value(self, index):
+		"""Get the value of a record, an int for well-formed dec/hex values and the raw string otherwise"""
+		if self.decoded[index]:
+			# array items come back as long
+			return int(self.scalars[index])
+		offset = self.offsets[index]
+		return str(self.payload[offset:offset + self.sizes[index]])
+	
+	
+	def get_property(self, index):
+		"""Build an ACPProperty for a record that does not have an error flag
+		
+		Raises:
+			ACPPropertyError if the raw value is malformed for the property type
+		
+		"""
+		return ACPProperty(self.names[index], self.get_value(index))
+	
+	
+	def iter_records(self):
+		"""Iterate over all records without building property objects
+		
+		Yields:
+			(target, name, flags, value) tuples, value as returned by get_value
+		
+		"""
+		for index in xrange(len(self.names)):
+			yield self.targets[self.target_ids[index]], self.names[index], int(self.flags[index]), self.get_value(index)
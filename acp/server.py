@@ -0,0 +1,381 @@
+import logging
+import random
+import socket
+import SocketServer
+import struct
+import threading
+import time
+import zlib
+
+from .cflbinary import CFLBinaryPListComposer
+from .exception import *
+from .message import ACPMessage, _generate_acp_header_key
+from .property import ACPProperty
+from .session import ACP_SERVER_PORT, ACPServerSession
+
+
+# error codes replied by the emulator, these are emulator specific and not taken from real devices
+_error_code_password = -1
+_error_code_unsupported = -2
+_error_code_checksum = -3
+_error_code_property = -10
+_error_code_request_size = -11
+
+_element_error_format = struct.Struct(">i")
+
+
+class ACPServerFaults(object):
+	"""Fault injection settings for ACPServer, each rate is the probability of a fault per reply"""
+	
+	def __init__(self, truncate=0.0, bad_checksum=0.0, error=0.0, element_error=0.0, error_code=-1, seed=None):
+		"""
+		Args:
+			truncate (float): send only part of the reply, then close the connection
+			bad_checksum (float): corrupt the reply header checksum
+			error (float): reply with error_code in the header and no body
+			element_error (float): per getprop element, reply with an error flag instead of the value
+			error_code (int): error code used by error and element_error faults
+			seed (int): seed for reproducible fault sequences
+		
+		"""
+		self.truncate = truncate
+		self.bad_checksum = bad_checksum
+		self.error = error
+		self.element_error = element_error
+		self.error_code = error_code
+		
+		self._random = random.Random(seed)
+		self._lock = threading.Lock()
+	
+	
+	def roll(self, rate):
+		if not rate:
+			return False
+		with self._lock:
+			return self._random.random() < rate
+	
+	
+	def truncated_size(self, size):
+		"""Pick how much of a reply of size bytes is sent before the connection is closed"""
+		with self._lock:
+			return self._random.randint(0, size - 1)
+
+
+class _ACPThreadingTCPServer(SocketServer.ThreadingTCPServer):
+	allow_reuse_address = True
+	daemon_threads = True
+	request_queue_size = 128
+
+
+class _ACPServerRequestHandler(SocketServer.BaseRequestHandler):
+	def handle(self):
+		self.server.emulator._serve_connection(self.request, self.client_address)
+
+
+class ACPServer(object):
+	"""ACP server emulator for testing clients without real hardware
+	
+	Serves getprop, setprop, feat and flash requests from an in-memory property store, one thread per
+	connection. Latency, bandwidth and faults can be configured to exercise client error handling.
+	
+	"""
+	
+	# bandwidth throttling sends replies in chunks of this size
+	_throttle_chunk_size = 0x1000
+	# flash bodies are received in chunks of this size, never as a whole
+	_flash_chunk_size = 0x8000
+	
+	def __init__(self, properties=None, password="", features=None, latency=0.0, bandwidth=None, faults=None,
+	             max_getprop_names=None):
+		"""
+		Args:
+			properties (dict): property name -> value, as accepted by ACPProperty
+			password (str): admin password requests must carry, None accepts any password
+			features (object): object returned as a cflbinary plist for the feat command
+			latency (float): seconds to wait before every reply
+			bandwidth (int): reply bytes per second, None sends as fast as possible
+			faults (ACPServerFaults): fault injection settings, None injects no faults
+			max_getprop_names (int): reject getprop requests for more names than this, None accepts any number
+		
+		"""
+		self.password = password
+		self.features = features if features is not None else {}
+		self.latency = latency
+		self.bandwidth = bandwidth
+		self.faults = faults
+		self.max_getprop_names = max_getprop_names
+		
+		self._lock = threading.Lock()
+		# name -> raw packed value, as sent in getprop replies
+		self._properties = {}
+		for name, value in (properties or {}).iteritems():
+			self.set_property(name, value)
+		
+		# called as flash_handler(command, body_size, body_checksum) after a flash body was received
+		self.flash_handler = None
+		
+		self._server = None
+		self._thread = None
+		
+		self.connections = 0
+		self.requests = 0
+		self.faults_injected = 0
+		self.bytes_sent = 0
+		
+		self._handlers = {
+			1: self._handle_echo,
+			3: self._handle_flash,
+			5: self._handle_flash,
+			6: self._handle_flash,
+			0x14: self._handle_getprop,
+			0x15: self._handle_setprop,
+			0x1b: self._handle_feat,
+			}
+	
+	
+	def __enter__(self):
+		if self._server is None:
+			self.start()
+		return self
+	
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.stop()
+	
+	
+	@property
+	def address(self):
+		"""(host, port) the server is listening on"""
+		return self._server.server_address if self._server is not None else None
+	
+	
+	def start(self, host="127.0.0.1", port=0):
+		"""Start serving on a background thread
+		
+		Args:
+			host (str): address to listen on
+			port (int): port to listen on, 0 picks a free one, see address
+		
+		Returns:
+			(host, port) the server is listening on
+		
+		"""
+		self._server = _ACPThreadingTCPServer((host, port), _ACPServerRequestHandler)
+		self._server.emulator = self
+		self._thread = threading.Thread(target=self._server.serve_forever, name="acp-server")
+		self._thread.daemon = True
+		self._thread.start()
+		logging.info("ACP server emulator listening on {0}:{1}".format(*self.address))
+		return self.address
+	
+	
+	def serve_forever(self, host="", port=ACP_SERVER_PORT):
+		"""Serve on the calling thread until interrupted"""
+		self._server = _ACPThreadingTCPServer((host, port), _ACPServerRequestHandler)
+		self._server.emulator = self
+		try:
+			self._server.serve_forever()
+		finally:
+			self._server.server_close()
+			self._server = None
+	
+	
+	def stop(self):
+		"""Stop accepting connections, connections being served finish on their own threads"""
+		if self._server is None:
+			return
+		self._server.shutdown()
+		self._server.server_close()
+		self._thread.join()
+		self._server = None
+		self._thread = None
+	
+	
+	def get_property(self, name):
+		"""Get the raw packed value of a property, None if it is not set"""
+		with self._lock:
+			return self._properties.get(name)
+	
+	
+	def set_property(self, name, value):
+		"""Set a property, value is a raw packed string or a value accepted by ACPProperty
+		
+		Raises:
+			ACPPropertyError if the value is invalid for the property
+		
+		"""
+		value = ACPProperty(name, value).value
+		if type(value) == int:
+			value = ACPProperty._element_int_format.pack(value)
+		with self._lock:
+			self._properties[name] = value
+	
+	
+	def stats(self):
+		with self._lock:
+			return dict(connections=self.connections, requests=self.requests, faults=self.faults_injected, bytes_sent=self.bytes_sent)
+	
+	
+	def _count(self, **counts):
+		with self._lock:
+			for name, count in counts.iteritems():
+				setattr(self, name, getattr(self, name) + count)
+	
+	
+	def _serve_connection(self, sock, client_address):
+		session = ACPServerSession(client_address[0], self.password)
+		session.attach(sock)
+		self._count(connections=1)
+		logging.debug("serving ACP client {0}:{1}".format(*client_address))
+		
+		try:
+			while True:
+				raw_header = session.recv(ACPMessage.header_size)
+				if len(raw_header) < ACPMessage.header_size:
+					break
+				
+				try:
+					header = ACPMessage.parse_raw(raw_header)
+				except ACPMessageError as e:
+					logging.debug("dropping client {0}:{1}, bad request header: {2!s}".format(client_address[0], client_address[1], e))
+					break
+				self._count(requests=1)
+				
+				handler = self._handlers.get(header.command)
+				if header.command in [3, 5, 6]:
+					# flash bodies are streamed into the handler
+					error_code, body = handler(session, header)
+				else:
+					body = session.recv(header.body_size) if header.body_size > 0 else ""
+					if len(body) < max(header.body_size, 0):
+						break
+					if body and zlib.adler32(body) != header.body_checksum:
+						error_code, body = _error_code_checksum, ""
+					elif not self._check_password(header):
+						error_code, body = _error_code_password, ""
+					elif handler is None:
+						error_code, body = _error_code_unsupported, ""
+					else:
+						error_code, body = handler(header, body)
+				
+				if not self._send_reply(session, header.command, error_code, body):
+					break
+		except socket.error as e:
+			logging.debug("ACP client {0}:{1} connection error: {2!s}".format(client_address[0], client_address[1], e))
+		finally:
+			session.close()
+	
+	
+	def _check_password(self, header):
+		if self.password is None or header.command in [0x1a, 0x1b]:
+			return True
+		return header.key == _generate_acp_header_key(self.password)
+	
+	
+	def _send_reply(self, session, command, error_code, body):
+		"""Compose and send a reply, applying the configured latency, bandwidth and faults
+		
+		Returns:
+			False if the connection was closed by a fault
+		
+		"""
+		faults = self.faults
+		if faults is not None and faults.roll(faults.error):
+			self._count(faults_injected=1)
+			error_code, body = faults.error_code, ""
+		
+		reply = ACPMessage.compose_message_ex(0x00030001, 0, 0, command, error_code, "", body, None)
+		
+		truncate = False
+		if faults is not None:
+			if faults.roll(faults.bad_checksum):
+				self._count(faults_injected=1)
+				reply = bytearray(reply)
+				reply[ACPMessage._header_checksum_offset] ^= 0xff
+				reply = str(reply)
+			if faults.roll(faults.truncate):
+				self._count(faults_injected=1)
+				truncate = True
+				reply = reply[:faults.truncated_size(len(reply))]
+		
+		if self.latency:
+			time.sleep(self.latency)
+		self._send(session, reply)
+		
+		return not truncate
+	
+	
+	def _send(self, session, data):
+		if not self.bandwidth:
+			session.send(data)
+		else:
+			begin = time.time()
+			for offset in xrange(0, len(data), self._throttle_chunk_size):
+				chunk = data[offset:offset + self._throttle_chunk_size]
+				session.send(chunk)
+				delay = begin + (offset + len(chunk)) / float(self.bandwidth) - time.time()
+				if delay > 0:
+					time.sleep(delay)
+		self._count(bytes_sent=len(data))
+	
+	
+	def _handle_echo(self, header, body):
+		return 0, body
+	
+	
+	def _handle_getprop(self, header, body):
+		faults = self.faults
+		requested = ACPProperty.parse_raw_elements(body)
+		if self.max_getprop_names is not None and len(requested) > self.max_getprop_names:
+			return _error_code_request_size, ""
+		
+		elements = []
+		for name, flags, value in requested:
+			value = self.get_property(name)
+			if faults is not None and faults.roll(faults.element_error):
+				self._count(faults_injected=1)
+				elements.append((name, 1, _element_error_format.pack(faults.error_code)))
+			elif value is None:
+				elements.append((name, 1, _element_error_format.pack(_error_code_property)))
+			else:
+				elements.append((name, 0, value))
+		return 0, ACPProperty.compose_raw_elements(elements, terminate=True)
+	
+	
+	def _handle_setprop(self, header, body):
+		# the reply carries the error element of the first rejected property, or only the "null" element
+		for name, flags, value in ACPProperty.iter_raw_elements(body):
+			try:
+				self.set_property(name, value)
+			except ACPPropertyError as e:
+				logging.debug("rejecting value for property \"{0}\": {1!s}".format(name, e))
+				return 0, ACPProperty.compose_raw_elements([(name, 1, _element_error_format.pack(_error_code_property))])
+		return 0, ACPProperty.compose_raw_elements([], terminate=True)
+	
+	
+	def _handle_feat(self, header, body):
+		return 0, CFLBinaryPListComposer.compose(self.features)
+	
+	
+	def _handle_flash(self, session, header):
+		if header.body_size <= 0:
+			return _error_code_unsupported, ""
+		
+		# always drain the body so the connection stays in sync
+		checksum = 1
+		remaining_size = header.body_size
+		while remaining_size:
+			chunk = session.recv_view(min(remaining_size, self._flash_chunk_size))
+			if not len(chunk):
+				raise socket.error("connection closed while receiving flash body")
+			checksum = zlib.adler32(chunk.tobytes(), checksum)
+			remaining_size -= len(chunk)
+		
+		if checksum != header.body_checksum:
+			return _error_code_checksum, ""
+		if not self._check_password(header):
+			return _error_code_password, ""
+		
+		if self.flash_handler is not None:
+			self.flash_handler(header.command, header.body_size, checksum)
+		return 0, ""
@@ -1,12 +1,43 @@
+import errno
 import logging
+import select
 import socket
+import time
 
 from .encryption import ACPEncryption
+from .exception import *
 
 
 ACP_SERVER_PORT = 5009
 
+
+class _ACPRecvDeadline(object):
+	"""First byte and total deadlines for a single receive call"""
+	
+	def __init__(self, first_byte_timeout, total_timeout):
+		now = time.time()
+		self.first_byte = now + first_byte_timeout if first_byte_timeout else None
+		self.total = now + total_timeout if total_timeout else None
+		self.got_first_byte = False
+	
+	
+	def current(self):
+		"""Get the deadline that applies to the next wait
+		
+		Returns:
+			(deadline, exception_class), deadline is None if there is nothing to wait for
+		
+		"""
+		if not self.got_first_byte and self.first_byte is not None:
+			if self.total is None or self.first_byte < self.total:
+				return self.first_byte, ACPFirstByteTimeoutError
+		return self.total, ACPRecvTimeoutError
+
+
 class _ACPSession(object):
+	# received data is read ahead into this buffer, reads larger than it bypass it
+	_recv_buffer_size = 0x10000
+	
 	def __init__(self, target, password):
 		#XXX: how should we make this abstract enough to cover client and server?
 		self.target = target
@@ -18,22 +49,82 @@ class _ACPSession(object):
 		self.encrypt_method = None
 		self.decrypt_method = None
 		
+		self._recv_buffer = bytearray(self._recv_buffer_size)
+		self._recv_buffer_view = memoryview(self._recv_buffer)
+		self._recv_start = 0
+		self._recv_end = 0
+		
 		#XXX: AppleSRP hax
 		#self.SRP = None
 		#self.state = 0
 	
 	
-	def connect(self, port=ACP_SERVER_PORT):
+	def connect(self, port=ACP_SERVER_PORT, timeout=None, connect_timeout=None):
+		"""Connect to the target
+		
+		Args:
+			port (int): ACP server port
+			timeout (float): socket timeout applied to all later I/O, None blocks forever; expiry raises
+			                 ACPSendTimeoutError or ACPRecvTimeoutError
+			connect_timeout (float): deadline for establishing the connection, defaults to timeout
+		
+		Raises:
+			ACPConnectTimeoutError
+		
+		"""
+		if connect_timeout is None:
+			connect_timeout = timeout
+		
 		self.port = port
-		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		logging.info("connecting to host {0}:{1}".format(self.target, self.port))
-		self.sock.connect((self.target, self.port))
+		try:
+			self.sock = socket.create_connection((self.target, self.port), connect_timeout)
+		except socket.timeout:
+			raise ACPConnectTimeoutError("connecting to {0}:{1} timed out after {2}s".format(self.target, self.port, connect_timeout))
+		self.sock.settimeout(timeout)
+		self._recv_start = self._recv_end = 0
 	
 	
 	def close(self):
 		if self.sock:
 			self.sock.close()
 			self.sock = None
+		self._recv_start = self._recv_end = 0
+	
+	
+	def abort(self):
+		"""Shut the connection down from another thread, so I/O blocked on it fails right away"""
+		sock = self.sock
+		if sock:
+			try:
+				sock.shutdown(socket.SHUT_RDWR)
+			except socket.error:
+				pass
+	
+	
+	def is_connected(self):
+		"""Check without blocking whether the connection can still be used
+		
+		Note:
+			An idle connection should never be readable, so readable means EOF, a socket error, or
+			stray data that would desync the next reply
+		
+		"""
+		if not self.sock:
+			return False
+		if self._recv_end != self._recv_start:
+			return False
+		try:
+			# select() can't watch descriptors from FD_SETSIZE up, so use poll() where there is one
+			if hasattr(select, "poll"):
+				poller = select.poll()
+				poller.register(self.sock, select.POLLIN)
+				readable = poller.poll(0)
+			else:
+				readable, _, _ = select.select([self.sock], [], [], 0)
+		except (select.error, socket.error, ValueError):
+			return False
+		return not readable
 	
 	
 	def send(self, data):
@@ -41,72 +132,178 @@ class _ACPSession(object):
 			data = self.encrypt_method(data)
 		
 		if self.sock:
-			self.sock.sendall(data)
+			try:
+				self.sock.sendall(data)
+			except socket.timeout:
+				raise ACPSendTimeoutError("sending to {0}:{1} timed out".format(self.target, self.port))
 		#TODO: else? what if sock is not None but not valid in some other way?
 	
 	
-	def _recv_size(self, size):
-		recvd_chunks = []
-		recvd_size = 0
-		while True:
-			if recvd_size == size:
-				break
-			#XXX: this is broken for server receiving stream headers
-			data = self.sock.recv(size - recvd_size)
-			if not data:
-				break
-			recvd_chunks.append(data)
-			recvd_size += len(data)
+	def _wait_readable(self, deadline):
+		"""Block until the socket is readable
 		
-		return "".join(recvd_chunks)
-	
-	def _recv_size_timeout(self, size, timeout):
-		#XXX: blargh
-		self.sock.setblocking(0)
-		recvd_chunks = []
-		recvd_size = 0
+		Raises:
+			ACPFirstByteTimeoutError, ACPRecvTimeoutError
 		
-		begin=time.time()
+		"""
 		while True:
-			if recvd_size == size:
-				break
-			if recvd_chunks and time.time()-begin > timeout:
-				break
-			if time.time()-begin > timeout*2:
-				break
+			when, timeout_error = deadline.current()
+			if when is None:
+				return
+			remaining = when - time.time()
+			if remaining <= 0:
+				raise timeout_error("receive deadline expired")
 			
 			try:
-				#XXX: this is broken for server receiving stream headers
-				data = self.sock.recv(size - recvd_size)
-				if data:
-					recvd_chunks.append(data)
-					recvd_size += len(data)
-					begin = time.time()
+				if hasattr(select, "poll"):
+					poller = select.poll()
+					poller.register(self.sock, select.POLLIN)
+					if poller.poll(remaining * 1000):
+						return
 				else:
-					time.sleep(0.1)
-			except socket.error:
-				pass
+					readable, _, _ = select.select([self.sock], [], [], remaining)
+					if readable:
+						return
+			except select.error as e:
+				if e.args[0] != errno.EINTR:
+					raise
+	
+	
+	def _recv_into(self, view, deadline=None):
+		"""Receive into a writable memoryview, decrypting in place
+		
+		Returns:
+			number of bytes received, 0 on EOF
 		
-		#XXX: should non-blocking just be the default?
-		self.sock.setblocking(1)
-		return "".join(recvd_chunks)
+		Raises:
+			ACPFirstByteTimeoutError, ACPRecvTimeoutError if a deadline is given and expires
+			ACPRecvTimeoutError if the socket timeout expires
+		
+		"""
+		if deadline is not None:
+			self._wait_readable(deadline)
+		#XXX: this is broken for server receiving stream headers
+		try:
+			recvd_size = self.sock.recv_into(view)
+		except socket.timeout:
+			raise ACPRecvTimeoutError("receiving from {0}:{1} timed out".format(self.target, self.port))
+		if recvd_size and deadline is not None:
+			deadline.got_first_byte = True
+		if recvd_size and self.decrypt_method:
+			view[:recvd_size] = self.decrypt_method(view[:recvd_size].tobytes())
+		return recvd_size
 	
-
-	def recv(self, size, timeout=0):
+	
+	def _fill_recv_buffer(self, size, deadline=None):
+		"""Read ahead until at least size bytes are buffered
+		
+		Returns:
+			number of bytes buffered, less than size if the connection was closed
+		
+		"""
+		buffered_size = self._recv_end - self._recv_start
+		if buffered_size >= size:
+			return buffered_size
+		if buffered_size and deadline is not None:
+			deadline.got_first_byte = True
+		
+		# move the unread tail to the front if the request does not fit behind it
+		if self._recv_start + size > self._recv_buffer_size:
+			self._recv_buffer[:buffered_size] = self._recv_buffer[self._recv_start:self._recv_end]
+			self._recv_start = 0
+			self._recv_end = buffered_size
+		
+		while self._recv_end - self._recv_start < size:
+			recvd_size = self._recv_into(self._recv_buffer_view[self._recv_end:], deadline)
+			if not recvd_size:
+				break
+			self._recv_end += recvd_size
+		
+		return self._recv_end - self._recv_start
+	
+	
+	def _recv_view(self, size, deadline=None):
+		if size > self._recv_buffer_size:
+			raise ValueError("view size {0:#x} exceeds receive buffer size".format(size))
+		
 		if not self.sock:
-			#XXX: do nothing? throw an exception?
-			return ""
+			return self._recv_buffer_view[0:0]
+		
+		size = min(self._fill_recv_buffer(size, deadline), size)
+		view = self._recv_buffer_view[self._recv_start:self._recv_start + size]
+		self._recv_start += size
+		return view
+	
+	
+	def recv_view(self, size, timeout=0, first_byte_timeout=None):
+		"""Receive up to size bytes without copying them out of the receive buffer
+		
+		Note:
+			The returned memoryview is only valid until the next receive call on this session
 		
-		data = ""
-		if timeout:
-			data = self._recv_size_timeout(size, timeout)
-		else:
-			data = self._recv_size(size)
+		Args:
+			size (int): number of bytes, at most the receive buffer size
+			timeout (float): total deadline for the whole read, 0 waits forever
+			first_byte_timeout (float): deadline for the first byte to arrive, defaults to timeout
 		
-		if self.decrypt_method:
-			data = self.decrypt_method(data)
+		Returns:
+			memoryview of the received data, shorter than size if the connection was closed
 		
-		return data
+		Raises:
+			ACPFirstByteTimeoutError, ACPRecvTimeoutError
+		
+		"""
+		deadline = None
+		if timeout or first_byte_timeout:
+			deadline = _ACPRecvDeadline(first_byte_timeout, timeout)
+		return self._recv_view(size, deadline)
+	
+	
+	def _recv_size(self, size, deadline=None):
+		if size <= self._recv_buffer_size:
+			return self._recv_view(size, deadline).tobytes()
+		
+		# bulk read straight into one buffer sized for the whole reply
+		data = bytearray(size)
+		recvd_size = self._recv_end - self._recv_start
+		data[:recvd_size] = self._recv_buffer[self._recv_start:self._recv_end]
+		self._recv_start = self._recv_end = 0
+		if recvd_size and deadline is not None:
+			deadline.got_first_byte = True
+		
+		view = memoryview(data)
+		while recvd_size < size:
+			chunk_size = self._recv_into(view[recvd_size:], deadline)
+			if not chunk_size:
+				return str(data[:recvd_size])
+			recvd_size += chunk_size
+		
+		return str(data)
+	
+	
+	def recv(self, size, timeout=0, first_byte_timeout=None):
+		"""Receive size bytes
+		
+		Args:
+			size (int): number of bytes to receive
+			timeout (float): total deadline for the whole read, 0 waits forever
+			first_byte_timeout (float): deadline for the first byte to arrive, defaults to timeout
+		
+		Returns:
+			received data, shorter than size if the connection was closed
+		
+		Raises:
+			ACPFirstByteTimeoutError, ACPRecvTimeoutError
+		
+		"""
+		if not self.sock:
+			#XXX: do nothing? throw an exception?
+			return ""
+		
+		deadline = None
+		if timeout or first_byte_timeout:
+			deadline = _ACPRecvDeadline(first_byte_timeout, timeout)
+		return self._recv_size(size, deadline)
 
 
 class ACPClientSession(_ACPSession):
@@ -118,6 +315,14 @@ class ACPClientSession(_ACPSession):
 
 
 class ACPServerSession(_ACPSession):
+	def attach(self, sock, timeout=None):
+		"""Serve a connected socket returned by accept()"""
+		self.sock = sock
+		self.port = sock.getsockname()[1]
+		self.sock.settimeout(timeout)
+		self._recv_start = self._recv_end = 0
+	
+	
 	def enable_encryption(self, key, client_iv, server_iv):
 		self.encryption_context = ACPEncryption(key, client_iv, server_iv)
 		
@@ -0,0 +1,280 @@
+import mmap
+import os
+import struct
+
+from .exception import ACPError
+from .property import ACPProperty
+
+
+class ACPSnapshotError(ACPError):
+	"""Exception raised for malformed snapshot files"""
+	pass
+
+
+"""
+Snapshot file layout, all integers big endian:
+
+	header        magic, version, target/name/record counts, section offsets
+	payload       raw values, in the order they were added
+	targets       per target: first record, record count, u16 length, address
+	names         4 byte property names
+	records       one column each for target id, name id, flags, size (u32) and payload offset (u64),
+	              records sorted by target then name
+	name index    per name: first entry, entry count; then the record ids of each name, as u32
+"""
+_snapshot_magic = "ACPS"
+_snapshot_version = 1
+_snapshot_header_format = struct.Struct("!4s4I5Q")
+_snapshot_target_format = struct.Struct("!2IH")
+_snapshot_range_format = struct.Struct("!2I")
+_snapshot_u32_format = struct.Struct("!I")
+_snapshot_u64_format = struct.Struct("!Q")
+
+
+def _pack_column(code, values):
+	return struct.pack("!{0}{1}".format(len(values), code), *values)
+
+
+class ACPSnapshotWriter(object):
+	"""Write (router, property) records with raw values into a columnar snapshot file
+	
+	Values are written out as they are added, only the record columns are kept in memory.
+	
+	"""
+	
+	def __init__(self, path):
+		self.path = path
+		self.file = open(path, "wb")
+		self.file.write("\x00" * _snapshot_header_format.size)
+		self._payload_size = 0
+		
+		self.targets = []
+		self._target_ids = {}
+		self.names = []
+		self._name_ids = {}
+		
+		self._target_ids_column = []
+		self._name_ids_column = []
+		self._flags_column = []
+		self._offsets_column = []
+		self._sizes_column = []
+	
+	
+	def __enter__(self):
+		return self
+	
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			# don't leave a file behind that looks complete
+			self.file.close()
+			os.remove(self.path)
+	
+	
+	def __len__(self):
+		return len(self._flags_column)
+	
+	
+	def add(self, target, name, flags, data):
+		"""Append one raw property element of a router"""
+		target_id = self._target_ids.get(target)
+		if target_id is None:
+			target_id = self._target_ids[target] = len(self.targets)
+			self.targets.append(target)
+		name_id = self._name_ids.get(name)
+		if name_id is None:
+			name_id = self._name_ids[name] = len(self.names)
+			self.names.append(name)
+		
+		self._target_ids_column.append(target_id)
+		self._name_ids_column.append(name_id)
+		self._flags_column.append(flags)
+		self._offsets_column.append(self._payload_size)
+		self._sizes_column.append(len(data))
+		
+		self.file.write(data)
+		self._payload_size += len(data)
+	
+	
+	def add_batch(self, batch):
+		"""Append every record of an ACPPropertyBatch"""
+		for index in xrange(len(batch)):
+			self.add(batch.targets[batch.target_ids[index]], batch.names[index], int(batch.flags[index]), batch.get_raw(index))
+	
+	
+	def close(self):
+		"""Write the tables and index, and the header that points at them"""
+		if self.file.closed:
+			return
+		
+		order = sorted(xrange(len(self)), key=lambda i: (self.targets[self._target_ids_column[i]], self.names[self._name_ids_column[i]]))
+		payload_offset = _snapshot_header_format.size
+		
+		targets_offset = payload_offset + self._payload_size
+		target_ranges = {}
+		for record_id, i in enumerate(order):
+			start, count = target_ranges.get(self._target_ids_column[i], (record_id, 0))
+			target_ranges[self._target_ids_column[i]] = (start, count + 1)
+		for target_id, target in enumerate(self.targets):
+			start, count = target_ranges[target_id]
+			self.file.write(_snapshot_target_format.pack(start, count, len(target)) + target)
+		
+		names_offset = self.file.tell()
+		self.file.write("".join(self.names))
+		
+		records_offset = self.file.tell()
+		self.file.write(_pack_column("I", [self._target_ids_column[i] for i in order]))
+		self.file.write(_pack_column("I", [self._name_ids_column[i] for i in order]))
+		self.file.write(_pack_column("I", [self._flags_column[i] for i in order]))
+		self.file.write(_pack_column("I", [self._sizes_column[i] for i in order]))
+		self.file.write(_pack_column("Q", [self._offsets_column[i] + payload_offset for i in order]))
+		
+		name_index_offset = self.file.tell()
+		name_records = [[] for name in self.names]
+		for record_id, i in enumerate(order):
+			name_records[self._name_ids_column[i]].append(record_id)
+		start = 0
+		for record_ids in name_records:
+			self.file.write(_snapshot_range_format.pack(start, len(record_ids)))
+			start += len(record_ids)
+		for record_ids in name_records:
+			self.file.write(_pack_column("I", record_ids))
+		
+		self.file.seek(0)
+		self.file.write(_snapshot_header_format.pack(_snapshot_magic,
+		                                             _snapshot_version,
+		                                             len(self.targets),
+		                                             len(self.names),
+		                                             len(self),
+		                                             payload_offset,
+		                                             targets_offset,
+		                                             names_offset,
+		                                             records_offset,
+		                                             name_index_offset))
+		self.file.close()
+
+
+class ACPSnapshotReader(object):
+	"""Random access to a snapshot file through a memory map
+	
+	Only the target and name tables are read up front, records and values are read from the map when
+	they are accessed.
+	
+	"""
+	
+	def __init__(self, path):
+		with open(path, "rb") as f:
+			try:
+				self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			except ValueError:
+				raise ACPSnapshotError("snapshot file is empty")
+		
+		try:
+			(magic, version, target_count, name_count, record_count, payload_offset, targets_offset, names_offset,
+			 records_offset, name_index_offset) = _snapshot_header_format.unpack_from(self._map)
+		except struct.error:
+			raise ACPSnapshotError("snapshot file is truncated")
+		if magic != _snapshot_magic:
+			raise ACPSnapshotError("bad snapshot magic")
+		if version != _snapshot_version:
+			raise ACPSnapshotError("unsupported snapshot version {0}".format(version))
+		if name_index_offset + name_count * _snapshot_range_format.size + record_count * 4 > len(self._map):
+			raise ACPSnapshotError("snapshot file is truncated")
+		
+		self.targets = []
+		self._target_ranges = {}
+		offset = targets_offset
+		for target_id in xrange(target_count):
+			start, count, size = _snapshot_target_format.unpack_from(self._map, offset)
+			offset += _snapshot_target_format.size
+			target = self._map[offset:offset + size]
+			offset += size
+			self.targets.append(target)
+			self._target_ranges[target] = (start, count)
+		
+		self.names = [self._map[names_offset + i * 4:names_offset + i * 4 + 4] for i in xrange(name_count)]
+		self._name_ids = dict((name, name_id) for name_id, name in enumerate(self.names))
+		
+		self._record_count = record_count
+		self._target_ids_offset = records_offset
+		self._name_ids_offset = self._target_ids_offset + record_count * 4
+		self._flags_offset = self._name_ids_offset + record_count * 4
+		self._sizes_offset = self._flags_offset + record_count * 4
+		self._offsets_offset = self._sizes_offset + record_count * 4
+		self._name_ranges_offset = name_index_offset
+		self._name_records_offset = name_index_offset + name_count * _snapshot_range_format.size
+	
+	
+	def __enter__(self):
+		return self
+	
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+	
+	
+	def __len__(self):
+		return self._record_count
+	
+	
+	def close(self):
+		self._map.close()
+	
+	
+	def _u32(self, column_offset, index):
+		return _snapshot_u32_format.unpack_from(self._map, column_offset + index * 4)[0]
+	
+	
+	def find(self, target=None, name=None):
+		"""Get the ids of the records of a router, of a property, or of one property of one router"""
+		if target is not None:
+			start, count = self._target_ranges.get(target, (0, 0))
+			if name is None:
+				return range(start, start + count)
+			name_id = self._name_ids.get(name)
+			return [i for i in xrange(start, start + count) if self._u32(self._name_ids_offset, i) == name_id]
+		
+		if name is not None:
+			name_id = self._name_ids.get(name)
+			if name_id is None:
+				return []
+			start, count = _snapshot_range_format.unpack_from(self._map, self._name_ranges_offset + name_id * _snapshot_range_format.size)
+			return [self._u32(self._name_records_offset, i) for i in xrange(start, start + count)]
+		
+		return range(self._record_count)
+	
+	
+	def get_raw(self, index):
+		"""Get the raw value of a record as a read-only buffer into the map, without copying it"""
+		(offset, ) = _snapshot_u64_format.unpack_from(self._map, self._offsets_offset + index * 8)
+		return buffer(self._map, offset, self._u32(self._sizes_offset, index))
+	
+	
+	def get_record(self, index):
+		"""
+		Returns:
+			(target, name, flags, value), value is the raw string
+		
+		"""
+		if not 0 <= index < self._record_count:
+			raise IndexError("snapshot record index out of range")
+		return (self.targets[self._u32(self._target_ids_offset, index)],
+		        self.names[self._u32(self._name_ids_offset, index)],
+		        self._u32(self._flags_offset, index),
+		        str(self.get_raw(index)))
+	
+	
+	def get_property(self, index):
+		"""Build an ACPProperty for a record that does not have an error flag"""
+		target, name, flags, value = self.get_record(index)
+		if flags & 1:
+			raise ACPSnapshotError("record for property \"{0}\" of {1} holds an error code".format(name, target))
+		return ACPProperty(name, value)
+	
+	
+	def iter_records(self, target=None, name=None):
+		"""Yield (target, name, flags, value) for the records matching find()"""
+		for index in self.find(target, name):
+			yield self.get_record(index)
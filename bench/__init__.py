@@ -0,0 +1,61 @@
+"""Standalone benchmarks, run each from the repository root, e.g. python -m bench.recv_latency"""
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict
+
+from Crypto.Cipher import AES
+
+from acp.basebinary import Basebinary, _derive_key
+
+
+def best_time(function, repeat=3):
+	"""Run function repeat times and get the fastest wall time in seconds"""
+	best = None
+	for i in range(repeat):
+		begin = time.time()
+		function()
+		elapsed = time.time() - begin
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+
+def report(label, value, unit=""):
+	if isinstance(value, float):
+		print "{0:<48} {1:>12.1f} {2}".format(label, value, unit)
+	else:
+		print "{0:<48} {1:>12} {2}".format(label, value, unit)
+
+
+def sample_plist_object(entry_count):
+	"""Build a list of client-table-like dicts, roughly 70 bytes each once composed"""
+	return [OrderedDict([(u"mac", "\x00\x11\x22" + chr(i >> 16 & 0xff) + chr(i >> 8 & 0xff) + chr(i & 0xff)),
+	                     (u"name", u"client-{0:06d}".format(i)),
+	                     (u"rssi", i % 100),
+	                     (u"rates", [1, 2, 5, 11]),
+	                     (u"active", bool(i & 1))])
+	        for i in xrange(entry_count)]
+
+
+def write_basebinary(f, size, model=120):
+	"""Write an encrypted basebinary with size bytes of random inner data, one chunk at a time
+	
+	Returns:
+		Adler-32 of the inner data
+	
+	"""
+	header = Basebinary._header_format.pack(Basebinary._header_magic, 3, model, 1, 0, 0, 0, 2, 0)
+	key, iv = _derive_key(model), Basebinary._header_magic + chr(3)
+	f.write(header)
+	checksum = zlib.adler32(header)
+	inner_checksum = 1
+	for offset in xrange(0, size, Basebinary._chunk_length):
+		chunk = os.urandom(min(Basebinary._chunk_length, size - offset))
+		checksum = zlib.adler32(chunk, checksum)
+		inner_checksum = zlib.adler32(chunk, inner_checksum)
+		aligned_length = len(chunk) & ~0xF
+		f.write(AES.new(key, AES.MODE_CBC, iv).encrypt(chunk[:aligned_length]) + chunk[aligned_length:])
+	f.write(struct.pack(">I", checksum & 0xffffffff))
+	return inner_checksum
@@ -0,0 +1,79 @@
+"""Basebinary.decrypt throughput, serially and with thread and process pools
+
+The old decryption called the cipher once per 16 byte block and grew its result by concatenation; an
+inline copy of it is timed on a smaller image.
+
+"""
+import zlib
+from cStringIO import StringIO
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+
+from Crypto.Cipher import AES
+
+from acp.basebinary import Basebinary, _derive_key
+
+from . import best_time, report, write_basebinary
+
+
+def _old_decrypt_chunk(encrypted_data, key, iv):
+	cipher = AES.new(key, AES.MODE_CBC, iv)
+	decrypted_data = ""
+	bytes_left = len(encrypted_data)
+	while bytes_left:
+		if bytes_left > 0x10:
+			decrypted_data += cipher.decrypt(encrypted_data[-bytes_left:-(bytes_left-0x10)])
+			bytes_left -= 0x10
+		elif bytes_left == 0x10:
+			decrypted_data += cipher.decrypt(encrypted_data[-bytes_left:])
+			bytes_left = 0
+		else:
+			decrypted_data += encrypted_data[-bytes_left:]
+			bytes_left = 0
+	return decrypted_data
+
+
+def _old_decrypt(data, model, byte_0x0F):
+	key, iv = _derive_key(model), Basebinary._header_magic + chr(byte_0x0F)
+	decrypted_data = ""
+	remaining_length = len(data)
+	chunk_length = Basebinary._chunk_length
+	while remaining_length:
+		if remaining_length > chunk_length:
+			decrypted_data += _old_decrypt_chunk(data[-remaining_length:-(remaining_length-chunk_length)], key, iv)
+			remaining_length -= chunk_length
+		else:
+			decrypted_data += _old_decrypt_chunk(data[-remaining_length:], key, iv)
+			remaining_length = 0
+	return decrypted_data
+
+
+def _encrypted_inner_data(size):
+	f = StringIO()
+	inner_checksum = write_basebinary(f, size)
+	return f.getvalue()[Basebinary.header_size:-4], inner_checksum
+
+
+def _run(label, decrypt, size):
+	data, inner_checksum = _encrypted_inner_data(size)
+	assert zlib.adler32(decrypt(data, 120, 3)) == inner_checksum
+	elapsed = best_time(lambda: decrypt(data, 120, 3))
+	report("{0}, {1} MB".format(label, size >> 20), size / elapsed / 0x100000, "MB/s")
+
+
+def main(size=16 << 20, pool_size=4):
+	print "{0} CPUs".format(cpu_count())
+	_run("per-block decryption (before)", _old_decrypt, 2 << 20)
+	_run("serial", Basebinary.decrypt, size)
+	
+	for label, pool in [("{0} threads".format(pool_size), ThreadPool(pool_size)),
+	                    ("{0} processes".format(pool_size), Pool(pool_size))]:
+		try:
+			_run(label, lambda data, model, byte_0x0F: Basebinary.decrypt(data, model, byte_0x0F, pool), size)
+		finally:
+			pool.close()
+			pool.join()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,57 @@
+"""Streaming basebinary decryption of a synthetic 64 MB image
+
+parse_stream decrypts, checksums and writes out the image one chunk at a time. The peak resident size
+after it is compared with the peak after Basebinary.parse, which holds the encrypted and decrypted images
+in memory at once.
+
+"""
+import os
+import resource
+import tempfile
+import time
+import zlib
+
+from acp.basebinary import Basebinary
+
+from . import report, write_basebinary
+
+
+def _peak_rss():
+	# kilobytes on Linux
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main(size=64 << 20):
+	directory = tempfile.mkdtemp()
+	image_path = os.path.join(directory, "image.basebinary")
+	output_path = os.path.join(directory, "image.out")
+	try:
+		with open(image_path, "wb") as f:
+			inner_checksum = write_basebinary(f, size)
+		report("peak RSS before decrypting", _peak_rss(), "MB")
+		
+		begin = time.time()
+		with open(image_path, "rb") as infile, open(output_path, "wb") as outfile:
+			Basebinary.parse_stream(infile, outfile)
+		elapsed = time.time() - begin
+		report("parse_stream, {0} MB".format(size >> 20), size / elapsed / 0x100000, "MB/s")
+		report("peak RSS after parse_stream", _peak_rss(), "MB")
+		
+		with open(output_path, "rb") as f:
+			assert zlib.adler32(f.read()) == inner_checksum
+		
+		begin = time.time()
+		with open(image_path, "rb") as f:
+			Basebinary.parse(f.read())
+		elapsed = time.time() - begin
+		report("parse in memory, {0} MB".format(size >> 20), size / elapsed / 0x100000, "MB/s")
+		report("peak RSS after parse in memory", _peak_rss(), "MB")
+	finally:
+		for path in [image_path, output_path]:
+			if os.path.exists(path):
+				os.remove(path)
+		os.rmdir(directory)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,92 @@
+"""cflbinary plist compose time for large dicts and client tables
+
+Compares writing every object into one shared bytearray against an inline copy of the composer it
+replaced, which returned a string per object and concatenated it into its parent.
+
+"""
+import logging
+import struct
+from collections import OrderedDict
+from math import log
+
+from acp.cflbinary import CFLBinaryPListComposer
+
+from . import best_time, report, sample_plist_object
+
+
+def _old_pack_object(obj):
+	data = ""
+	object_type = type(obj)
+	
+	if object_type == type(None):
+		data += "\x00"
+	
+	elif object_type == bool:
+		data += "\x09" if obj else "\x08"
+	
+	elif object_type == int:
+		buf = ""
+		for fmt in [">B", ">H", ">I", ">Q"]:
+			try:
+				buf = struct.pack(fmt, obj)
+			except struct.error:
+				logging.debug("XXX: skipping {0}".format(fmt))
+			else:
+				break
+		data += chr(0x10 + int(log(len(buf), 2)))
+		data += buf
+	
+	elif object_type == str:
+		data_len = len(obj)
+		if data_len < 0xF:
+			data += chr(0x40 + data_len)
+		else:
+			data += chr(0x4F)
+			data += _old_pack_object(data_len)
+		data += obj
+	
+	elif object_type == unicode:
+		data += "\x70"
+		data += obj.encode("utf-8")
+		data += "\x00"
+	
+	elif object_type == list:
+		data += "\xA0"
+		for element in obj:
+			data += _old_pack_object(element)
+		data += "\x00"
+	
+	elif object_type in [dict, OrderedDict]:
+		data += "\xD0"
+		for k, v in obj.iteritems():
+			data += _old_pack_object(k)
+			data += _old_pack_object(v)
+		data += "\x00"
+	
+	else:
+		raise TypeError("type {0} is not handled by the benchmark copy".format(object_type))
+	
+	return data
+
+
+def _old_compose(obj):
+	return "CFB0" + _old_pack_object(obj) + "END!"
+
+
+def _run(label, obj):
+	assert _old_compose(obj) == CFLBinaryPListComposer.compose(obj)
+	size = len(CFLBinaryPListComposer.compose(obj))
+	for composer_label, compose in [("before", _old_compose), ("shared buffer", CFLBinaryPListComposer.compose)]:
+		elapsed = best_time(lambda: compose(obj))
+		report("{0}, {1}".format(label, composer_label), 1000 * elapsed, "ms ({0:.1f} MB/s)".format(size / elapsed / 0x100000))
+
+
+def main():
+	_run("100k-key dict", OrderedDict((u"key{0}".format(i), i * 1000) for i in xrange(100000)))
+	_run("10k x 4 KB value dict", OrderedDict((u"key{0}".format(i), "\xa5" * 0x1000) for i in xrange(10000)))
+	_run("15k-entry client table", sample_plist_object(15000))
+	_run("100 x 1000-key dicts", OrderedDict((u"outer{0}".format(j), OrderedDict((u"key{0}".format(i), i) for i in xrange(1000))) for j in xrange(100)))
+
+
+if __name__ == "__main__":
+	main()
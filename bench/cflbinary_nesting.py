@@ -0,0 +1,67 @@
+"""cflbinary plist parse time for wide and deeply nested containers
+
+Compares the explicit-stack parser with the recursive one it replaced, reproduced inline on top of the
+current object unpacker. The recursive parser fails once nesting reaches the interpreter recursion limit.
+
+"""
+import sys
+from collections import OrderedDict
+
+from acp.cflbinary import CFLBinaryPListComposer, CFLBinaryPListParser
+
+from . import best_time, report
+
+
+def _old_unpack_object(data, offset):
+	obj, offset = CFLBinaryPListParser._unpack_object(data, offset)
+	if type(obj) is list:
+		while True:
+			element, offset = _old_unpack_object(data, offset)
+			if element == None:
+				break
+			obj.append(element)
+	elif type(obj) is OrderedDict:
+		while True:
+			key, offset = _old_unpack_object(data, offset)
+			if key == None:
+				break
+			obj[key], offset = _old_unpack_object(data, offset)
+	return obj, offset
+
+
+def _old_parse(data):
+	return _old_unpack_object(data, 4)[0]
+
+
+def _nested(depth):
+	root = obj = []
+	for i in xrange(depth - 1):
+		child = [i]
+		obj.append(child)
+		obj = child
+	return root
+
+
+def _run(label, obj):
+	data = CFLBinaryPListComposer.compose(obj)
+	for parser_label, parse in [("recursive (before)", _old_parse),
+	                            ("explicit stack", lambda data: CFLBinaryPListParser.parse(data, max_depth=0x100000))]:
+		try:
+			elapsed = best_time(lambda: parse(data))
+		except RuntimeError:
+			report("{0}, {1}".format(label, parser_label), "failed", "(recursion limit)")
+			continue
+		report("{0}, {1}".format(label, parser_label), 1000 * elapsed, "ms")
+
+
+def main():
+	print "recursion limit {0}".format(sys.getrecursionlimit())
+	_run("dict of 100000 keys", OrderedDict((u"key{0}".format(i), i) for i in xrange(100000)))
+	_run("array of 200000 ints", range(200000))
+	_run("10000 arrays of 10 dicts", [[OrderedDict([(u"a", i), (u"b", [i])]) for i in range(10)] for j in xrange(10000)])
+	for depth in [100, 500, 5000, 100000]:
+		_run("arrays nested {0} deep".format(depth), _nested(depth))
+
+
+if __name__ == "__main__":
+	main()
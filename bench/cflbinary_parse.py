@@ -0,0 +1,93 @@
+"""cflbinary plist parse time against plist size
+
+The parser unpacks objects at an offset into the original data. The slicing parser it replaced copied
+the rest of the plist for every object it read, so its time grows with the square of the size; an inline
+copy of it, reduced to the object types used here, is timed on smaller plists.
+
+"""
+from acp.cflbinary import CFLBinaryPListComposer, CFLBinaryPListParser
+
+from . import best_time, report, sample_plist_object
+
+
+def _lslice(data, size):
+	return data[:size], data[size:]
+
+
+def _old_unpack_object(data):
+	marker, data = _lslice(data, 1)
+	marker = ord(marker)
+	object_type = marker & 0xF0
+	object_info = marker & 0x0F
+	
+	if object_type == 0x00:
+		return {0x00: None, 0x08: False, 0x09: True}[object_info], data
+	
+	elif object_type == 0x10:
+		int_bytes, data = _lslice(data, 2**object_info)
+		return int(int_bytes.encode("hex"), 16), data
+	
+	elif object_type == 0x40:
+		return _lslice(data, object_info)
+	
+	elif object_type == 0x70:
+		raw = ""
+		while True:
+			byte, data = _lslice(data, 1)
+			if byte == "\x00":
+				break
+			raw += byte
+		return raw.decode("utf-8"), data
+	
+	elif object_type == 0xA0:
+		obj = []
+		while True:
+			element, data = _old_unpack_object(data)
+			if element == None:
+				break
+			obj.append(element)
+		return obj, data
+	
+	elif object_type == 0xD0:
+		keys = []
+		values = []
+		while True:
+			key, data = _old_unpack_object(data)
+			if key == None:
+				break
+			keys.append(key)
+			value, data = _old_unpack_object(data)
+			values.append(value)
+		return dict(zip(keys, values)), data
+	
+	raise ValueError("object type {0:#x} is not handled by the benchmark copy".format(object_type))
+
+
+def _old_parse(data):
+	header, data = _lslice(data, 4)
+	return _old_unpack_object(data)[0]
+
+
+def _sample_plist(size):
+	# about 70 bytes per entry
+	return CFLBinaryPListComposer.compose(sample_plist_object(size // 70))
+
+
+def _run(label, parse, size):
+	data = _sample_plist(size)
+	elapsed = best_time(lambda: parse(data), repeat=3 if size < 0x100000 else 1)
+	report("{0}, {1} KB".format(label, len(data) // 1024), 1000 * elapsed, "ms ({0:.1f} MB/s)".format(len(data) / elapsed / 0x100000))
+
+
+def main():
+	data = _sample_plist(0x8000)
+	assert _old_parse(data) == CFLBinaryPListParser.parse(data)
+	
+	for size in [0x8000, 0x10000, 0x20000, 0x40000]:
+		_run("slicing parser (before)", _old_parse, size)
+	for size in [0x8000, 0x40000, 0x100000, 0x200000, 0x400000, 0x800000]:
+		_run("offset parser", CFLBinaryPListParser.parse, size)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,49 @@
+"""Bulk property element compose and parse throughput
+
+Compares compose_raw_elements and iter_raw_elements against composing one element at a time with
+compose_raw_element, and parsing by slicing each element header and value off the front of the data.
+
+"""
+from acp.property import ACPProperty
+
+from . import best_time, report
+
+
+def _old_compose(elements):
+	return "".join([ACPProperty.compose_raw_element(flags, ACPProperty(name, value)) for name, flags, value in elements])
+
+
+def _old_parse(data):
+	elements = []
+	while data:
+		name, flags, size = ACPProperty.parse_raw_element_header(data[:ACPProperty.element_header_size])
+		data = data[ACPProperty.element_header_size:]
+		value, data = data[:size], data[size:]
+		if name == ACPProperty.null_name and value == ACPProperty.null_value:
+			break
+		elements.append((name, flags, value))
+	return elements
+
+
+def _run(label, elements):
+	data = ACPProperty.compose_raw_elements(elements)
+	assert data == _old_compose(elements)
+	assert ACPProperty.parse_raw_elements(data) == _old_parse(data)
+	
+	for codec_label, compose, parse in [("before", _old_compose, _old_parse),
+	                                    ("bulk", ACPProperty.compose_raw_elements, ACPProperty.parse_raw_elements)]:
+		elapsed = best_time(lambda: compose(elements))
+		report("compose {0}, {1}".format(label, codec_label), 1000 * elapsed, "ms ({0:.0f}k elements/s)".format(len(elements) / elapsed / 1000))
+		elapsed = best_time(lambda: parse(data))
+		report("parse {0}, {1}".format(label, codec_label), 1000 * elapsed, "ms ({0:.0f}k elements/s)".format(len(elements) / elapsed / 1000))
+
+
+def main():
+	names = ACPProperty.get_supported_property_names()
+	_run("10k getprop names", [(names[i % len(names)], 0, None) for i in xrange(10000)])
+	_run("10k values of 64 bytes", [("syNm", 0, "v" * 64) for i in xrange(10000)])
+	_run("100 values of 16 KB", [("syNm", 0, "v" * 0x4000) for i in xrange(100)])
+
+
+if __name__ == "__main__":
+	main()
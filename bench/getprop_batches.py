@@ -0,0 +1,151 @@
+"""Requests and wall time to read every supported property from a local getprop responder
+
+Compares one getprop request per property, one request for everything, and get_properties_batched with
+and without pipelining, against a responder that delays every reply. The last run also makes the
+responder flag a share of the elements as errors, which get_properties_batched retries one by one.
+
+"""
+import os
+import random
+import socket
+import SocketServer
+import struct
+import sys
+import threading
+import time
+
+from acp.cflbinary import CFLBinaryPListComposer
+from acp.client import ACPClient
+from acp.exception import ACPPropertyError
+from acp.message import ACPMessage
+from acp.property import ACPProperty
+
+from . import report
+
+
+_values_by_type = {
+	"str": "value",
+	"dec": 1,
+	"hex": 1,
+	"mac": "00:11:22:33:44:55",
+	"bin": "\x00\x00\x00\x00",
+	"cfb": CFLBinaryPListComposer.compose({"key": "value"}),
+	"log": "log line\n",
+	}
+
+
+def _properties():
+	"""Get name -> raw value for every supported property that accepts a generic value of its type"""
+	properties = {}
+	for name in ACPProperty.get_supported_property_names():
+		try:
+			value = ACPProperty(name, _values_by_type[ACPProperty.get_property_info_string(name, "type")]).value
+		except ACPPropertyError:
+			# a few properties only accept specific values
+			continue
+		properties[name] = struct.pack(">I", value) if type(value) == int else value
+	return properties
+
+
+def _recv_exactly(sock, size):
+	data = ""
+	while len(data) < size:
+		chunk = sock.recv(size - len(data))
+		if not chunk:
+			return None
+		data += chunk
+	return data
+
+
+class _GetpropHandler(SocketServer.BaseRequestHandler):
+	"""Answer getprop requests from the server's property dict, counting requests"""
+	
+	def handle(self):
+		server = self.server
+		while True:
+			raw_header = _recv_exactly(self.request, ACPMessage.header_size)
+			if raw_header is None:
+				return
+			header = ACPMessage.parse_raw(raw_header)
+			body = _recv_exactly(self.request, header.body_size) if header.body_size > 0 else ""
+			server.requests += 1
+			
+			reply = []
+			offset = 0
+			while offset + ACPProperty.element_header_size <= len(body):
+				name, flags, size = ACPProperty.parse_raw_element_header(body[offset:offset + ACPProperty.element_header_size])
+				offset += ACPProperty.element_header_size + size
+				if name == "\x00\x00\x00\x00":
+					break
+				if server.random.random() < server.element_error:
+					reply.append(ACPProperty.compose_raw_element_header(name, 1, 4) + struct.pack(">i", -10))
+				else:
+					value = server.properties[name]
+					reply.append(ACPProperty.compose_raw_element_header(name, 0, len(value)) + value)
+			reply.append(ACPProperty.compose_raw_element_header("\x00\x00\x00\x00", 0, 4) + "\x00\x00\x00\x00")
+			
+			time.sleep(server.latency)
+			self.request.sendall(ACPMessage.compose_message_ex(0x00030001, 0, 0, header.command, 0, "", "".join(reply), None))
+
+
+def _run(label, fetch, properties, latency, element_error=0.0):
+	server = SocketServer.ThreadingTCPServer(("127.0.0.1", 0), _GetpropHandler)
+	server.daemon_threads = True
+	server.properties = properties
+	server.latency = latency
+	server.element_error = element_error
+	server.random = random.Random(1)
+	server.requests = 0
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	
+	try:
+		client = ACPClient(server.server_address[0])
+		client.connect(server.server_address[1], 10)
+		names = sorted(properties)
+		
+		# per-property errors are printed by the client
+		stdout = sys.stdout
+		sys.stdout = open(os.devnull, "w")
+		try:
+			begin = time.time()
+			properties = fetch(client, names)
+			elapsed = time.time() - begin
+		finally:
+			sys.stdout.close()
+			sys.stdout = stdout
+		
+		client.close()
+	finally:
+		server.shutdown()
+		server.server_close()
+	
+	report("{0}, requests".format(label), server.requests)
+	report("{0}, properties".format(label), len(properties))
+	report("{0}, time".format(label), 1000 * elapsed, "ms")
+
+
+def main(latency=0.002, batch_size=16, element_error=0.05):
+	properties = _properties()
+	print "{0} properties, {1} ms reply latency".format(len(properties), latency * 1000)
+	
+	_run("one request per property",
+	     lambda client, names: [prop for name in names for prop in client.get_properties([name])],
+	     properties, latency)
+	_run("one request",
+	     lambda client, names: client.get_properties(names),
+	     properties, latency)
+	_run("batches of {0}".format(batch_size),
+	     lambda client, names: client.get_properties_batched(names, batch_size),
+	     properties, latency)
+	_run("pipelined batches of {0}".format(batch_size),
+	     lambda client, names: client.get_properties_batched(names, batch_size, pipeline=True),
+	     properties, latency)
+	_run("pipelined, {0:.0%} element errors".format(element_error),
+	     lambda client, names: client.get_properties_batched(names, batch_size, pipeline=True),
+	     properties, latency, element_error)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,58 @@
+"""Keystream and encrypted header key generation, against the per-character versions they replaced"""
+import timeit
+
+from acp import message
+from acp.keystream import ACP_STATIC_KEY, generate_acp_keystream
+
+from . import report
+
+
+def _old_generate_acp_keystream(length):
+	key = ""
+	key_idx = 0
+	
+	while (key_idx < length):
+		key += chr((key_idx + 0x55 & 0xFF) ^ ord(ACP_STATIC_KEY[key_idx % len(ACP_STATIC_KEY)]))
+		key_idx += 1
+	
+	return key
+
+
+def _old_generate_acp_header_key(password):
+	pw_len = 0x20
+	pw_key = _old_generate_acp_keystream(pw_len)
+	
+	pw_buf = password[:pw_len].ljust(pw_len, "\x00")
+	enc_pw_buf = ""
+	for i in range(pw_len):
+		enc_pw_buf += chr(ord(pw_key[i]) ^ ord(pw_buf[i]))
+	
+	return enc_pw_buf
+
+
+def _uncached_header_key(password):
+	message._header_key_cache.clear()
+	return message._generate_acp_header_key(password)
+
+
+def _rate(function, arg, number):
+	return number / min(timeit.repeat(lambda: function(arg), repeat=3, number=number))
+
+
+def main(number=20000):
+	password = "admin password"
+	assert generate_acp_keystream(0x1000) == _old_generate_acp_keystream(0x1000)
+	assert message._generate_acp_header_key(password) == _old_generate_acp_header_key(password)
+	
+	for length in [0x20, 0x1000]:
+		count = number if length <= 0x100 else number // 100
+		report("keystream of {0} bytes (before)".format(length), _rate(_old_generate_acp_keystream, length, count), "calls/s")
+		report("keystream of {0} bytes".format(length), _rate(generate_acp_keystream, length, count), "calls/s")
+	
+	report("header key (before)", _rate(_old_generate_acp_header_key, password, number), "calls/s")
+	report("header key, cache cleared every call", _rate(_uncached_header_key, password, number), "calls/s")
+	report("header key, cached", _rate(message._generate_acp_header_key, password, number), "calls/s")
+
+
+if __name__ == "__main__":
+	main()
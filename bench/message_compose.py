@@ -0,0 +1,76 @@
+"""Message header composition and header checksum verification
+
+Compares packing the header once into a bytearray and checksumming the packed header in place against
+the previous approach, which packed every header twice and repacked parsed headers to verify them.
+
+"""
+import timeit
+import zlib
+
+from acp.message import ACPMessage, _generate_acp_header_key
+
+from . import report
+
+
+def _old_compose_header(message):
+	tmphdr = message._header_format.pack(message._header_magic,
+	                                     message.version,
+	                                     0,
+	                                     message.body_checksum,
+	                                     message.body_size,
+	                                     message.flags,
+	                                     message.unused,
+	                                     message.command,
+	                                     message.error_code,
+	                                     message.key)
+	
+	return message._header_format.pack(message._header_magic,
+	                                   message.version,
+	                                   zlib.adler32(tmphdr),
+	                                   message.body_checksum,
+	                                   message.body_size,
+	                                   message.flags,
+	                                   message.unused,
+	                                   message.command,
+	                                   message.error_code,
+	                                   message.key)
+
+
+def _old_verify_header_checksum(data, fields):
+	# parse_raw has already unpacked the fields, the checksum was verified by repacking them
+	(magic, version, header_checksum, body_checksum, body_size, flags, unused, command, error_code, key) = fields
+	tmphdr = ACPMessage._header_format.pack(magic, version, 0, body_checksum, body_size, flags, unused, command, error_code, key)
+	return header_checksum == zlib.adler32(tmphdr)
+
+
+def _verify_header_checksum(data, fields):
+	return fields[2] == ACPMessage._compute_header_checksum(data)
+
+
+def _rate(function, number):
+	return number / min(timeit.repeat(function, repeat=5, number=number))
+
+
+def main(number=100000):
+	payload = "".join("{0:04d}".format(i) for i in range(16))
+	message = ACPMessage(0x00030001, 0, 0, 0x14, 0, _generate_acp_header_key("admin"), payload)
+	header = message._compose_header()
+	assert header == _old_compose_header(message)
+	fields = ACPMessage._header_format.unpack(header)
+	assert _verify_header_checksum(header, fields) and _old_verify_header_checksum(header, fields)
+	
+	report("compose header (before)", _rate(lambda: _old_compose_header(message), number), "headers/s")
+	report("compose header", _rate(message._compose_header, number), "headers/s")
+	report("compose getprop message", _rate(lambda: ACPMessage.compose_getprop_command(0, "admin", payload), number), "messages/s")
+	report("verify header checksum (before)", _rate(lambda: _old_verify_header_checksum(header, fields), number), "headers/s")
+	report("verify header checksum", _rate(lambda: _verify_header_checksum(header, fields), number), "headers/s")
+	
+	# a streamed body is checksummed in chunks before its header is composed
+	chunks = ["\xa5" * 0x10000] * 16
+	number = 20
+	report("stream header for 1 MB body, joined", _rate(lambda: ACPMessage.compose_message_ex(0x00030001, 0, 0, 3, 0, "admin", "".join(chunks), None), number), "headers/s")
+	report("stream header for 1 MB body, chunked", _rate(lambda: ACPMessage.compose_header_ex(0x00030001, 0, 0, 3, 0, "admin", 0x100000, ACPMessage.compute_body_checksum(chunks)), number), "headers/s")
+
+
+if __name__ == "__main__":
+	main()
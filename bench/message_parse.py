@@ -0,0 +1,72 @@
+"""ACPMessage.parse_raw throughput for bare headers and for messages with 1 MB bodies
+
+Compares strict and deferred checksum verification against an inline copy of the parser from before
+parse_raw kept the body as a buffer, which copied the header and body out of the data and formatted its
+debug lines whether or not they were logged.
+
+"""
+import logging
+import timeit
+import zlib
+
+from acp.exception import ACPMessageError
+from acp.message import ACPMessage
+
+from . import report
+
+
+def _old_parse_raw(data):
+	cls = ACPMessage
+	if len(data) < cls.header_size:
+		raise ACPMessageError("need to pass at least {0} bytes".format(cls.header_size))
+	header_data = data[:cls.header_size]
+	body_data = data[cls.header_size:] if len(data) > cls.header_size else None
+	
+	(magic, version, header_checksum, body_checksum, body_size, flags, unused, command, error_code, key) = cls._header_format.unpack(header_data)
+	logging.debug("ACP message header fields, parsed not validated")
+	logging.debug("magic           {0!r}".format(magic))
+	logging.debug("header_checksum {0:#x}".format(header_checksum))
+	logging.debug("body_checksum   {0:#x}".format(body_checksum))
+	logging.debug("body_size       {0:#x}".format(body_size))
+	logging.debug("flags           {0:#x}".format(flags))
+	logging.debug("unused          {0:#x}".format(unused))
+	logging.debug("command         {0:#x}".format(command))
+	logging.debug("error_code      {0:#x}".format(error_code))
+	logging.debug("key             {0!r}".format(key))
+	
+	if magic != cls._header_magic:
+		raise ACPMessageError("bad header magic")
+	if version not in [0x00000001, 0x00030001]:
+		raise ACPMessageError("invalid version")
+	if header_checksum != cls._compute_header_checksum(header_data):
+		raise ACPMessageError("header checksum does not match")
+	if body_data and body_size == -1:
+		raise ACPMessageError("cannot handle stream header with data attached")
+	if body_data and body_size != len(body_data):
+		raise ACPMessageError("message body size does not match available data")
+	if body_data and body_checksum != zlib.adler32(body_data):
+		raise ACPMessageError("body checksum does not match")
+	if command not in [1, 3, 4, 5, 6, 0x14, 0x15, 0x16, 0x17, 0x18, 0x19, 0x1a, 0x1b]:
+		raise ACPMessageError("unknown command")
+	
+	# the constructor checksummed the body again
+	return cls(version, flags, unused, command, error_code, key, body_data, body_size)
+
+
+def _rate(function, number):
+	return number / min(timeit.repeat(function, repeat=5, number=number))
+
+
+def main():
+	header = ACPMessage.compose_getprop_command(4, "admin", None)
+	message = ACPMessage.compose_getprop_command(4, "admin", "\xa5" * 0x100000)
+	
+	for label, data, number, unit in [("header", header, 100000, "headers/s"), ("1 MB message", message, 200, "messages/s")]:
+		assert str(ACPMessage.parse_raw(data).body or "") == (_old_parse_raw(data).body or "")
+		report("{0}, before".format(label), _rate(lambda: _old_parse_raw(data), number), unit)
+		report("{0}, strict".format(label), _rate(lambda: ACPMessage.parse_raw(data), number), unit)
+		report("{0}, deferred checksums".format(label), _rate(lambda: ACPMessage.parse_raw(data, strict=False), number), unit)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,84 @@
+"""ACPProperty construction and formatting from raw element values
+
+Compares the compiled property schema against an inline copy of the constructor it replaced, which
+scanned the list of supported names, looked its handlers up by name and eval()ed the validation
+expression on every construction. Also reports the per-instance size of ACPCompactProperty.
+
+"""
+import logging
+import sys
+
+from acp.property import ACPCompactProperty, ACPProperty, ACPPropertyError, ACPPropertyInitValueError
+
+from . import best_time, report
+
+
+class _OldProperty(ACPProperty):
+	def __init__(self, name=None, value=None):
+		if name == self.null_name and value == self.null_value:
+			name = None
+			value = None
+		
+		if name and name not in self.get_supported_property_names():
+			raise ACPPropertyError("invalid property name passed to initializer: {0}".format(name))
+		
+		if value is not None:
+			prop_type = self.get_property_info_string(name, "type")
+			_init_handler_name = "_init_{0}".format(prop_type)
+			assert hasattr(self, _init_handler_name), "missing init handler for \"{0}\" property type".format(prop_type)
+			_init_handler = getattr(self, _init_handler_name)
+			
+			logging.debug("old value: {0!r} type: {1}".format(value, type(value)))
+			try:
+				value = _init_handler(value)
+			except ACPPropertyInitValueError as e:
+				raise ACPPropertyError("{0!s} provided for \"{1}\" property type: {2!r}".format(e, prop_type, value))
+			logging.debug("new value: {0!r} type: {1}".format(value, type(value)))
+			
+			validation_expr = self.get_property_info_string(name, "validation")
+			if validation_expr and not eval(validation_expr):
+				raise ACPPropertyError("invalid value passed to initializer for property \"{0}\": {1}".format(name, repr(value)))
+		
+		self.name = name
+		self.value = value
+	
+	def __str__(self):
+		if self.name is None or self.value is None:
+			return ""
+		
+		prop_type = self.get_property_info_string(self.name, "type")
+		_format_handler_name = "_format_{0}".format(prop_type)
+		assert hasattr(self, _format_handler_name), "missing format handler for \"{0}\" property type".format(prop_type)
+		return getattr(self, _format_handler_name)(self.value)
+
+
+# raw values as they arrive in getprop replies
+_elements = [
+	("syNm", "router name"),
+	("syUT", "\x00\x01\x51\x80"),
+	("waMA", "\x00\x11\x22\x33\x44\x55"),
+	("raNm", "network name"),
+	("dbug", "\x00\x00\x00\x01"),
+	]
+
+
+def main(count=100000):
+	elements = (_elements * (count // len(_elements) + 1))[:count]
+	
+	for label, cls in [("ACPProperty (before)", _OldProperty), ("ACPProperty", ACPProperty), ("ACPCompactProperty", ACPCompactProperty)]:
+		assert [(prop.name, prop.value, str(prop)) for prop in [cls(name, value) for name, value in _elements]] == \
+		       [(prop.name, prop.value, str(prop)) for prop in [ACPProperty(name, value) for name, value in _elements]]
+		elapsed = best_time(lambda: [cls(name, value) for name, value in elements])
+		report("construct {0}k, {1}".format(count // 1000, label), 1000 * elapsed, "ms ({0:.0f}k/s)".format(count / elapsed / 1000))
+		props = [cls(name, value) for name, value in elements]
+		elapsed = best_time(lambda: [str(prop) for prop in props])
+		report("format {0}k, {1}".format(count // 1000, label), 1000 * elapsed, "ms ({0:.0f}k/s)".format(count / elapsed / 1000))
+	
+	prop = ACPProperty("syNm", "router name")
+	compact_prop = ACPCompactProperty("syNm", "router name")
+	report("ACPProperty instance size", sys.getsizeof(prop) + sys.getsizeof(prop.__dict__), "bytes")
+	report("ACPCompactProperty instance size", sys.getsizeof(compact_prop), "bytes")
+
+
+if __name__ == "__main__":
+	main()
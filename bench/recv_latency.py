@@ -0,0 +1,127 @@
+"""Latency of receives from a peer that drips data in small chunks
+
+The peer sends 100 byte chunks with a pause between them. Latency is the time from the last chunk being
+sent until the receive call returns, for the poll-based session receive and for the busy-wait loop it
+replaced, which slept 100 ms whenever the non-blocking socket had nothing to read.
+
+"""
+import socket
+import threading
+import time
+
+from acp.session import ACPClientSession
+
+from . import report
+
+
+_chunk_size = 100
+
+
+def _old_recv_size_timeout(sock, size, timeout):
+	"""The receive loop from before poll-based deadlines, without decryption"""
+	recvd_chunks = []
+	recvd_size = 0
+	
+	sock.setblocking(0)
+	
+	begin = time.time()
+	while True:
+		if recvd_size == size:
+			break
+		if recvd_size and time.time() - begin > timeout:
+			break
+		if time.time() - begin > timeout * 2:
+			break
+		
+		try:
+			data = sock.recv(size - recvd_size)
+			if data:
+				recvd_chunks.append(data)
+				recvd_size += len(data)
+				begin = time.time()
+			else:
+				time.sleep(0.1)
+		except socket.error:
+			time.sleep(0.1)
+	
+	sock.setblocking(1)
+	return "".join(recvd_chunks)
+
+
+class _DripServer(object):
+	"""Accept one connection and send each requested size as paced chunks"""
+	
+	def __init__(self, interval):
+		self.interval = interval
+		self.last_sent = None
+		self._listener = socket.socket()
+		self._listener.bind(("127.0.0.1", 0))
+		self._listener.listen(1)
+		self.address = self._listener.getsockname()
+		self._requests = []
+		self._ready = threading.Condition()
+		self._thread = threading.Thread(target=self._serve)
+		self._thread.daemon = True
+		self._thread.start()
+	
+	
+	def _serve(self):
+		sock, address = self._listener.accept()
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		while True:
+			with self._ready:
+				while not self._requests:
+					self._ready.wait()
+				size = self._requests.pop(0)
+			if size is None:
+				break
+			for offset in range(0, size, _chunk_size):
+				time.sleep(self.interval)
+				# set first, the receiver can return before sendall does
+				self.last_sent = time.time()
+				sock.sendall("\x00" * min(_chunk_size, size - offset))
+		sock.close()
+		self._listener.close()
+	
+	
+	def drip(self, size):
+		with self._ready:
+			self._requests.append(size)
+			self._ready.notify()
+	
+	
+	def stop(self):
+		self.drip(None)
+		self._thread.join()
+
+
+def _measure(receive, size, interval, rounds):
+	server = _DripServer(interval)
+	session = ACPClientSession(server.address[0], "")
+	session.port = server.address[1]
+	session.sock = socket.create_connection(server.address)
+	
+	latencies = []
+	for i in range(rounds):
+		server.drip(size)
+		data = receive(session, size)
+		received = time.time()
+		assert len(data) == size
+		latencies.append(received - server.last_sent)
+	
+	server.stop()
+	session.close()
+	return latencies
+
+
+def main(size=1000, interval=0.02, rounds=10):
+	print "{0} bytes in {1} byte chunks every {2} ms, {3} rounds".format(size, _chunk_size, interval * 1000, rounds)
+	for label, receive in [("poll-based deadline", lambda session, size: session.recv(size, timeout=5)),
+	                       ("busy-wait loop (before)", lambda session, size: _old_recv_size_timeout(session.sock, size, 5))]:
+		latencies = _measure(receive, size, interval, rounds)
+		report("{0}, mean latency".format(label), 1000 * sum(latencies) / len(latencies), "ms")
+		report("{0}, max latency".format(label), 1000 * max(latencies), "ms")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,128 @@
+import os
+import struct
+import unittest
+import zlib
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+
+from Crypto.Cipher import AES
+
+from acp.basebinary import *
+from acp.basebinary import _derive_key, _map_in_groups
+
+
+def _compose_basebinary(inner_data, model=120, flags=2):
+	header = Basebinary._header_format.pack(Basebinary._header_magic, 3, model, 1, 0, 0, 0, flags, 0)
+	checksum = zlib.adler32(inner_data, zlib.adler32(header)) & 0xffffffff
+	if flags & 2:
+		key, iv = _derive_key(model), Basebinary._header_magic + chr(3)
+		chunks = []
+		for offset in xrange(0, len(inner_data), Basebinary._chunk_length):
+			chunk = inner_data[offset:offset + Basebinary._chunk_length]
+			aligned_length = len(chunk) & ~0xF
+			chunks.append(AES.new(key, AES.MODE_CBC, iv).encrypt(chunk[:aligned_length]) + chunk[aligned_length:])
+		inner_data = "".join(chunks)
+	return header + inner_data + struct.pack(">I", checksum)
+
+
+class BasebinaryStreamTestCase(unittest.TestCase):
+	def setUp(self):
+		# more chunks than one pool group, and an unaligned tail
+		self.inner_data = os.urandom(Basebinary._chunk_length * (Basebinary._pool_chunk_count + 4) + 5)
+		self.image = _compose_basebinary(self.inner_data)
+	
+	def _parse_stream(self, image, pool=None):
+		outfile = StringIO()
+		size = Basebinary.parse_stream(StringIO(image), outfile, pool)
+		self.assertEqual(size, len(outfile.getvalue()))
+		return outfile.getvalue()
+	
+	def test_matches_parse(self):
+		self.assertEqual(Basebinary.parse(self.image), self.inner_data)
+		self.assertEqual(self._parse_stream(self.image), self.inner_data)
+	
+	def test_pool(self):
+		pool = ThreadPool(4)
+		try:
+			self.assertEqual(self._parse_stream(self.image, pool), self.inner_data)
+		finally:
+			pool.close()
+			pool.join()
+	
+	def test_unencrypted(self):
+		image = _compose_basebinary(self.inner_data, flags=0)
+		self.assertEqual(self._parse_stream(image), Basebinary.parse(image))
+	
+	def test_small(self):
+		image = _compose_basebinary("")
+		self.assertEqual(self._parse_stream(image), "")
+		with self.assertRaises(BasebinaryError):
+			self._parse_stream(image[:-1])
+	
+	def test_bad_checksum(self):
+		image = self.image[:-1] + chr(ord(self.image[-1]) ^ 1)
+		with self.assertRaises(BasebinaryError):
+			Basebinary.parse(image)
+		with self.assertRaises(BasebinaryError):
+			self._parse_stream(image)
+	
+	def test_missing_key(self):
+		image = _compose_basebinary(self.inner_data, model=3, flags=0)
+		image = image[:Basebinary.header_size - 5] + chr(2) + image[Basebinary.header_size - 4:]
+		with self.assertRaises(BasebinaryError):
+			self._parse_stream(image)
+
+
+class _RecordingPool(object):
+	def __init__(self):
+		self.group_sizes = []
+	
+	def map(self, function, jobs):
+		self.group_sizes.append(len(jobs))
+		return map(function, jobs)
+
+
+class BasebinaryDecryptTestCase(unittest.TestCase):
+	def setUp(self):
+		self.inner_data = os.urandom(Basebinary._chunk_length * (Basebinary._pool_chunk_count + 4) + 5)
+		image = _compose_basebinary(self.inner_data)
+		self.encrypted_data = image[Basebinary.header_size:-4]
+	
+	def test_decrypt_chunk(self):
+		key, iv = _derive_key(120), Basebinary._header_magic + chr(3)
+		chunk = "\x01" * 0x25
+		encrypted_chunk = AES.new(key, AES.MODE_CBC, iv).encrypt(chunk[:0x20]) + chunk[0x20:]
+		# the unaligned tail is stored in the clear
+		self.assertEqual(Basebinary.decrypt_chunk(encrypted_chunk, key, iv), chunk)
+		self.assertEqual(Basebinary.decrypt_chunk(encrypted_chunk[:0x20], key, iv), chunk[:0x20])
+		self.assertEqual(Basebinary.decrypt_chunk("", key, iv), "")
+	
+	def test_decrypt(self):
+		self.assertEqual(Basebinary.decrypt(self.encrypted_data, 120, 3), self.inner_data)
+	
+	def test_decrypt_pool(self):
+		pool = ThreadPool(4)
+		try:
+			self.assertEqual(Basebinary.decrypt(self.encrypted_data, 120, 3, pool), self.inner_data)
+		finally:
+			pool.close()
+			pool.join()
+	
+	def test_decrypt_pool_groups(self):
+		pool = _RecordingPool()
+		self.assertEqual(Basebinary.decrypt(self.encrypted_data, 120, 3, pool), self.inner_data)
+		# 21 chunks, never more than one group queued at once
+		self.assertEqual(pool.group_sizes, [Basebinary._pool_chunk_count, 5])
+	
+	def test_map_in_groups(self):
+		pool = _RecordingPool()
+		self.assertEqual(list(_map_in_groups(pool, lambda x: x * 2, iter(xrange(7)), 3)), [0, 2, 4, 6, 8, 10, 12])
+		self.assertEqual(pool.group_sizes, [3, 3, 1])
+		
+		pool = _RecordingPool()
+		self.assertEqual(list(_map_in_groups(pool, lambda x: x, iter([]), 3)), [])
+		self.assertEqual(pool.group_sizes, [])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,295 @@
+import struct
+import unittest
+from collections import OrderedDict
+from datetime import date, datetime
+from types import UnicodeType
+
+from acp.cflbinary import *
+
+
+def _nested_arrays(depth):
+	root = obj = []
+	for i in range(depth - 1):
+		child = [i]
+		obj.append(child)
+		obj = child
+	return root
+
+
+def _sample_object():
+	return OrderedDict([
+		(u"name", u"r\xf6uter"),
+		(u"data", "\x00\x01\x02" * 10),
+		(u"small", 7),
+		(u"large", 0xFFFFFFFFFF),
+		(u"real", 1.5),
+		(u"flags", [True, False]),
+		(u"nested", OrderedDict([(u"list", [1, [2, [3]], OrderedDict()]), (u"empty", [])])),
+		])
+
+
+class CFLBinaryPListParserTestCase(unittest.TestCase):
+	def test_round_trip(self):
+		obj = _sample_object()
+		self.assertEqual(CFLBinaryPListParser.parse(CFLBinaryPListComposer.compose(obj)), obj)
+	
+	def test_round_trip_scalars(self):
+		for obj in [None, True, False, 0, 0xFF, 0x100, 0xFFFF, 0x10000, 0xFFFFFFFF, 0x100000000, 0.25, u"", u"text", "", "x" * 0x100]:
+			self.assertEqual(CFLBinaryPListParser.parse(CFLBinaryPListComposer.compose(obj)), obj)
+	
+	def test_known_encoding(self):
+		data = CFLBinaryPListComposer.compose(OrderedDict([(u"a", 1)]))
+		self.assertEqual(data, "CFB0\xd0\x70a\x00\x10\x01\x00END!")
+	
+	def test_float_encoding(self):
+		compose = CFLBinaryPListComposer.compose
+		self.assertEqual(compose(1.5), "CFB0\x22\x3f\xc0\x00\x00END!")
+		self.assertEqual(compose(float("inf")), "CFB0\x22\x7f\x80\x00\x00END!")
+		self.assertEqual(compose(float("-inf")), "CFB0\x22\xff\x80\x00\x00END!")
+		self.assertEqual(compose(float("nan"))[4], "\x22")
+		self.assertEqual(compose(1e300), "CFB0\x23" + struct.pack(">d", 1e300) + "END!")
+		self.assertEqual(CFLBinaryPListParser.parse(compose(1e300)), 1e300)
+	
+	def test_date_encoding(self):
+		when = datetime(2020, 5, 17, 12, 30, 15, 500000)
+		self.assertEqual(CFLBinaryPListParser.parse(CFLBinaryPListComposer.compose(when)), when)
+		self.assertEqual(CFLBinaryPListComposer.compose(datetime(2001, 1, 2)), "CFB0\x33" + struct.pack(">d", 86400.0) + "END!")
+		self.assertEqual(CFLBinaryPListComposer.compose(date(2001, 1, 2)), CFLBinaryPListComposer.compose(datetime(2001, 1, 2)))
+	
+	def test_data_encoding(self):
+		data = "\x00\x01" * 0x10
+		expected = CFLBinaryPListComposer.compose(data)
+		self.assertEqual(expected[4:7], "\x4f\x10\x20")
+		for obj in [bytearray(data), buffer(data), memoryview(data)]:
+			self.assertEqual(CFLBinaryPListComposer.compose(obj), expected)
+	
+	def test_set_encoding(self):
+		self.assertEqual(CFLBinaryPListParser.parse(CFLBinaryPListComposer.compose(set([1]))), [1])
+		self.assertEqual(sorted(CFLBinaryPListParser.parse(CFLBinaryPListComposer.compose(frozenset([1, 2, 3])))), [1, 2, 3])
+	
+	def test_memo(self):
+		obj = [u"key", u"key", 1, 1, True, 1L, "key"]
+		expected = CFLBinaryPListComposer.compose(obj)
+		# a second pass is served from the memo and must not change the output
+		self.assertEqual(CFLBinaryPListComposer.compose(obj), expected)
+		self.assertEqual(CFLBinaryPListParser.parse(expected), obj)
+		self.assertEqual([type(value) for value in CFLBinaryPListParser.parse(expected)][4], bool)
+		
+		# values too large to memoize are composed normally
+		large = u"x" * (CFLBinaryPListComposer._memo_max_size + 1)
+		self.assertEqual(CFLBinaryPListParser.parse(CFLBinaryPListComposer.compose([large, large])), [large, large])
+		self.assertNotIn((UnicodeType, large), CFLBinaryPListComposer._memo)
+	
+	def test_register_encoder(self):
+		class Point(tuple):
+			pass
+		
+		class PointComposer(CFLBinaryPListComposer):
+			pass
+		
+		def pack_point(obj, buf):
+			buf += "\x70point\x00"
+		
+		PointComposer.register_encoder(Point, pack_point)
+		self.assertEqual(PointComposer.compose([Point((1, 2))]), "CFB0\xa0\x70point\x00\x00END!")
+		# the base composer still packs the tuple subclass as an array
+		self.assertEqual(CFLBinaryPListComposer.compose([Point((1, 2))]), "CFB0\xa0\xa0\x10\x01\x10\x02\x00\x00END!")
+		self.assertNotIn(Point, CFLBinaryPListComposer._encoders)
+		
+		# replacing an encoder on the subclass only resets the subclass memo
+		PointComposer.compose(u"memo")
+		CFLBinaryPListComposer.compose(u"memo")
+		PointComposer.register_encoder(UnicodeType, lambda obj, buf: pack_point(obj, buf))
+		self.assertEqual(PointComposer.compose(u"memo"), "CFB0\x70point\x00END!")
+		self.assertEqual(CFLBinaryPListComposer.compose(u"memo"), "CFB0\x70memo\x00END!")
+		self.assertIn((UnicodeType, u"memo"), CFLBinaryPListComposer._memo)
+	
+	def test_unsupported_type(self):
+		with self.assertRaises(CFLBinaryPListComposeError):
+			CFLBinaryPListComposer.compose([object()])
+	
+	def test_truncated(self):
+		data = CFLBinaryPListComposer.compose(_sample_object())
+		for size in range(len(data) - 4):
+			with self.assertRaises(CFLBinaryPListParseError):
+				CFLBinaryPListParser.parse(data[:size])
+	
+	def test_bad_magic(self):
+		data = CFLBinaryPListComposer.compose([1])
+		with self.assertRaises(CFLBinaryPListParseError):
+			CFLBinaryPListParser.parse("CFB1" + data[4:])
+		with self.assertRaises(CFLBinaryPListParseError):
+			CFLBinaryPListParser.parse(data[:-4] + "END?")
+	
+	def test_unterminated_string(self):
+		with self.assertRaises(CFLBinaryPListParseError):
+			CFLBinaryPListParser.parse("CFB0\x70abcdEND!")
+	
+	def test_data_past_end(self):
+		with self.assertRaises(CFLBinaryPListParseError):
+			CFLBinaryPListParser.parse("CFB0\x4f\x10\x20abcEND!")
+	
+	def test_deep_nesting(self):
+		obj = CFLBinaryPListParser.parse("CFB0" + "\xa0" * 5000 + "\x00" * 5000 + "END!", max_depth=5000)
+		# comparing the objects themselves would recurse, walk them instead
+		for depth in range(4999):
+			self.assertEqual(len(obj), 1)
+			obj = obj[0]
+		self.assertEqual(obj, [])
+	
+	def test_max_depth(self):
+		data = CFLBinaryPListComposer.compose(_nested_arrays(10))
+		CFLBinaryPListParser.parse(data, max_depth=10)
+		with self.assertRaises(CFLBinaryPListParseError):
+			CFLBinaryPListParser.parse(data, max_depth=9)
+		with self.assertRaises(CFLBinaryPListParseError):
+			CFLBinaryPListParser.parse(CFLBinaryPListComposer.compose(_nested_arrays(CFLBinaryPListParser.max_depth + 1)))
+	
+	def test_max_objects(self):
+		data = CFLBinaryPListComposer.compose(range(9))
+		CFLBinaryPListParser.parse(data, max_objects=11)
+		with self.assertRaises(CFLBinaryPListParseError):
+			CFLBinaryPListParser.parse(data, max_objects=10)
+	
+	def test_container_key(self):
+		with self.assertRaises(CFLBinaryPListParseError):
+			CFLBinaryPListParser.parse("CFB0\xd0\xa0\x00\x10\x01\x00END!")
+
+
+
+class CFLBinaryPListLazyViewTestCase(unittest.TestCase):
+	def setUp(self):
+		self.obj = _sample_object()
+		self.view = CFLBinaryPListParser.parse_lazy(CFLBinaryPListComposer.compose(self.obj))
+	
+	def test_dict_view(self):
+		self.assertIsInstance(self.view, CFLBinaryPListDictView)
+		self.assertEqual(list(self.view), list(self.obj))
+		self.assertEqual(len(self.view), len(self.obj))
+		self.assertEqual(self.view[u"name"], self.obj[u"name"])
+		self.assertIn(u"real", self.view)
+		self.assertNotIn(u"missing", self.view)
+		with self.assertRaises(KeyError):
+			self.view[u"missing"]
+	
+	def test_array_view(self):
+		view = self.view[u"nested"][u"list"]
+		self.assertIsInstance(view, CFLBinaryPListArrayView)
+		self.assertEqual(len(view), 3)
+		self.assertEqual(view[0], 1)
+		self.assertEqual(view[1][1][0], 3)
+		self.assertEqual(view[-3], 1)
+		self.assertEqual(view[1:2][0].to_object(), [2, [3]])
+		for i in [3, -4, -5]:
+			with self.assertRaises(IndexError):
+				view[i]
+	
+	def test_lookup(self):
+		self.assertEqual(self.view.lookup([u"nested", u"list", 1, 1, 0]), 3)
+		self.assertEqual(self.view.lookup([]), self.view)
+		with self.assertRaises(KeyError):
+			self.view.lookup([u"nested", u"missing"])
+	
+	def test_to_object(self):
+		self.assertEqual(self.view.to_object(), self.obj)
+		self.assertEqual(self.view[u"nested"].to_object(), self.obj[u"nested"])
+	
+	def test_values_are_cached(self):
+		self.assertIs(self.view[u"nested"], self.view[u"nested"])
+	
+	def test_unaccessed_values_are_not_unpacked(self):
+		# the string under "bad" is not valid UTF-8, which only matters once it is accessed
+		view = CFLBinaryPListParser.parse_lazy("CFB0\xd0\x70bad\x00\x70\xff\x00\x70good\x00\x10\x01\x00END!")
+		self.assertEqual(view[u"good"], 1)
+		with self.assertRaises(UnicodeDecodeError):
+			view[u"bad"]
+		self.assertIn(u"bad", view)
+	
+	def test_scalar_root(self):
+		self.assertEqual(CFLBinaryPListParser.parse_lazy(CFLBinaryPListComposer.compose(5)), 5)
+
+
+class _EventRecorder(CFLBinaryPListHandler):
+	def __init__(self):
+		self.events = []
+	
+	def start_dict(self):
+		self.events.append(("start_dict", ))
+	
+	def end_dict(self):
+		self.events.append(("end_dict", ))
+	
+	def start_array(self):
+		self.events.append(("start_array", ))
+	
+	def end_array(self):
+		self.events.append(("end_array", ))
+	
+	def key(self, key):
+		self.events.append(("key", key))
+	
+	def value(self, value):
+		self.events.append(("value", value))
+
+
+class CFLBinaryPListIncrementalParserTestCase(unittest.TestCase):
+	def _feed(self, data, chunk_size, parser=None):
+		parser = parser if parser is not None else CFLBinaryPListIncrementalParser()
+		for offset in range(0, len(data), chunk_size):
+			parser.feed(data[offset:offset + chunk_size])
+		return parser.close()
+	
+	def test_chunk_sizes(self):
+		obj = _sample_object()
+		data = CFLBinaryPListComposer.compose(obj)
+		for chunk_size in [1, 2, 3, 7, 16, len(data)]:
+			self.assertEqual(self._feed(data, chunk_size), obj)
+	
+	def test_large_data_object(self):
+		obj = OrderedDict([(u"blob", "\xa5" * 0x10000)])
+		self.assertEqual(self._feed(CFLBinaryPListComposer.compose(obj), 0x1000), obj)
+	
+	def test_events(self):
+		handler = _EventRecorder()
+		data = CFLBinaryPListComposer.compose(OrderedDict([(u"a", [1, OrderedDict()]), (u"b", u"c")]))
+		self.assertIsNone(self._feed(data, 1, CFLBinaryPListIncrementalParser(handler)))
+		self.assertEqual(handler.events, [("start_dict", ),
+		                                  ("key", u"a"),
+		                                  ("start_array", ),
+		                                  ("value", 1),
+		                                  ("start_dict", ),
+		                                  ("end_dict", ),
+		                                  ("end_array", ),
+		                                  ("key", u"b"),
+		                                  ("value", u"c"),
+		                                  ("end_dict", )])
+	
+	def test_ended_early(self):
+		data = CFLBinaryPListComposer.compose(_sample_object())
+		parser = CFLBinaryPListIncrementalParser()
+		parser.feed(data[:-1])
+		with self.assertRaises(CFLBinaryPListParseError):
+			parser.close()
+	
+	def test_extra_data(self):
+		parser = CFLBinaryPListIncrementalParser()
+		parser.feed(CFLBinaryPListComposer.compose([1]))
+		with self.assertRaises(CFLBinaryPListParseError):
+			parser.feed("x")
+	
+	def test_bad_magic(self):
+		with self.assertRaises(CFLBinaryPListParseError):
+			CFLBinaryPListIncrementalParser().feed("CFB1")
+		with self.assertRaises(CFLBinaryPListParseError):
+			self._feed(CFLBinaryPListComposer.compose([1])[:-4] + "END?", 1)
+	
+	def test_limits(self):
+		data = CFLBinaryPListComposer.compose(_nested_arrays(10))
+		with self.assertRaises(CFLBinaryPListParseError):
+			self._feed(data, 1, CFLBinaryPListIncrementalParser(max_depth=9))
+		with self.assertRaises(CFLBinaryPListParseError):
+			self._feed(data, 1, CFLBinaryPListIncrementalParser(max_objects=10))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from acp.cflbinary import CFLBinaryPListComposer
+from acp.deltacache import ACPDeltaCache
+from acp.exception import ACPPropertyError
+
+
+class ACPDeltaCacheTestCase(unittest.TestCase):
+	def setUp(self):
+		self.cache = ACPDeltaCache(max_entries=2)
+	
+	def test_unchanged(self):
+		change = self.cache.update("r", "syNm", "router")
+		self.assertEqual((change.value, change.diffs), ("router", []))
+		self.assertIsNone(self.cache.update("r", "syNm", "router"))
+		self.assertEqual(self.cache.stats()["hits"], 1)
+	
+	def test_changed(self):
+		self.cache.update("r", "syNm", "router")
+		change = self.cache.update("r", "syNm", "gateway")
+		self.assertEqual([(diff.kind, diff.old, diff.new) for diff in change.diffs], [("changed", "router", "gateway")])
+	
+	def test_adler32_collision(self):
+		# these two values have the same Adler-32 checksum and size
+		self.cache.update("r", "syNm", "\x00\x01\x01\x00")
+		self.assertIsNotNone(self.cache.update("r", "syNm", "\x01\x00\x00\x01"))
+	
+	def test_large_value(self):
+		self.cache.update("r", "syNm", "a" * 0x100)
+		self.assertIsNone(self.cache.update("r", "syNm", "a" * 0x100))
+		self.assertIsNotNone(self.cache.update("r", "syNm", "a" * 0xff + "b"))
+	
+	def test_cfb_diffs(self):
+		self.cache.update("r", "raSL", CFLBinaryPListComposer.compose({"a": 1, "b": [1, 2]}))
+		change = self.cache.update("r", "raSL", CFLBinaryPListComposer.compose({"a": 2, "b": [1], "c": 3}))
+		self.assertEqual(sorted((diff.path, diff.kind) for diff in change.diffs),
+		                 [(("a", ), "changed"), (("b", 1), "removed"), (("c", ), "added")])
+	
+	def test_malformed_cfb(self):
+		with self.assertRaises(ACPPropertyError):
+			self.cache.update("r", "raSL", "not a plist")
+	
+	def test_malformed_keeps_cached_value(self):
+		self.cache.update("r", "raSL", CFLBinaryPListComposer.compose({"a": 1}))
+		with self.assertRaises(ACPPropertyError):
+			self.cache.update("r", "raSL", "not a plist")
+		change = self.cache.update("r", "raSL", CFLBinaryPListComposer.compose({"a": 2}))
+		self.assertEqual([(diff.path, diff.old, diff.new) for diff in change.diffs], [(("a", ), 1, 2)])
+		
+		self.cache.update("r", "syUT", "\x00\x00\x00\x01")
+		with self.assertRaises(ACPPropertyError):
+			self.cache.update("r", "syUT", "\x00\x01")
+		self.assertIsNone(self.cache.update("r", "syUT", "\x00\x00\x00\x01"))
+	
+	def test_max_bytes(self):
+		cache = ACPDeltaCache(max_bytes=3 * (ACPDeltaCache._entry_overhead + 0x1000))
+		value = CFLBinaryPListComposer.compose({"a": "x" * (0x1000 - 0x20)})
+		for target in ["a", "b", "c", "d"]:
+			cache.update(target, "raSL", value)
+		self.assertEqual((len(cache), cache.evictions), (3, 1))
+		self.assertLessEqual(cache.stats()["bytes"], cache.max_bytes)
+		
+		size = cache.stats()["bytes"]
+		cache.invalidate("b")
+		self.assertEqual(cache.stats()["bytes"], size * 2 // 3)
+		cache.clear()
+		self.assertEqual(cache.stats()["bytes"], 0)
+	
+	def test_eviction_and_invalidate(self):
+		self.cache.update("r", "syNm", "router")
+		self.cache.update("r", "syUT", "\x00\x00\x00\x01")
+		self.cache.update("s", "syNm", "router")
+		self.assertEqual((len(self.cache), self.cache.evictions), (2, 1))
+		self.assertIsNotNone(self.cache.update("r", "syNm", "router"))
+		
+		self.cache.invalidate("s")
+		self.assertIsNotNone(self.cache.update("s", "syNm", "router"))
+
+
+if __name__ == "__main__":
+	unittest.main()
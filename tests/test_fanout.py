@@ -0,0 +1,59 @@
+import time
+import unittest
+
+from acp.exception import *
+from acp.fanout import fan_out
+from acp.pool import ACPConnectionPool
+from acp.server import ACPServer
+
+
+def _get_name(client):
+	(name, flags, value), = client.iter_property_elements(["syNm"])
+	return value
+
+
+class ACPFanOutTestCase(unittest.TestCase):
+	def setUp(self):
+		self.server = ACPServer({"syNm": "router", "raNm": "x" * 0x3000}, password="admin")
+		self.server.start()
+		self.host, self.port = self.server.address
+	
+	def tearDown(self):
+		self.server.stop()
+	
+	def test_results(self):
+		targets = [self.host, (self.host, "wrong"), self.host]
+		results = list(fan_out(targets, _get_name, "admin", self.port, concurrency=2, timeout=5))
+		self.assertEqual(len(results), 3)
+		self.assertEqual(sorted(result.value for result in results if result.error is None), ["router", "router"])
+		errors = [result.error for result in results if result.error is not None]
+		self.assertEqual(len(errors), 1)
+		self.assertIsInstance(errors[0], ACPReplyError)
+	
+	def test_deadline(self):
+		# the reply trickles in for about 3 seconds, each chunk well within the socket timeout
+		self.server.bandwidth = 0x1000
+		begin = time.time()
+		results = list(fan_out([self.host], lambda client: client.get_properties(["raNm"]), "admin", self.port, timeout=5, deadline=0.5))
+		self.assertLess(time.time() - begin, 2.0)
+		self.assertIsInstance(results[0].error, ACPDeadlineError)
+	
+	def test_pool(self):
+		pool = ACPConnectionPool(timeout=5)
+		try:
+			for i in range(2):
+				results = list(fan_out([self.host], _get_name, "admin", self.port, pool=pool, timeout=1))
+				self.assertEqual(results[0].value, "router")
+			self.assertEqual((pool.stats()["hits"], pool.stats()["misses"]), (1, 1))
+			
+			self.server.bandwidth = 0x1000
+			results = list(fan_out([self.host], lambda client: client.get_properties(["raNm"]), "admin", self.port, pool=pool, deadline=0.5))
+			self.assertIsInstance(results[0].error, ACPDeadlineError)
+			# the aborted connection is not pooled again
+			self.assertEqual(pool.stats()["idle"], 0)
+		finally:
+			pool.close()
+
+
+if __name__ == "__main__":
+	unittest.main()
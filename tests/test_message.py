@@ -0,0 +1,60 @@
+import unittest
+
+from acp.exception import ACPMessageError
+from acp.message import ACPMessage, _bytes
+
+
+class ACPMessageParseTestCase(unittest.TestCase):
+	def setUp(self):
+		self.body = "".join(chr(i & 0xff) for i in range(1000))
+		self.data = ACPMessage.compose_getprop_command(0, "admin", self.body)
+	
+	def _corrupt(self, offset):
+		data = bytearray(self.data)
+		data[offset] ^= 0xff
+		return str(data)
+	
+	def test_parse(self):
+		for data in [self.data, bytearray(self.data), buffer(self.data), memoryview(self.data)]:
+			message = ACPMessage.parse_raw(data)
+			self.assertEqual((message.command, message.body_size), (0x14, len(self.body)))
+			self.assertEqual(_bytes(message.body), self.body)
+			self.assertEqual(message._compose_raw_packet(), self.data)
+	
+	def test_memoryview_body_is_not_copied(self):
+		message = ACPMessage.parse_raw(memoryview(self.data))
+		self.assertIsInstance(message.body, memoryview)
+	
+	def test_header_only(self):
+		message = ACPMessage.parse_raw(memoryview(self.data)[:ACPMessage.header_size])
+		self.assertEqual((message.body, message.body_size), (None, len(self.body)))
+		with self.assertRaises(ACPMessageError):
+			ACPMessage.parse_raw(self.data[:ACPMessage.header_size - 1])
+	
+	def test_strict_checksums(self):
+		for offset in [ACPMessage._header_checksum_offset, ACPMessage.header_size + 10]:
+			for data in [self._corrupt(offset), memoryview(self._corrupt(offset))]:
+				with self.assertRaises(ACPMessageError):
+					ACPMessage.parse_raw(data)
+	
+	def test_lazy_checksums(self):
+		for offset in [ACPMessage._header_checksum_offset, ACPMessage.header_size + 10]:
+			for data in [self._corrupt(offset), memoryview(self._corrupt(offset))]:
+				message = ACPMessage.parse_raw(data, strict=False)
+				with self.assertRaises(ACPMessageError):
+					message.verify_checksums()
+		
+		message = ACPMessage.parse_raw(memoryview(self.data), strict=False)
+		message.verify_checksums()
+		# checked once, later calls do nothing
+		message.verify_checksums()
+	
+	def test_malformed(self):
+		with self.assertRaises(ACPMessageError):
+			ACPMessage.parse_raw("xxxx" + self.data[4:])
+		with self.assertRaises(ACPMessageError):
+			ACPMessage.parse_raw(self.data[:-1], strict=False)
+
+
+if __name__ == "__main__":
+	unittest.main()
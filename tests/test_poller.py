@@ -0,0 +1,73 @@
+import threading
+import unittest
+
+from acp.deltacache import ACPDeltaCache
+from acp.poller import ACPCallbackSink, ACPPoller
+from acp.server import ACPServer
+
+
+class ACPPollerTestCase(unittest.TestCase):
+	def setUp(self):
+		self.server = ACPServer({"syNm": "router", "syUT": 1234}, password="admin")
+		self.server.start()
+		self.samples = []
+	
+	def tearDown(self):
+		self.server.stop()
+	
+	def _poller(self, password="admin", callback=None, **kwargs):
+		kwargs.setdefault("jitter", 0.0)
+		return ACPPoller([self.server.address[0]], {"syNm": 0.05, "syUT": 0.05}, [ACPCallbackSink(callback or self.samples.append)],
+		                 password=password, port=self.server.address[1], concurrency=2, **kwargs)
+	
+	def _run(self, poller, duration=0.5):
+		# a deadlocked poller would never return from run()
+		t = threading.Thread(target=poller.run, args=(duration, ))
+		t.daemon = True
+		t.start()
+		t.join(duration + 5.0)
+		self.assertFalse(t.is_alive(), "poller did not stop")
+	
+	def test_samples(self):
+		poller = self._poller()
+		self._run(poller)
+		stats = poller.stats()
+		self.assertGreaterEqual(stats["polls"], 5)
+		self.assertEqual((stats["poll_errors"], stats["backoff_targets"]), (0, 0))
+		self.assertEqual(stats["samples"], len(self.samples))
+		self.assertEqual(set((sample.name, sample.value, sample.error) for sample in self.samples),
+		                 set([("syNm", "router", None), ("syUT", "1234", None)]))
+		# both properties share an interval, so they are read with one request per poll
+		self.assertEqual(stats["polls"], self.server.stats()["requests"])
+	
+	def test_backoff(self):
+		poller = self._poller(password="wrong", backoff_base=10.0)
+		self._run(poller)
+		stats = poller.stats()
+		self.assertEqual((stats["polls"], stats["poll_errors"], stats["backoff_targets"]), (1, 1, 1))
+		self.assertEqual([sample.name for sample in self.samples], ["syNm", "syUT"])
+		self.assertTrue(all(sample.value is None and sample.error for sample in self.samples))
+	
+	def test_delta_cache(self):
+		poller = self._poller(cache=ACPDeltaCache())
+		rename = threading.Timer(0.25, self.server.set_property, ("syNm", "renamed"))
+		rename.start()
+		self._run(poller)
+		rename.join()
+		
+		self.assertGreaterEqual(poller.stats()["polls"], 5)
+		# only first values and changes are reported
+		self.assertEqual(sorted((sample.name, sample.value) for sample in self.samples),
+		                 [("syNm", "renamed"), ("syNm", "router"), ("syUT", "1234")])
+		self.assertEqual(self.samples[-1].diffs[0].new, "renamed")
+	
+	def test_reentrant_sink(self):
+		stats = []
+		poller = self._poller(callback=lambda sample: stats.append(poller.stats()))
+		self._run(poller)
+		self.assertTrue(stats)
+		self.assertEqual(len(stats), poller.stats()["samples"])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,112 @@
+import time
+import unittest
+
+from acp.message import ACPMessage
+from acp.pool import ACPConnectionPool
+from acp.server import ACPServer
+
+
+def _wait_for(condition, timeout=2.0):
+	deadline = time.time() + timeout
+	while not condition() and time.time() < deadline:
+		time.sleep(0.01)
+	return condition()
+
+
+class ACPConnectionPoolTestCase(unittest.TestCase):
+	def setUp(self):
+		self.server = ACPServer({"syNm": "router"}, password="admin")
+		self.server.start()
+		self.host, self.port = self.server.address
+		self.pool = ACPConnectionPool(timeout=5)
+	
+	def tearDown(self):
+		self.pool.close()
+		self.server.stop()
+	
+	def test_reuse(self):
+		client = self.pool.acquire(self.host, "admin", self.port)
+		self.pool.release(client)
+		self.assertIs(self.pool.acquire(self.host, "admin", self.port), client)
+		self.assertEqual(client.get_properties(["syNm"])[0].value, "router")
+		self.pool.release(client)
+		
+		# a different password is a different key
+		other = self.pool.acquire(self.host, "wrong", self.port)
+		self.assertIsNot(other, client)
+		self.pool.release(other)
+		
+		stats = self.pool.stats()
+		self.assertEqual((stats["hits"], stats["misses"], stats["idle"]), (1, 2, 2))
+		# the server counts connections on its own threads
+		self.assertTrue(_wait_for(lambda: self.server.stats()["connections"] == 2))
+	
+	def test_reuse_false_closes(self):
+		client = self.pool.acquire(self.host, "admin", self.port)
+		self.pool.release(client, reuse=False)
+		self.assertIsNone(client.session.sock)
+		self.assertEqual(self.pool.stats()["idle"], 0)
+	
+	def test_dead_connection(self):
+		client = self.pool.acquire(self.host, "admin", self.port)
+		self.pool.release(client)
+		self.assertTrue(client.session.is_connected())
+		
+		# the server drops clients that send a malformed header
+		client.send("\x00" * ACPMessage.header_size)
+		self.assertTrue(_wait_for(lambda: not client.session.is_connected()))
+		
+		replacement = self.pool.acquire(self.host, "admin", self.port)
+		self.assertIsNot(replacement, client)
+		self.assertIsNone(client.session.sock)
+		self.assertEqual(replacement.get_properties(["syNm"])[0].value, "router")
+		self.pool.release(replacement)
+		stats = self.pool.stats()
+		self.assertEqual((stats["hits"], stats["misses"], stats["evictions"]), (0, 2, 1))
+	
+	def test_idle_ttl(self):
+		self.pool.idle_ttl = 0.2
+		client = self.pool.acquire(self.host, "admin", self.port)
+		self.pool.release(client)
+		self.assertEqual(self.pool.stats()["idle"], 1)
+		
+		# expired clients are closed without waiting for another acquire()
+		self.assertTrue(_wait_for(lambda: client.session.sock is None))
+		stats = self.pool.stats()
+		self.assertEqual((stats["idle"], stats["evictions"]), (0, 1))
+		
+		self.assertIsNot(self.pool.acquire(self.host, "admin", self.port), client)
+	
+	def test_max_idle_per_key(self):
+		self.pool.max_idle_per_key = 2
+		clients = [self.pool.acquire(self.host, "admin", self.port) for i in range(3)]
+		for client in clients:
+			self.pool.release(client)
+		self.assertEqual(self.pool.stats()["idle"], 2)
+		self.assertIsNotNone(clients[0].session.sock)
+		self.assertIsNotNone(clients[1].session.sock)
+		self.assertIsNone(clients[2].session.sock)
+		
+		# the most recently released is handed out first
+		self.assertIs(self.pool.acquire(self.host, "admin", self.port), clients[1])
+	
+	def test_acquire_timeout(self):
+		client = self.pool.acquire(self.host, "admin", self.port, timeout=1)
+		self.assertEqual(client.session.sock.gettimeout(), 1)
+		self.pool.release(client)
+		self.assertEqual(client.session.sock.gettimeout(), 5)
+		
+		self.assertIs(self.pool.acquire(self.host, "admin", self.port, timeout=2), client)
+		self.assertEqual(client.session.sock.gettimeout(), 2)
+		self.pool.release(client)
+	
+	def test_close(self):
+		client = self.pool.acquire(self.host, "admin", self.port)
+		self.pool.release(client)
+		self.pool.close()
+		self.assertIsNone(client.session.sock)
+		self.assertEqual(self.pool.stats()["idle"], 0)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+from acp.exception import ACPPropertyError
+from acp.property import ACPProperty
+
+
+class ACPPropertyElementCodecTestCase(unittest.TestCase):
+	def test_round_trip(self):
+		elements = [("syNm", 0, "router"), ("syUT", 0, "\x00\x00\x00\x2a"), ("raNm", 1, ""), ("syFl", 0, "\xff" * 0x10000)]
+		data = ACPProperty.compose_raw_elements(elements)
+		self.assertEqual(ACPProperty.parse_raw_elements(data), elements)
+	
+	def test_matches_single_element_compose(self):
+		props = [ACPProperty("syNm", "router"), ACPProperty("syUT", 42), ACPProperty("dbug", 7), ACPProperty("raNm")]
+		data = ACPProperty.compose_raw_elements([(prop.name, 0, prop.value) for prop in props])
+		self.assertEqual(data, "".join(ACPProperty.compose_raw_element(0, prop) for prop in props))
+	
+	def test_iterable_elements(self):
+		elements = [("syNm", 0, "router"), ("raNm", 0, "network")]
+		self.assertEqual(ACPProperty.compose_raw_elements(iter(elements)), ACPProperty.compose_raw_elements(elements))
+	
+	def test_int_values(self):
+		data = ACPProperty.compose_raw_elements([("syUT", 0, 0x01020304)])
+		self.assertEqual(data, "syUT\x00\x00\x00\x00\x00\x00\x00\x04\x01\x02\x03\x04")
+	
+	def test_null_values(self):
+		# names are requested with a "null" value
+		data = ACPProperty.compose_raw_elements([("syNm", 0, None)])
+		self.assertEqual(data, "syNm\x00\x00\x00\x00\x00\x00\x00\x04\x00\x00\x00\x00")
+	
+	def test_terminate(self):
+		data = ACPProperty.compose_raw_elements([("syNm", 0, "router")], terminate=True)
+		self.assertTrue(data.endswith(ACPProperty.null_name + "\x00\x00\x00\x00\x00\x00\x00\x04" + ACPProperty.null_value))
+		self.assertEqual(ACPProperty.parse_raw_elements(data + "trailing data"), [("syNm", 0, "router")])
+	
+	def test_offset(self):
+		data = "skip" + ACPProperty.compose_raw_elements([("syNm", 0, "router")])
+		self.assertEqual(ACPProperty.parse_raw_elements(data, 4), [("syNm", 0, "router")])
+	
+	def test_iter_is_lazy(self):
+		data = ACPProperty.compose_raw_elements([("syNm", 0, "router")]) + "truncated"
+		elements = ACPProperty.iter_raw_elements(data)
+		self.assertEqual(next(elements), ("syNm", 0, "router"))
+		with self.assertRaises(ACPPropertyError):
+			next(elements)
+	
+	def test_truncated(self):
+		data = ACPProperty.compose_raw_elements([("syNm", 0, "router")])
+		for size in range(1, len(data)):
+			with self.assertRaises(ACPPropertyError):
+				ACPProperty.parse_raw_elements(data[:size])
+	
+	def test_bad_values(self):
+		with self.assertRaises(ACPPropertyError):
+			ACPProperty.compose_raw_elements([("syNm", 0, 1.5)])
+		with self.assertRaises(ACPPropertyError):
+			ACPProperty.compose_raw_elements([("syUT", 0, -1)])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from acp.exception import ACPPropertyError
+from acp.property import ACPProperty
+from acp.propertybatch import ACPPropertyBatch
+
+
+class ACPPropertyBatchTestCase(unittest.TestCase):
+	def setUp(self):
+		self.batch = ACPPropertyBatch()
+		self.batch.add("10.0.0.1", "syNm", 0, "router")
+		self.batch.add("10.0.0.1", "syUT", 0, "\x00\x00\x04\xd2")
+		self.batch.add("10.0.0.2", "syUT", 0, "\x00\x00\x00\x01")
+		self.batch.add("10.0.0.2", "raNm", 1, "\xff\xff\xff\xf6")
+	
+	def test_records(self):
+		self.assertEqual(list(self.batch.iter_records()), [("10.0.0.1", "syNm", 0, "router"),
+		                                                    ("10.0.0.1", "syUT", 0, 1234),
+		                                                    ("10.0.0.2", "syUT", 0, 1),
+		                                                    ("10.0.0.2", "raNm", 1, "\xff\xff\xff\xf6")])
+		self.assertEqual(str(self.batch.get_raw(1)), "\x00\x00\x04\xd2")
+	
+	def test_find(self):
+		self.assertEqual(self.batch.find("syUT"), [1, 2])
+		self.assertEqual(self.batch.find("syUT", "10.0.0.2"), [2])
+		self.assertEqual(self.batch.find("syUT", "10.0.0.3"), [])
+		self.assertEqual(self.batch.find("waIP"), [])
+	
+	def test_get_property(self):
+		prop = self.batch.get_property(1)
+		self.assertEqual((prop.name, prop.value), ("syUT", 1234))
+	
+	def test_malformed_scalar(self):
+		# a dec value that is not 4 bytes must not read as 0
+		index = self.batch.add("10.0.0.1", "syUT", 0, "\x00\x01")
+		self.assertEqual(self.batch.get_value(index), "\x00\x01")
+		with self.assertRaises(ACPPropertyError):
+			self.batch.get_property(index)
+	
+	def test_add_raw_elements(self):
+		batch = ACPPropertyBatch()
+		batch.add_raw_elements("10.0.0.1", ACPProperty.compose_raw_elements([("syNm", 0, "router"), ("syUT", 0, 5)], terminate=True))
+		self.assertEqual(list(batch.iter_records()), [("10.0.0.1", "syNm", 0, "router"), ("10.0.0.1", "syUT", 0, 5)])
+
+
+if __name__ == "__main__":
+	unittest.main()
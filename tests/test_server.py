@@ -0,0 +1,170 @@
+import sys
+import unittest
+import zlib
+from cStringIO import StringIO
+
+from acp.cflbinary import CFLBinaryPListComposer
+from acp.client import ACPClient
+from acp.exception import *
+from acp.property import ACPProperty
+from acp.server import ACPServer, ACPServerFaults
+
+
+class ACPServerClientTestCase(unittest.TestCase):
+	def setUp(self):
+		self.server = ACPServer({"syNm": "router", "syUT": 1234, "raNm": "network"}, password="admin", features={u"feature": 1})
+		self.server.start()
+		self.client = self._connect("admin")
+	
+	def tearDown(self):
+		self.client.close()
+		self.server.stop()
+	
+	def _connect(self, password):
+		client = ACPClient(self.server.address[0], password)
+		client.connect(self.server.address[1], timeout=5)
+		return client
+	
+	def test_get_properties(self):
+		props = self.client.get_properties(["syNm", "syUT"])
+		self.assertEqual([(prop.name, prop.value) for prop in props], [("syNm", "router"), ("syUT", 1234)])
+	
+	def test_missing_property(self):
+		elements = list(self.client.iter_property_elements(["syNm", "waIP"]))
+		self.assertEqual(elements[0], ("syNm", 0, "router"))
+		self.assertEqual(elements[1][:2], ("waIP", 1))
+	
+	def test_get_properties_batched(self):
+		names = ["syNm", "syUT", "raNm"]
+		for pipeline in [False, True]:
+			props = self.client.get_properties_batched(names, batch_size=2, pipeline=pipeline)
+			self.assertEqual([prop.name for prop in props], names)
+		self.assertEqual(self.server.stats()["requests"], 4)
+	
+	def test_get_properties_batched_split(self):
+		self.server.max_getprop_names = 2
+		props = self.client.get_properties_batched(["syNm", "syUT", "raNm"], batch_size=3)
+		self.assertEqual([prop.name for prop in props], ["syNm", "syUT", "raNm"])
+		# the rejected batch of 3, then its halves
+		self.assertEqual(self.server.stats()["requests"], 3)
+	
+	def test_get_properties_batched_wrong_password(self):
+		client = self._connect("wrong")
+		try:
+			names = ["syNm", "syUT", "raNm"] * 26
+			with self.assertRaises(ACPReplyError):
+				client.get_properties_batched(names, batch_size=32)
+			self.assertEqual(self.server.stats()["requests"], 1)
+			
+			# every request of the pipelined round is read before raising
+			with self.assertRaises(ACPReplyError):
+				client.get_properties_batched(names, batch_size=32, pipeline=True)
+			self.assertEqual(self.server.stats()["requests"], 4)
+			with self.assertRaises(ACPReplyError):
+				client.get_properties_batched(names[:1])
+			self.assertEqual(self.server.stats()["requests"], 5)
+		finally:
+			client.close()
+	
+	def test_set_properties(self):
+		self.client.set_properties({"syNm": ACPProperty("syNm", "renamed")})
+		self.assertEqual(self.server.get_property("syNm"), "renamed")
+		self.assertEqual(self.client.get_properties(["syNm"])[0].value, "renamed")
+	
+	def test_wrong_password(self):
+		client = self._connect("wrong")
+		try:
+			with self.assertRaises(ACPReplyError):
+				list(client.iter_property_elements(["syNm"]))
+		finally:
+			client.close()
+	
+	def test_get_features(self):
+		self.assertEqual(self.client.get_features(), {u"feature": 1})
+	
+	def test_flash_primary(self):
+		flashed = []
+		self.server.flash_handler = lambda *args: flashed.append(args)
+		image = "".join(chr(i & 0xff) for i in range(0x30000))
+		self.client.flash_primary(image)
+		self.client.flash_primary_stream(StringIO(image), chunk_size=0x7000)
+		self.assertEqual(flashed, [(3, len(image), zlib.adler32(image))] * 2)
+		# the connection is still in sync
+		self.assertEqual(self.client.get_properties(["syNm"])[0].value, "router")
+	
+	def test_sink(self):
+		value = CFLBinaryPListComposer.compose({u"blob": "\x01" * 0x20000})
+		self.server.set_property("dSpn", value)
+		chunks = []
+		sink = lambda name, chunk: chunks.append((name, chunk.tobytes()))
+		elements = list(self.client.iter_property_elements(["syNm", "dSpn"], sink=sink, sink_threshold=0x100))
+		self.assertEqual(elements, [("syNm", 0, "router"), ("dSpn", 0, None)])
+		self.assertGreater(len(chunks), 1)
+		self.assertEqual(set(name for name, chunk in chunks), set(["dSpn"]))
+		self.assertEqual("".join(chunk for name, chunk in chunks), value)
+	
+	def test_abandoned_reply(self):
+		self.server.set_property("dSpn", CFLBinaryPListComposer.compose({u"blob": "\x01" * 0x20000}))
+		elements = self.client.iter_property_elements(["syNm", "dSpn", "raNm"])
+		self.assertEqual(next(elements), ("syNm", 0, "router"))
+		elements.close()
+		# the rest of the reply was drained, so the connection is still in sync
+		self.assertEqual(self.client.get_properties(["raNm"])[0].value, "network")
+		
+		for prop in self.client.iter_properties(["syNm", "dSpn", "raNm"]):
+			break
+		self.assertEqual(self.client.get_properties(["syUT"])[0].value, 1234)
+		self.assertEqual(self.server.stats()["connections"], 1)
+	
+	def test_abandoned_reply_drain_failure(self):
+		self.server.set_property("raNm", "x" * 0x40000)
+		elements = self.client.iter_property_elements(["syNm", "raNm"])
+		self.assertEqual(next(elements), ("syNm", 0, "router"))
+		self.client.session.abort()
+		
+		# the generator is closed by garbage collection, which would only print an exception
+		stderr = sys.stderr
+		sys.stderr = StringIO()
+		try:
+			del elements
+			output = sys.stderr.getvalue()
+		finally:
+			sys.stderr = stderr
+		self.assertEqual(output, "")
+		self.assertIsNone(self.client.session.sock)
+	
+	def test_connection_reuse(self):
+		for i in range(10):
+			self.client.get_properties(["syNm"])
+		self.assertEqual(self.server.stats()["connections"], 1)
+		self.assertEqual(self.server.stats()["requests"], 10)
+
+
+class ACPServerFaultsTestCase(unittest.TestCase):
+	def _get_elements(self, **faults):
+		with ACPServer({"syNm": "router"}, faults=ACPServerFaults(seed=1, **faults)) as server:
+			client = ACPClient(server.address[0])
+			client.connect(server.address[1], timeout=5)
+			try:
+				return list(client.iter_property_elements(["syNm"]))
+			finally:
+				client.close()
+	
+	def test_bad_checksum(self):
+		with self.assertRaises(ACPMessageError):
+			self._get_elements(bad_checksum=1.0)
+	
+	def test_error(self):
+		with self.assertRaises(ACPReplyError):
+			self._get_elements(error=1.0, error_code=-5)
+	
+	def test_element_error(self):
+		self.assertEqual(self._get_elements(element_error=1.0, error_code=-5), [("syNm", 1, "\xff\xff\xff\xfb")])
+	
+	def test_truncate(self):
+		with self.assertRaises((ACPError, ACPPropertyError)):
+			self._get_elements(truncate=1.0)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,207 @@
+import socket
+import threading
+import time
+import unittest
+
+from acp.exception import *
+from acp.session import ACPClientSession
+
+
+class _SmallBufferSession(ACPClientSession):
+	_recv_buffer_size = 0x10
+
+
+class ACPSessionTestCase(unittest.TestCase):
+	session_class = ACPClientSession
+	
+	def setUp(self):
+		self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.listener.bind(("127.0.0.1", 0))
+		self.listener.listen(4)
+		self.session = self.session_class("127.0.0.1", "")
+		self.session.connect(self.listener.getsockname()[1], timeout=5)
+		self.peer, _ = self.listener.accept()
+	
+	def tearDown(self):
+		self.session.close()
+		self.peer.close()
+		self.listener.close()
+	
+	def _send_later(self, data):
+		thread = threading.Thread(target=self.peer.sendall, args=(data,))
+		thread.daemon = True
+		thread.start()
+		return thread
+
+
+class ACPSessionBufferTestCase(ACPSessionTestCase):
+	def test_read_ahead(self):
+		self.peer.sendall("header" + "body")
+		self.assertEqual(self.session.recv(6), "header")
+		# the rest is already buffered
+		self.assertEqual(self.session._recv_end - self.session._recv_start, 4)
+		self.assertFalse(self.session.is_connected())
+		self.assertEqual(self.session.recv(4), "body")
+		self.assertTrue(self.session.is_connected())
+	
+	def test_recv_view(self):
+		self.peer.sendall("abcdef")
+		view = self.session.recv_view(3)
+		self.assertIsInstance(view, memoryview)
+		self.assertEqual(view.tobytes(), "abc")
+		self.assertEqual(self.session.recv_view(3).tobytes(), "def")
+		with self.assertRaises(ValueError):
+			self.session.recv_view(self.session._recv_buffer_size + 1)
+	
+	def test_eof(self):
+		self.peer.sendall("abc")
+		self.peer.close()
+		self.assertEqual(self.session.recv(4), "abc")
+		self.assertEqual(self.session.recv(4), "")
+	
+	def test_bulk_bypass(self):
+		size = self.session._recv_buffer_size * 3 + 5
+		data = "".join(chr(i % 251) for i in xrange(size))
+		thread = self._send_later(data)
+		self.assertEqual(self.session.recv(5), data[:5])
+		# reads larger than the buffer take what is buffered and then bypass it
+		self.assertEqual(self.session.recv(size - 5), data[5:])
+		self.assertEqual((self.session._recv_start, self.session._recv_end), (0, 0))
+		thread.join()
+	
+	def test_bulk_bypass_eof(self):
+		size = self.session._recv_buffer_size * 2
+		thread = self._send_later("x" * (size - 1))
+		thread.join()
+		self.peer.close()
+		self.assertEqual(self.session.recv(size), "x" * (size - 1))
+
+
+class ACPSessionSmallBufferTestCase(ACPSessionTestCase):
+	session_class = _SmallBufferSession
+	
+	def test_compaction(self):
+		self.peer.sendall("0123456789ab")
+		self.assertEqual(self.session.recv(10), "0123456789")
+		self.assertEqual((self.session._recv_start, self.session._recv_end), (10, 12))
+		
+		# 12 more bytes don't fit behind the unread tail, which is moved to the front first
+		self.peer.sendall("cdefghijkl")
+		self.assertEqual(self.session.recv(12), "abcdefghijkl")
+		self.assertEqual((self.session._recv_start, self.session._recv_end), (12, 12))
+	
+	def test_no_compaction_when_it_fits(self):
+		self.peer.sendall("0123")
+		self.assertEqual(self.session.recv(2), "01")
+		self.peer.sendall("45")
+		self.assertEqual(self.session.recv(4), "2345")
+		self.assertEqual((self.session._recv_start, self.session._recv_end), (6, 6))
+	
+	def test_bulk_bypass(self):
+		self.peer.sendall("0123456789")
+		self.assertEqual(self.session.recv(4), "0123")
+		self.peer.sendall("abcdefghijklmnopqrstuvwxyz")
+		self.assertEqual(self.session.recv(32), "456789abcdefghijklmnopqrstuvwxyz")
+		self.assertEqual((self.session._recv_start, self.session._recv_end), (0, 0))
+
+
+class ACPSessionTimeoutTestCase(ACPSessionTestCase):
+	def _trickle(self, data, interval):
+		def send():
+			try:
+				for c in data:
+					self.peer.sendall(c)
+					time.sleep(interval)
+			except socket.error:
+				pass
+		thread = threading.Thread(target=send)
+		thread.daemon = True
+		thread.start()
+		return thread
+	
+	def test_first_byte_timeout(self):
+		begin = time.time()
+		with self.assertRaises(ACPFirstByteTimeoutError):
+			self.session.recv(4, timeout=5, first_byte_timeout=0.1)
+		self.assertLess(time.time() - begin, 1.0)
+	
+	def test_single_deadline(self):
+		with self.assertRaises(ACPFirstByteTimeoutError):
+			self.session.recv_view(4, first_byte_timeout=0.1)
+		self.peer.sendall("a")
+		with self.assertRaises(ACPRecvTimeoutError) as context:
+			self.session.recv(4, timeout=0.1)
+		self.assertNotIsInstance(context.exception, ACPFirstByteTimeoutError)
+	
+	def test_buffered_data_counts_as_first_byte(self):
+		self.peer.sendall("abc")
+		self.assertEqual(self.session.recv(1), "a")
+		with self.assertRaises(ACPRecvTimeoutError) as context:
+			self.session.recv(4, timeout=0.2, first_byte_timeout=0.1)
+		self.assertNotIsInstance(context.exception, ACPFirstByteTimeoutError)
+	
+	def test_total_timeout(self):
+		# every byte arrives well within the socket timeout, but the whole read does not
+		self._trickle("x" * 100, 0.02)
+		begin = time.time()
+		with self.assertRaises(ACPRecvTimeoutError):
+			self.session.recv(100, timeout=0.3, first_byte_timeout=0.1)
+		self.assertLess(time.time() - begin, 1.0)
+	
+	def test_total_timeout_bulk(self):
+		size = self.session._recv_buffer_size + 1
+		self._trickle("x" * 10, 0.02)
+		with self.assertRaises(ACPRecvTimeoutError):
+			self.session.recv(size, timeout=0.3)
+	
+	def test_completes_within_timeout(self):
+		self._trickle("abcd", 0.02)
+		self.assertEqual(self.session.recv(4, timeout=5, first_byte_timeout=1), "abcd")
+	
+	def test_socket_timeout(self):
+		self.session.sock.settimeout(0.1)
+		with self.assertRaises(ACPRecvTimeoutError):
+			self.session.recv(4)
+	
+	def test_send_timeout(self):
+		self.session.sock.settimeout(0.1)
+		# the peer never reads, so the socket buffers fill up
+		with self.assertRaises(ACPSendTimeoutError):
+			self.session.send("x" * 0x4000000)
+	
+	def test_connect_timeout(self):
+		listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		listener.bind(("127.0.0.1", 0))
+		listener.listen(0)
+		fillers = []
+		try:
+			# fill the accept queue, further connections then hang instead of being refused
+			for i in range(16):
+				try:
+					fillers.append(socket.create_connection(listener.getsockname(), 0.2))
+				except socket.timeout:
+					break
+			else:
+				self.skipTest("accept queue does not fill up on this platform")
+			
+			session = ACPClientSession("127.0.0.1", "")
+			begin = time.time()
+			with self.assertRaises(ACPConnectTimeoutError):
+				session.connect(listener.getsockname()[1], timeout=5, connect_timeout=0.2)
+			self.assertLess(time.time() - begin, 1.0)
+		finally:
+			for filler in fillers:
+				filler.close()
+			listener.close()
+	
+	def test_connect_timeout_keeps_io_timeout(self):
+		session = ACPClientSession("127.0.0.1", "")
+		session.connect(self.listener.getsockname()[1], timeout=3, connect_timeout=1)
+		try:
+			self.assertEqual(session.sock.gettimeout(), 3)
+		finally:
+			session.close()
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from acp.propertybatch import ACPPropertyBatch
+from acp.snapshot import *
+
+
+class ACPSnapshotTestCase(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, "routers.snapshot")
+	
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+	
+	def _write(self):
+		batch = ACPPropertyBatch()
+		batch.add("10.0.0.2", "syUT", 0, "\x00\x00\x00\x01")
+		batch.add("10.0.0.2", "raNm", 1, "\xff\xff\xff\xf6")
+		with ACPSnapshotWriter(self.path) as writer:
+			# added out of order, records are sorted by target then name
+			writer.add("10.0.0.1", "syUT", 0, "\x00\x00\x04\xd2")
+			writer.add("10.0.0.1", "syNm", 0, "router")
+			writer.add_batch(batch)
+			writer.add("10.0.0.10", "syNm", 0, "")
+			self.assertEqual(len(writer), 5)
+	
+	def test_round_trip(self):
+		self._write()
+		with ACPSnapshotReader(self.path) as reader:
+			self.assertEqual(len(reader), 5)
+			self.assertEqual(reader.targets, ["10.0.0.1", "10.0.0.2", "10.0.0.10"])
+			self.assertEqual(reader.names, ["syUT", "syNm", "raNm"])
+			self.assertEqual(list(reader.iter_records()), [("10.0.0.1", "syNm", 0, "router"),
+			                                               ("10.0.0.1", "syUT", 0, "\x00\x00\x04\xd2"),
+			                                               ("10.0.0.10", "syNm", 0, ""),
+			                                               ("10.0.0.2", "raNm", 1, "\xff\xff\xff\xf6"),
+			                                               ("10.0.0.2", "syUT", 0, "\x00\x00\x00\x01")])
+	
+	def test_find(self):
+		self._write()
+		with ACPSnapshotReader(self.path) as reader:
+			self.assertEqual(list(reader.find(target="10.0.0.2")), [3, 4])
+			self.assertEqual(reader.find(name="syUT"), [1, 4])
+			self.assertEqual(reader.find(target="10.0.0.1", name="syUT"), [1])
+			self.assertEqual(reader.find(target="10.0.0.1", name="raNm"), [])
+			self.assertEqual(list(reader.find(target="10.0.0.3")), [])
+			self.assertEqual(reader.find(name="waIP"), [])
+			self.assertEqual(list(reader.find()), range(5))
+			self.assertEqual([record[3] for record in reader.iter_records(name="syNm")], ["router", ""])
+	
+	def test_values(self):
+		self._write()
+		with ACPSnapshotReader(self.path) as reader:
+			raw = reader.get_raw(0)
+			self.assertIsInstance(raw, buffer)
+			self.assertEqual(str(raw), "router")
+			
+			prop = reader.get_property(1)
+			self.assertEqual((prop.name, prop.value), ("syUT", 1234))
+			with self.assertRaises(ACPSnapshotError):
+				reader.get_property(3)
+			with self.assertRaises(IndexError):
+				reader.get_record(5)
+	
+	def test_empty(self):
+		with ACPSnapshotWriter(self.path):
+			pass
+		with ACPSnapshotReader(self.path) as reader:
+			self.assertEqual(len(reader), 0)
+			self.assertEqual(list(reader.iter_records()), [])
+	
+	def test_writer_error(self):
+		with self.assertRaises(ValueError):
+			with ACPSnapshotWriter(self.path) as writer:
+				writer.add("10.0.0.1", "syNm", 0, "router")
+				raise ValueError()
+		self.assertFalse(os.path.exists(self.path))
+	
+	def test_malformed(self):
+		self._write()
+		with open(self.path, "rb") as f:
+			data = f.read()
+		
+		for bad_data in ["", data[:10], data[:-4], "XXXX" + data[4:], data[:4] + "\x00\x00\x00\x02" + data[8:]]:
+			with open(self.path, "wb") as f:
+				f.write(bad_data)
+			with self.assertRaises(ACPSnapshotError):
+				ACPSnapshotReader(self.path)
+
+
+if __name__ == "__main__":
+	unittest.main()